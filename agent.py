@@ -2,53 +2,48 @@ import warnings
 warnings.filterwarnings("ignore")
 
 import os
-import traceback
+import time
+_import_started = time.perf_counter()
 import asyncio
-import json
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph, END
 from typing import List, Optional, Dict, Any
 
 # --- FastAPI & Server Imports ---
 import uvicorn
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from agent_helpers.cosmos_db import CosmosDB
 
 # --- Local Imports ---
-from agent_helpers.tools import VectorStore, web_search, run_python_analysis, generate_chart
-from agent_helpers.types import AgentState, WorkItem, print_tree, Hypothesis, Analysis
+from agent_helpers.tools import VectorStore, aweb_search, aweb_search_results, arun_python_analysis, agenerate_chart
+from agent_helpers.charts import CHART_FORMATS, chart_service
+from agent_helpers.python_pool import python_pool
+from agent_helpers.types import AgentState, WorkItem, Hypothesis, Analysis
+from agent_helpers.tree import replace_tree
 from agent_helpers.research import ResearchAgent
 from agent_helpers.strat import StrategistAgent
+from agent_helpers.runs import RunManager
+from agent_helpers.batch import BATCH_MAX_ITEMS, BatchManager
+from agent_helpers.scheduler import QueueFullError, admission_controller, admission_identity, trusted_caller
+from agent_helpers.frontier import RunBudget, FRONTIERS, budget_exhausted
+from agent_helpers.json_stream import PARSE_STATS
+from agent_helpers.research_store import set_research_embeddings, release_research_store
+from agent_helpers.semantic_cache import set_cache_embeddings, breakdown_cache, classification_cache
+from agent_helpers.incremental import RESTART_MODE, RESTART_MODES, set_incremental_embeddings
+from agent_helpers.shared_cache import install_llm_cache
+from agent_helpers.loop_monitor import loop_monitor
+from agent_helpers.metrics import get_run_trace, render_metrics, traced, traced_node
+from agent_helpers import profiling
+from agent_helpers.logs import get_logger
+from agent_helpers.serialize import FastJSONResponse, sse_frame
+from agent_helpers.sse import event_stream_response
+from agent_helpers.transfer import EXPORT_COMPRESSIONS, export_stream, import_stream
 
 load_dotenv()
 
-from dataclasses import asdict, is_dataclass
-
-def _to_jsonable(obj):
-    """Best-effort conversion to purely JSON-serializable structures."""
-    if obj is None:
-        return None
-    if isinstance(obj, (str, int, float, bool)):
-        return obj
-    if isinstance(obj, dict):
-        return {k: _to_jsonable(v) for k, v in obj.items()}
-    if isinstance(obj, (list, tuple, set)):
-        return [_to_jsonable(v) for v in obj]
-    # pydantic v2
-    if hasattr(obj, "model_dump") and callable(getattr(obj, "model_dump")):
-        return _to_jsonable(obj.model_dump())
-    # pydantic v1
-    if hasattr(obj, "dict") and callable(getattr(obj, "dict")):
-        return _to_jsonable(obj.dict())
-    # dataclass
-    if is_dataclass(obj):
-        return _to_jsonable(asdict(obj))
-    # fallback
-    return str(obj)
+logger = get_logger("server")
 
 # ============================================================
 # SETUP & INITIALIZATION
@@ -56,37 +51,74 @@ def _to_jsonable(obj):
 
 # 1. Load LLM
 def load_llm():
+    if FAKE_PROVIDERS:
+        from agent_helpers.fakes import FakeChatModel
+        logger.info("[Startup] FAKE_PROVIDERS=1: using deterministic fake LLM, search and memory")
+        return FakeChatModel()
     try:
         if "OPENAI_API_KEY" not in os.environ:
-            print("CRITICAL: OPENAI_API_KEY missing.")
+            logger.critical("OPENAI_API_KEY missing.")
             return None
         
         # Sanitize key to remove potential newlines from copy-paste
         os.environ["OPENAI_API_KEY"] = os.environ["OPENAI_API_KEY"].strip()
         
-        return ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+        from langchain_openai import ChatOpenAI
+        # stream_usage so streamed completions still report tokens for run budgets
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0.7, stream_usage=True)
     except Exception as e:
-        print(f"Error loading LLM: {e}")
+        logger.error(f"Error loading LLM: {e}")
         return None
 
-llm = load_llm()
-
 # 2. Initialize Globals
+# Populated by initialize_agents() during startup, not at import, so the server
+# starts listening immediately and reports readiness separately from liveness
+llm = None
 agent_tools = {}
 agents = {}
 agent_app = None # The compiled graph
-
-# 3. Initialize Tools & Agents (Run immediately so Server has them)
-if llm:
+READINESS = {"ready": False, "stage": "starting", "error": None, "init_seconds": None}
+ready_event = asyncio.Event()
+# How long /run_agent waits for a cold worker to finish initializing
+INIT_WAIT_SECONDS = float(os.environ.get("INIT_WAIT_SECONDS", 60))
+
+# Deterministic stand-ins for OpenAI, Tavily and agent memory (benchmarks, load tests)
+FAKE_PROVIDERS = os.environ.get("FAKE_PROVIDERS") == "1"
+
+# "batch" classifies all queued siblings in one LLM call, "single" one node per call
+CLASSIFY_MODE = os.environ.get("CLASSIFY_MODE", "batch")
+
+# 3. Initialize Tools & Agents
+def initialize_agents():
+    """Builds the LLM, tools, agents and graph. Blocking; run it off the event loop."""
+    global llm, agent_app
+    llm = load_llm()
+    if not llm:
+        return
     try:
-        print("Initializing Tools & Agents...")
-        agent_tools["vector_store"] = VectorStore()
-        agent_tools["web_search"] = web_search
-        agent_tools["python_repl"] = run_python_analysis
-        agent_tools["chart_gen"] = generate_chart
+        logger.info("Initializing Tools & Agents...")
+        install_llm_cache()
+        if FAKE_PROVIDERS:
+            from agent_helpers import fakes
+            agent_tools["vector_store"] = fakes.FakeVectorStore()
+        else:
+            agent_tools["vector_store"] = VectorStore()
+        # Research snippets are embedded with the same model as agent memory
+        set_research_embeddings(agent_tools["vector_store"].embeddings)
+        set_cache_embeddings(agent_tools["vector_store"].embeddings)
+        set_incremental_embeddings(agent_tools["vector_store"].embeddings)
+        agent_tools["web_search"] = aweb_search # Async so run cancellation interrupts in-flight searches
+        agent_tools["web_search_results"] = aweb_search_results
+        if FAKE_PROVIDERS:
+            agent_tools["web_search"] = fakes.fake_web_search
+            agent_tools["web_search_results"] = fakes.fake_web_search_results
+        agent_tools["web_search"] = traced("web_search")(agent_tools["web_search"])
+        agent_tools["web_search_results"] = traced("web_search")(agent_tools["web_search_results"])
+        agent_tools["python_repl"] = arun_python_analysis # Sandboxed worker pool, safe to await from nodes
+        agent_tools["chart_gen"] = agenerate_chart # Rendered in a process pool, cached by content hash
         
         # Pass web_search to Strategist for "Research First" logic
-        agents["strategist"] = StrategistAgent(llm, agent_tools["web_search"])
+        agents["strategist"] = StrategistAgent(llm, agent_tools["web_search_results"])
         
         # Pass all tools to Researcher
         agents["researcher"] = ResearchAgent(
@@ -96,10 +128,13 @@ if llm:
             agent_tools["python_repl"],
             agent_tools["chart_gen"]
         )
-        print("Agents Initialized Successfully.")
+        logger.info("Agents Initialized Successfully.")
+
+        agent_app = build_graph()
+        logger.info("Graph Compiled Successfully.")
     except Exception as e:
-        print(f"Failed to initialize agents: {e}")
-        traceback.print_exc()
+        logger.exception(f"Failed to initialize agents: {e}")
+        READINESS["error"] = str(e)
 
 # ============================================================
 # GRAPH LOGIC
@@ -110,20 +145,22 @@ def start_process(state: AgentState) -> dict:
     existing_tree = state.get("existing_tree")
     restart_node_id = state.get("restart_node_id")
     parent_node_id = state.get("parent_node_id")
+    usage = {"started_at": time.time(), "tokens": 0}
     
     # --- LOGIC TO HANDLE RESTART / EDIT ---
     if existing_tree and restart_node_id:
-        print(f"--- Restarting from node {restart_node_id} ---")
+        logger.info(f"--- Restarting from node {restart_node_id} ---")
         
         # 1. Find the node to restart in the input tree (which contains the EDITED text)
         restart_node_input = next((n for n in existing_tree if n["id"] == restart_node_id), None)
         if not restart_node_input:
-            print(f"Warning: Restart node {restart_node_id} not found. Starting fresh.")
+            logger.warning(f"Restart node {restart_node_id} not found. Starting fresh.")
             return {
-                "hypothesis_tree": [],
+                "hypothesis_tree": replace_tree([]),
                 "nodes_to_process": [],
                 "explainability_log": [f"Restart failed: Node not found. Starting fresh: {problem}"],
-                "last_completed_item_id": None
+                "last_completed_item_id": None,
+                "usage": usage
             }
             
         # 2. Identify all descendants (the entire subtree below the edited node)
@@ -138,7 +175,7 @@ def start_process(state: AgentState) -> dict:
                 descendants.add(child)
                 queue.append(child)
         
-        print(f"   [Restart] Pruning {len(descendants)} descendants to regenerate subtree.")
+        logger.info(f"[Restart] Pruning {len(descendants)} descendants to regenerate subtree.")
         
         # 3. Filter the tree: Keep everything EXCEPT the descendants
         nodes_to_keep = [n for n in existing_tree if n["id"] not in descendants]
@@ -152,7 +189,7 @@ def start_process(state: AgentState) -> dict:
                 updated_node["is_leaf"] = False
                 updated_node["children_ids"] = [] # Clear old children links
                 nodes_to_keep[i] = updated_node
-                print(f"   [Restart] Updated node {restart_node_id} with new text: '{updated_node['text'][:50]}...'")
+                logger.info(f"[Restart] Updated node {restart_node_id} with new text: '{updated_node['text'][:50]}...'")
                 break
         
         # 4b. Reconstruct children_ids for all kept nodes to prevent false orphans
@@ -166,32 +203,42 @@ def start_process(state: AgentState) -> dict:
             if pid and pid != "0" and pid in node_map:
                 node_map[pid]["children_ids"].append(n["id"])
         
+        # 4c. Incremental mode keeps the pruned subtree so matching branches can be grafted back
+        incremental = (state.get("restart_mode") or RESTART_MODE) == "incremental"
+        graft_candidates = [dict(n) for n in existing_tree if n["id"] in descendants] if incremental else []
+
         # 5. Create a WorkItem to force the agent to process this node again
         # Determine action: Root (depth 1) -> breakdown, Sub-nodes -> classify/breakdown
         depth = len(restart_node_id.split('.'))
         if restart_node_input.get("parent_id") == "0":
              action = "breakdown"
+        elif graft_candidates:
+             action = "breakdown" # It had children before; break it down again and reuse what still matches
         else:
              action = "classify" # Always re-classify edited nodes to check if they should be leaves
               
         new_work_item = WorkItem(id=restart_node_id, action=action)
         
-        print(f"   [Restart] Tree reset. Queuing {restart_node_id} for {action}.")
+        logger.info(f"[Restart] Tree reset. Queuing {restart_node_id} for {action}.")
+        usage["base_nodes"] = len(nodes_to_keep)
         
         return {
-            "hypothesis_tree": nodes_to_keep,
+            "hypothesis_tree": replace_tree(nodes_to_keep),
             "analyses_needed": [],
             "nodes_to_process": [new_work_item],
             "explainability_log": [f"Refining analysis from node {restart_node_id}: {restart_node_input['text'][:30]}..."],
-            "last_completed_item_id": None
+            "last_completed_item_id": None,
+            "usage": usage,
+            "graft_candidates": graft_candidates
         }
 
     return {
-        "hypothesis_tree": [],
+        "hypothesis_tree": replace_tree([]),
         "analyses_needed": [],
         "nodes_to_process": [],
         "explainability_log": [f"Problem statement defined: {problem}"],
-        "last_completed_item_id": None
+        "last_completed_item_id": None,
+        "usage": usage
     }
 
 def wait_for_approval(state: AgentState):
@@ -210,13 +257,25 @@ def ensure_completion(state: AgentState) -> dict:
     tree = state.get("hypothesis_tree", [])
     queue = state.get("nodes_to_process", [])
     queue_ids = {item["id"] for item in queue}
+
+    # Out of budget: stop expanding and return the partial tree as it stands
+    exhausted = budget_exhausted(state)
+    if exhausted:
+        closed = [dict(node, is_leaf=True, status="truncated") for node in tree
+                  if not node["is_leaf"] and len(node.get("children_ids", [])) == 0]
+        logger.info(f"[Budget] {exhausted}. Closing {len(closed)} open nodes.")
+        return {
+            "hypothesis_tree": closed,
+            "nodes_to_process": [],
+            "explainability_log": [f"Run budget exhausted ({exhausted}). Returning the best tree so far; {len(closed)} open points were not expanded."]
+        }
     
     new_work_items = []
     
     for node in tree:
         # Condition: Not a leaf, has no children, and not currently queued
         if not node["is_leaf"] and len(node.get("children_ids", [])) == 0 and node["id"] not in queue_ids:
-            print(f"[Safety] Found orphaned node {node['id']}. Re-queueing.")
+            logger.warning(f"[Safety] Found orphaned node {node['id']}. Re-queueing.")
             
             # Force breakdown for stuck nodes
             action = "breakdown"
@@ -234,7 +293,7 @@ def ensure_completion(state: AgentState) -> dict:
     return {}
 
 def route_action(state: AgentState) -> str:
-    if not state["nodes_to_process"]:
+    if not state["nodes_to_process"] or budget_exhausted(state):
         return "ensure_completion"
 
     next_item = state["nodes_to_process"][0]
@@ -279,19 +338,25 @@ def check_restart(state: AgentState) -> str:
             
     return "formulate_top_hypothesis"
 
-def build_graph():
+def build_graph(checkpointer=None):
     if not agents:
         raise RuntimeError("Agents not initialized. Check logs for setup errors.")
 
+    from langgraph.graph import StateGraph, END
     workflow = StateGraph(AgentState)
-    
-    workflow.add_node("start_process", start_process)
-    workflow.add_node("formulate_top_hypothesis", agents["strategist"].formulate_top_hypothesis)
-    workflow.add_node("breakdown_hypothesis", agents["strategist"].breakdown_hypothesis)
-    workflow.add_node("classify_hypothesis", agents["researcher"].classify_hypothesis)
-    workflow.add_node("ensure_completion", ensure_completion)
-    workflow.add_node("wait_for_approval", wait_for_approval)
-    workflow.add_node("compile_report", compile_report)
+    classify = agents["researcher"].classify_batch if CLASSIFY_MODE == "batch" else agents["researcher"].classify_hypothesis
+    nodes = {
+        "start_process": start_process,
+        "formulate_top_hypothesis": agents["strategist"].formulate_top_hypothesis,
+        "breakdown_hypothesis": agents["strategist"].breakdown_hypothesis,
+        "classify_hypothesis": classify,
+        "ensure_completion": ensure_completion,
+        "wait_for_approval": wait_for_approval,
+        "compile_report": compile_report,
+    }
+    # Every node is timed and traced (see agent_helpers/metrics.py)
+    for name, fn in nodes.items():
+        workflow.add_node(name, traced_node(name, fn))
 
     workflow.set_entry_point("start_process")
 
@@ -328,21 +393,16 @@ def build_graph():
     workflow.add_edge("wait_for_approval", "compile_report")
     workflow.add_edge("compile_report", END)
     
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
-# Compile the graph immediately on startup
-try:
-    if llm:
-        agent_app = build_graph()
-        print("Graph Compiled Successfully.")
-except Exception as e:
-    print(f"Graph compilation failed: {e}")
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 # ============================================================
 # SERVER & STREAMING LOGIC
 # ============================================================
 
-app = FastAPI()
+# Routes that return large trees return FastJSONResponse directly to skip jsonable_encoder
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -359,73 +419,120 @@ class AgentInput(BaseModel):
     restart_node_id: Optional[str] = None
     root_id_offset: int = 0
     parent_node_id: Optional[str] = None
+    base_run_id: Optional[str] = None # Reuse the checkpointed tree of a previous run instead of existing_tree
+    user_id: Optional[str] = None # Fairness key for run slots; only honoured with X-Scheduler-Token
+    priority: int = 0 # Higher runs first when the run queue is backed up; only lowered without X-Scheduler-Token
+    frontier: Optional[str] = None # Expansion order: "fifo" or "best_first"
+    budget: Optional[Dict[str, Any]] = None # RunBudget overrides: max_tokens, max_seconds, max_nodes, max_depth, max_children; only tightened without X-Scheduler-Token
+    restart_mode: Optional[str] = None # "full" regenerates the edited subtree, "incremental" reuses unchanged branches
+
+def build_event_payload(node_name: str, state_update: Any, inputs: dict) -> dict:
+    """Turns one graph update into the SSE payload the frontend consumes."""
+    # Graph updates are plain dicts; the payload is encoded once, by the RunManager
+    update = state_update if isinstance(state_update, dict) else {}
+
+    completed_id = update.get("last_completed_item_id")
+    logs = list(update.get("explainability_log") or [])
+
+    # Synthetic log step
+    synthetic = f"Step: {node_name}" + (f" for {completed_id}" if completed_id else "")
+    logs.append(synthetic)
+
+    activity = {
+        "node": node_name,
+        "item_id": completed_id,
+        "status": "done" if completed_id else "working"
+    }
 
-async def real_agent_generator(input_data: AgentInput):
-    if not agent_app:
-        yield f"data: {json.dumps({'explainability_log': ['Error: Agent not initialized.']})}\n\n"
-        return
+    # Save tree to CosmosDB if scratchpad exists (batch runs save only their final tree)
+    current_tree = update.get("hypothesis_tree")
+    scratchpad_id = inputs.get("scratchpad_id")
+    if current_tree and scratchpad_id and inputs.get("save_tree") != "final":
+        try:
+            CosmosDB().save_tree_state(scratchpad_id, current_tree)
+        except Exception as e:
+            logger.error(f"[System] Failed to save tree state: {e}")
 
-    inputs = {
-        "problem_statement": input_data.problem_statement,
-        "scratchpad_id": input_data.scratchpad_id,
-        "existing_tree": input_data.existing_tree,
-        "restart_node_id": input_data.restart_node_id,
-        "root_id_offset": input_data.root_id_offset,
-        "parent_node_id": input_data.parent_node_id
+    return {
+        "hypothesis_tree": current_tree or [],
+        "explainability_log": logs,
+        "last_completed_item_id": completed_id,
+        "activity": activity,
     }
 
-    try:
-        async for output in agent_app.astream(inputs, config={"recursion_limit": 50}):
-            for node_name, state_update in output.items():
-                safe = _to_jsonable(state_update) or {}
+# Runs execute as background tasks with checkpointed state so they survive dropped connections
+run_manager = RunManager(build_graph, build_event_payload, on_finish=release_research_store)
+batch_manager = BatchManager(run_manager, save_tree=lambda scratchpad_id, tree: CosmosDB().save_tree_state(scratchpad_id, tree))
 
-                completed_id = safe.get("last_completed_item_id")
-                logs = list(safe.get("explainability_log") or [])
-                
-                # Synthetic log step
-                synthetic = f"Step: {node_name}" + (f" for {completed_id}" if completed_id else "")
-                logs.append(synthetic)
-
-                activity = {
-                    "node": node_name,
-                    "item_id": completed_id,
-                    "status": "done" if completed_id else "working"
-                }
-
-                # Save tree to CosmosDB if scratchpad exists
-                current_tree = safe.get("hypothesis_tree")
-                if current_tree and input_data.scratchpad_id:
-                    try:
-                        CosmosDB().save_tree_state(input_data.scratchpad_id, current_tree)
-                    except Exception as e:
-                        print(f"[System] Failed to save tree state: {e}")
-
-                payload = {
-                    "hypothesis_tree": current_tree or [],
-                    "explainability_log": logs,
-                    "last_completed_item_id": completed_id,
-                    "activity": activity,
-                }
-
-                # SSE Format: data: {json}\n\n
-                yield f"data: {json.dumps(_to_jsonable(payload))}\n\n"
-
-        yield "data: [DONE]\n\n"
+_warm_up_task = None
+
+@app.on_event("startup")
+async def start_run_manager():
+    # Heavy initialization runs in the background so the server answers liveness probes immediately
+    global _warm_up_task
+    loop_monitor.start()
+    _warm_up_task = asyncio.create_task(warm_up())
 
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        READINESS["stage"] = "agents"
+        await asyncio.to_thread(initialize_agents)
+        if agents:
+            READINESS["stage"] = "run_manager"
+            await run_manager.startup()
+            await batch_manager.startup()
+            READINESS["stage"] = "python_pool"
+            try:
+                await python_pool.start()
+            except Exception as e:
+                # Not fatal: code execution retries the spawn on first use
+                logger.error(f"[Startup] Python worker pool failed to start: {e}")
+        # Resolve the Cosmos container now rather than on the first user request
+        READINESS["stage"] = "storage"
+        await asyncio.to_thread(lambda: CosmosDB().enabled)
+        READINESS["ready"] = run_manager.graph is not None
+        READINESS["stage"] = "ready" if READINESS["ready"] else "failed"
     except Exception as e:
-        error_msg = f"Agent Runtime Error: {str(e)}"
-        print(error_msg)
-        traceback.print_exc()
-        yield f"data: {json.dumps({'explainability_log': [error_msg], 'activity': {'node': 'error', 'status': 'done'}})}\n\n"
+        logger.exception(f"[Startup] Initialization failed: {e}")
+        READINESS["stage"] = "failed"
+        READINESS["error"] = str(e)
+    finally:
+        READINESS["init_seconds"] = round(time.perf_counter() - started, 3)
+        logger.info(f"[Startup] Imports took {IMPORT_SECONDS:.2f}s, initialization {READINESS['init_seconds']:.2f}s ({READINESS['stage']})")
+        ready_event.set()
+
+@app.on_event("shutdown")
+async def stop_run_manager():
+    await loop_monitor.stop()
+    await batch_manager.shutdown()
+    await run_manager.shutdown()
+    await python_pool.shutdown()
+    chart_service.shutdown()
+
+async def agent_error_stream(message: str):
+    yield sse_frame({'explainability_log': [message]})
 
 # ============================================================
 # HEALTH CHECK
 # ============================================================
 
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving. Never depends on downstream services."""
+    return {"status": "alive", "import_seconds": round(IMPORT_SECONDS, 3)}
+
+@app.get("/health/ready")
+async def readiness():
+    """200 once agents, graph and workers are initialized; 503 while warming up or if that failed."""
+    body = dict(READINESS, import_seconds=round(IMPORT_SECONDS, 3))
+    return FastJSONResponse(body, status_code=200 if READINESS["ready"] else 503)
+
 @app.get("/health")
 async def health_check():
     return {
         "status": "ok" if agent_app else "error",
+        "stage": READINESS["stage"],
         "agent_initialized": agent_app is not None,
         "llm_initialized": llm is not None,
         "openai_key_present": "OPENAI_API_KEY" in os.environ,
@@ -478,7 +585,7 @@ async def create_scratchpad(req: ScratchpadRequest):
 @app.get("/scratchpads/{scratchpad_id}/tree")
 async def get_scratchpad_tree(scratchpad_id: str):
     tree = CosmosDB().load_tree_state(scratchpad_id)
-    return {"tree": tree}
+    return FastJSONResponse({"tree": tree})
 
 class TreeSaveRequest(BaseModel):
     tree: List[Dict[str, Any]]
@@ -489,7 +596,7 @@ async def save_scratchpad_tree(scratchpad_id: str, req: TreeSaveRequest):
         CosmosDB().save_tree_state(scratchpad_id, req.tree)
         return {"success": True}
     except Exception as e:
-        print(f"Failed to save tree: {e}")
+        logger.error(f"Failed to save tree: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================
@@ -531,7 +638,7 @@ async def upload_document(scratchpad_id: str, request: Request):
         
         return {"success": True, "document": doc}
     except Exception as e:
-        print(f"Document upload error: {e}")
+        logger.error(f"Document upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/scratchpads/{scratchpad_id}/documents")
@@ -545,13 +652,259 @@ async def delete_document(document_id: str):
         raise HTTPException(status_code=500, detail="Failed to delete document")
     return {"success": True}
 
+# ============================================================
+# EXPORT / IMPORT
+# ============================================================
+
+@app.get("/export/{user_id}")
+async def export_user_data(user_id: str, compression: Optional[str] = None, continuation: Optional[str] = None):
+    """Streams the user's scratchpads, trees, documents and chunks as NDJSON (see agent_helpers/transfer.py)."""
+    if compression not in EXPORT_COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported compression '{compression}'")
+    media_type, extension = EXPORT_COMPRESSIONS[compression]
+    return StreamingResponse(export_stream(user_id, continuation, compression), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="export-{user_id}{extension}"'})
+
+@app.post("/import")
+async def import_user_data(request: Request, user_id: Optional[str] = None):
+    """Upserts an NDJSON export from the request body; `user_id` reassigns the scratchpads' owner."""
+    try:
+        return await import_stream(request.stream(), request.headers.get("content-encoding"), user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def validate_input(input_data: AgentInput, trusted: bool = False):
+    if input_data.frontier and input_data.frontier not in FRONTIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown frontier '{input_data.frontier}'")
+    if input_data.restart_mode and input_data.restart_mode not in RESTART_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown restart mode '{input_data.restart_mode}'")
+    try:
+        RunBudget.for_caller(input_data.budget, trusted)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def run_inputs(input_data: AgentInput, trusted: bool = False) -> dict:
+    """Graph inputs for a run; resolves `base_run_id` to that run's checkpointed tree."""
+    existing_tree = input_data.existing_tree
+    if existing_tree is None and input_data.base_run_id:
+        existing_tree = await run_manager.load_tree(input_data.base_run_id)
+        if existing_tree is None:
+            raise HTTPException(status_code=404, detail="Base run not found")
+    return {
+        "problem_statement": input_data.problem_statement,
+        "scratchpad_id": input_data.scratchpad_id,
+        "existing_tree": existing_tree,
+        "restart_node_id": input_data.restart_node_id,
+        "root_id_offset": input_data.root_id_offset,
+        "parent_node_id": input_data.parent_node_id,
+        "frontier": input_data.frontier,
+        "budget": RunBudget.for_caller(input_data.budget, trusted).to_dict(),
+        "restart_mode": input_data.restart_mode,
+    }
+
 @app.post("/run_agent")
-async def run_agent(input_data: AgentInput):
-    print(f"\n[Server] Received Request: {input_data.problem_statement[:50]}... (Pad: {input_data.scratchpad_id})")
+async def run_agent(input_data: AgentInput, request: Request):
+    logger.info(f"[Server] Received Request: {input_data.problem_statement[:50]}... (Pad: {input_data.scratchpad_id})")
     if input_data.restart_node_id:
-        print(f"[Server] Restarting from node: {input_data.restart_node_id}")
-        
-    return StreamingResponse(real_agent_generator(input_data), media_type="text/event-stream")
+        logger.info(f"[Server] Restarting from node: {input_data.restart_node_id}")
+
+    if not ready_event.is_set():
+        # A freshly started worker may still be warming up
+        try:
+            await asyncio.wait_for(ready_event.wait(), INIT_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    if not run_manager.graph:
+        return event_stream_response(agent_error_stream("Error: Agent not initialized."), request)
+    trusted = trusted_caller(request)
+    validate_input(input_data, trusted)
+
+    # Opt-in profiling of this run (see agent_helpers/profiling.py)
+    profile_mode = request.headers.get("x-profile")
+    if profile_mode:
+        if not profiling.authorized(request.headers.get("x-profile-token")):
+            raise HTTPException(status_code=403, detail="Profiling requires a valid X-Profile-Token")
+        if profile_mode not in profiling.PROFILE_MODES:
+            raise HTTPException(status_code=400, detail=f"Unknown profile mode '{profile_mode}'")
+    else:
+        profile_mode = profiling.take_armed_mode()
+
+    inputs = await run_inputs(input_data, trusted)
+    user, priority = admission_identity(request, input_data.user_id, input_data.priority)
+    try:
+        run = run_manager.start(dict(inputs, profile=profile_mode), user_id=user, priority=priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info(f"[Server] Started run {run.id}")
+
+    headers = {"X-Run-Id": run.id}
+    if profile_mode:
+        headers["X-Profile-Url"] = f"/runs/{run.id}/profile"
+    return event_stream_response(run_manager.stream(run.id, request=request), request, headers)
+
+@app.get("/runs/queue")
+async def get_run_queue():
+    return admission_controller.stats()
+
+@app.get("/stats/parsing")
+async def get_parse_stats():
+    """LLM output parse outcomes (parsed / repaired / failed) per parser and schema."""
+    return PARSE_STATS
+
+@app.get("/charts/{name}")
+async def get_chart(name: str):
+    """Serves a rendered chart. Names are content hashes, so responses never change."""
+    path = chart_service.path_for(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Chart not found")
+    return FileResponse(path, media_type=CHART_FORMATS[name.rsplit(".", 1)[1]],
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    """Semantic result cache hit rates and sizes."""
+    return {"breakdown": breakdown_cache.stats(), "classification": classification_cache.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus exposition: node/step latency, tokens, cost, cache hits, runs."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/runs/{run_id}/trace")
+async def get_run_trace_endpoint(run_id: str):
+    """Seconds per node, step and hypothesis, plus tokens, cost and cache hits for one run."""
+    trace = get_run_trace(run_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace for this run")
+    return FastJSONResponse(trace)
+
+@app.get("/runs/{run_id}/profile")
+async def get_run_profile(run_id: str, request: Request):
+    """Downloads a run's profile: folded stacks (sample) or pstats (cpu / wall)."""
+    if not profiling.authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Profile-Token")
+    path = profiling.profile_path(run_id) if await run_manager.get(run_id) else None
+    if not path:
+        raise HTTPException(status_code=404, detail="No profile for this run")
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+
+class ProfileRequest(BaseModel):
+    mode: str = "sample"
+    runs: int = 1
+
+@app.post("/admin/profile")
+async def arm_profiling(body: ProfileRequest, request: Request):
+    """Profiles the next `runs` runs on this worker, for clients that can't send X-Profile."""
+    if not profiling.authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Profile-Token")
+    if body.mode not in profiling.PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile mode '{body.mode}'")
+    profiling.arm(body.mode, body.runs)
+    return profiling.profile_status()
+
+@app.get("/admin/profile")
+async def get_profiling_status(request: Request):
+    if not profiling.authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Profile-Token")
+    return profiling.profile_status()
+
+@app.get("/stats/loop")
+async def get_loop_stats(reset: bool = False):
+    """Event loop lag percentiles; `?reset=true` starts a new measurement window after reporting."""
+    stats = loop_monitor.stats()
+    if reset:
+        loop_monitor.reset()
+    return stats
+
+@app.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    run = await run_manager.get(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run.summary()
+
+@app.get("/runs/{run_id}/events")
+async def stream_run_events(run_id: str, request: Request, last_event_id: int = 0):
+    """Resumes a run's event stream; `Last-Event-ID` (or ?last_event_id=) skips events already seen."""
+    if not await run_manager.get(run_id):
+        raise HTTPException(status_code=404, detail="Run not found")
+
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    return event_stream_response(run_manager.stream(run_id, last_event_id, request=request), request, {"X-Run-Id": run_id})
+
+@app.post("/runs/{run_id}/cancel")
+async def cancel_run(run_id: str):
+    run = await run_manager.get(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    if not run_manager.cancel(run_id):
+        return {"success": False, "status": run.status}
+    return {"success": True, "status": "cancelling"}
+
+# ============================================================
+# BATCH JOBS
+# ============================================================
+
+class BatchRequest(BaseModel):
+    items: List[AgentInput]
+    user_id: Optional[str] = None
+
+@app.post("/batch")
+async def submit_batch(req: BatchRequest, request: Request):
+    """Runs many problem statements unattended at batch priority; see agent_helpers/batch.py."""
+    if not run_manager.graph:
+        raise HTTPException(status_code=503, detail="Agent not initialized")
+    if not req.items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(req.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per job")
+    trusted = trusted_caller(request)
+    for item in req.items:
+        validate_input(item, trusted)
+    items = [dict(await run_inputs(item, trusted), user_id=admission_identity(request, item.user_id or req.user_id)[0])
+             for item in req.items]
+    job = batch_manager.submit(items, user_id=req.user_id)
+    return {
+        "job_id": job.id,
+        "items": len(items),
+        "status_url": f"/batch/{job.id}",
+        "progress_url": f"/batch/{job.id}/stream",
+        "results_url": f"/batch/{job.id}/results",
+    }
+
+def _get_job(job_id: str):
+    job = batch_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return job
+
+@app.get("/batch/{job_id}")
+async def get_batch(job_id: str):
+    job = _get_job(job_id)
+    return dict(job.summary(), results=job.results)
+
+@app.get("/batch/{job_id}/stream")
+async def stream_batch(job_id: str):
+    """NDJSON: one line per item as it finishes, then the job summary."""
+    _get_job(job_id)
+    return StreamingResponse(batch_manager.stream(job_id), media_type="application/x-ndjson")
+
+@app.get("/batch/{job_id}/results")
+async def get_batch_results(job_id: str, include_tree: bool = True):
+    """NDJSON: one line per item in input order, with its final hypothesis tree."""
+    _get_job(job_id)
+    return StreamingResponse(batch_manager.results(job_id, include_tree), media_type="application/x-ndjson")
+
+@app.post("/batch/{job_id}/cancel")
+async def cancel_batch(job_id: str):
+    job = _get_job(job_id)
+    if not batch_manager.cancel(job_id):
+        return {"success": False, "status": job.status}
+    return {"success": True, "status": "cancelling"}
 
 class ImageRequest(BaseModel):
     prompt: str
@@ -562,7 +915,7 @@ async def generate_image(req: ImageRequest):
         if not llm:
             raise HTTPException(status_code=500, detail="OpenAI API Key missing")
             
-        print(f"[Server] Generating image for: {req.prompt[:50]}...")
+        logger.debug(f"[Server] Generating image for: {req.prompt[:50]}...")
         from openai import OpenAI
         client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
         
@@ -576,23 +929,19 @@ async def generate_image(req: ImageRequest):
         return {"url": response.data[0].url}
         
     except Exception as e:
-        print(f"Image generation failed: {e}")
+        logger.error(f"Image generation failed: {e}")
         return {"url": "https://images.unsplash.com/photo-1620641788421-7a1c342ea42e?q=80&w=1974&auto=format&fit=crop"}
 
 if __name__ == "__main__":
-    print("\n" + "="*60)
-    if agent_app:
-        print("STARTING PRODUCTION AGENT SERVER")
-        print("Endpoint: http://localhost:8000/run_agent")
-        print("Agent Graph: COMPILED")
-    else:
-        print("STARTING SERVER (WARNING: Agent Failed to Initialize)")
-        if "OPENAI_API_KEY" not in os.environ:
-            print("ERROR: OPENAI_API_KEY environment variable is missing!")
-        else:
-            print("ERROR: Check logs for initialization failures.")
-            
-    print("="*60)
+    logger.info("Starting production agent server. Endpoint: http://localhost:8000/run_agent")
+    logger.info("Agent Graph: initializing in the background (see /health/ready)")
+    if "OPENAI_API_KEY" not in os.environ:
+        logger.error("OPENAI_API_KEY environment variable is missing!")
     
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        # Each worker imports the app itself; see gunicorn_conf.py for the production setup
+        uvicorn.run("agent:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
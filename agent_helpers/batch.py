@@ -0,0 +1,355 @@
+"""
+Batch Jobs
+
+Runs many problem statements unattended, e.g. overnight. A job's items are
+ordinary runs on the RunManager, so they share its checkpointing, the
+admission queue, the semantic / research / shared caches and the provider
+rate limits with interactive traffic. They are queued at BATCH_PRIORITY,
+below interactive runs, and at most BATCH_CONCURRENCY batch runs (across all
+jobs) are queued or executing at once, so a large job can't flood the queue.
+
+When a run finishes, its final tree is saved once through `save_tree`, and
+not on every event as interactive runs do. Each item's outcome is recorded
+in the run database. Progress and results are served as NDJSON; a worker
+asked for the progress of another worker's job polls the database every
+BATCH_POLL_SECONDS. Finished jobs are dropped from memory after
+RUN_RETENTION_SECONDS and served from the database after that.
+
+Jobs survive restarts. On startup, a job whose worker process has died is
+picked up again: finished items are kept, runs the RunManager resumed are
+awaited, and items that never started are started.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from agent_helpers.runs import RUN_RETENTION_SECONDS, RunManager, RunRecord, _process_alive, process_start
+from agent_helpers.scheduler import MAX_CONCURRENT_RUNS, QueueFullError
+from agent_helpers.serialize import dumps
+from agent_helpers.logs import get_logger
+
+# Batch runs queued or executing at once, across all jobs. Defaults to every run slot:
+# batch work fills idle capacity, and interactive runs still go first in the queue.
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", MAX_CONCURRENT_RUNS))
+BATCH_PRIORITY = int(os.environ.get("BATCH_PRIORITY", -10))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+# Wait before retrying when the run queue is full
+BATCH_RETRY_SECONDS = float(os.environ.get("BATCH_RETRY_SECONDS", 5))
+# How often progress of a job owned by another worker is read from the database
+BATCH_POLL_SECONDS = float(os.environ.get("BATCH_POLL_SECONDS", 2))
+
+JOB_FINISHED_STATUSES = ("done", "cancelled")
+
+logger = get_logger("batch")
+
+
+class BatchJob:
+    """In-memory view of a job: its items' inputs and per-item results."""
+
+    def __init__(self, job_id: str, items: List[dict], user_id: Optional[str] = None, status: str = "running",
+                 results: List[dict] = None, created_at: str = None, updated_at: str = None):
+        self.id = job_id
+        self.items = items
+        self.user_id = user_id
+        self.status = status
+        self.created_at = created_at or datetime.datetime.utcnow().isoformat()
+        self.updated_at = updated_at or self.created_at
+        self.results: List[dict] = results or [{"index": i, "status": "pending"} for i in range(len(items))]
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Condition()
+        # Indices in the order they finished, for progress streams
+        self.completion_order: List[int] = [r["index"] for r in self.results if r["status"] in ("done", "error", "cancelled")]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JOB_FINISHED_STATUSES
+
+    def summary(self) -> dict:
+        counts: Dict[str, int] = {}
+        for result in self.results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        completed = len(self.completion_order)
+        ended = datetime.datetime.fromisoformat(self.updated_at) if self.finished else datetime.datetime.utcnow()
+        elapsed = (ended - datetime.datetime.fromisoformat(self.created_at)).total_seconds()
+        done = counts.get("done", 0)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "items": len(self.items),
+            "completed": completed,
+            "counts": counts,
+            "created_at": self.created_at,
+            "runs_per_hour": round(done / elapsed * 3600, 1) if done and elapsed > 0 else None,
+        }
+
+
+class BatchManager:
+    """
+    Executes batch jobs on a RunManager. `save_tree(scratchpad_id, tree)` persists
+    a finished run's tree (it is called in a worker thread).
+    """
+
+    def __init__(self, run_manager: RunManager, save_tree: Callable[[str, list], Any]):
+        self.run_manager = run_manager
+        self.save_tree = save_tree
+        self.jobs: Dict[str, BatchJob] = {}
+        self._slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+        self._closing = False
+
+        with run_manager.db_lock:
+            db = run_manager.db
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                " id TEXT PRIMARY KEY, status TEXT, user_id TEXT, created_at TEXT, updated_at TEXT, owner INTEGER)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batch_items ("
+                " job_id TEXT, idx INTEGER, inputs TEXT, result TEXT, PRIMARY KEY (job_id, idx))"
+            )
+            # Start time of the owner process, so a reused pid is not taken for it
+            try:
+                db.execute("ALTER TABLE batch_jobs ADD COLUMN owner_started INTEGER")
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+            db.commit()
+
+    @property
+    def db(self):
+        return self.run_manager.db
+
+    @property
+    def db_lock(self):
+        return self.run_manager.db_lock
+
+    # --- LIFECYCLE ---
+    async def startup(self):
+        """Picks up jobs left unfinished by a worker process that is no longer running."""
+        with self.db_lock:
+            rows = self.db.execute("SELECT id, owner, owner_started FROM batch_jobs WHERE status = 'running'").fetchall()
+        for job_id, owner, owner_started in rows:
+            if owner is not None and owner != os.getpid() and _process_alive(owner, owner_started):
+                continue
+            with self.db_lock:
+                cursor = self.db.execute("UPDATE batch_jobs SET owner = ?, owner_started = ? WHERE id = ? AND owner IS ?",
+                                         (os.getpid(), process_start(os.getpid()), job_id, owner))
+                self.db.commit()
+            if cursor.rowcount != 1:
+                continue
+            job = self._load(job_id)
+            logger.info(f"[Batch] Resuming job {job_id} ({len(job.completion_order)}/{len(job.items)} items done)")
+            self.jobs[job_id] = job
+            job.task = asyncio.create_task(self._run_job(job))
+
+    async def shutdown(self):
+        """Stops job tasks without marking anything finished; the jobs resume on next startup."""
+        self._closing = True
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+
+    # --- JOBS ---
+    def submit(self, items: List[dict], user_id: Optional[str] = None) -> BatchJob:
+        """Starts a job over the given run inputs."""
+        job = BatchJob(str(uuid.uuid4()), items, user_id)
+        now = job.created_at
+        with self.db_lock:
+            self.db.execute(
+                "INSERT INTO batch_jobs (id, status, user_id, created_at, updated_at, owner, owner_started)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.status, user_id, now, now, os.getpid(), process_start(os.getpid())),
+            )
+            self.db.executemany(
+                "INSERT INTO batch_items (job_id, idx, inputs, result) VALUES (?, ?, ?, ?)",
+                [(job.id, i, dumps(inputs), dumps(job.results[i])) for i, inputs in enumerate(items)],
+            )
+            self.db.commit()
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run_job(job))
+        logger.info(f"[Batch] Started job {job.id} with {len(items)} items")
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        """A job from this process, or a read-only view of one from the database."""
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        return self._load(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job.finished or not job.task:
+            return False
+        job.task.cancel()
+        return True
+
+    async def stream(self, job_id: str) -> AsyncIterator[str]:
+        """
+        NDJSON progress: a line per item as it finishes (including those finished
+        before the request), then a final line with the job summary. A job run
+        by another worker is followed through the database; if that worker
+        has died, the stream ends with the summary so far.
+        """
+        job = self.get(job_id)
+        cursor = 0
+        while True:
+            for index in job.completion_order[cursor:]:
+                yield dumps(dict(job.results[index], type="item")) + "\n"
+            cursor = len(job.completion_order)
+            if job.finished:
+                yield dumps(dict(job.summary(), type="job")) + "\n"
+                return
+            live = self.jobs.get(job_id)
+            if live is not None:
+                # Picked up by this worker (or still owned by it); follow it in memory
+                job = live
+                async with job.changed:
+                    await job.changed.wait_for(lambda: len(job.completion_order) > cursor or job.finished)
+                continue
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+            fresh, owner_alive = await asyncio.to_thread(self._load_with_owner, job_id)
+            for index, result in enumerate(fresh.results):
+                if index in fresh.completion_order and index not in job.completion_order:
+                    job.completion_order.append(index)
+            job.results, job.status, job.updated_at = fresh.results, fresh.status, fresh.updated_at
+            if not job.finished and not owner_alive:
+                yield dumps(dict(job.summary(), type="job", owner_gone=True)) + "\n"
+                return
+
+    async def results(self, job_id: str, include_tree: bool = True) -> AsyncIterator[str]:
+        """NDJSON with one line per item in input order, with its final tree from the run checkpoint."""
+        job = self.get(job_id)
+        for result in job.results:
+            line = dict(result, problem_statement=job.items[result["index"]].get("problem_statement"))
+            if include_tree and result.get("run_id") and result["status"] == "done":
+                line["hypothesis_tree"] = await self.run_manager.load_tree(result["run_id"]) or []
+            yield dumps(line) + "\n"
+
+    # --- INTERNALS ---
+    async def _run_job(self, job: BatchJob):
+        pending = [r["index"] for r in job.results if r["index"] not in job.completion_order]
+        workers = [asyncio.create_task(self._run_item(job, index)) for index in pending]
+        try:
+            await asyncio.gather(*workers)
+            await self._set_job_status(job, "done")
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if not self._closing:
+                await self._set_job_status(job, "cancelled")
+            raise
+        finally:
+            summary = job.summary()
+            logger.info(f"[Batch] Job {job.id} {job.status}: {summary['counts']} ({summary['runs_per_hour']} runs/hour)")
+            if job.finished:
+                # Results stay in the database; only drop the in-memory copy
+                asyncio.get_event_loop().call_later(RUN_RETENTION_SECONDS, self.jobs.pop, job.id, None)
+
+    async def _run_item(self, job: BatchJob, index: int):
+        result = job.results[index]
+        run_id = result.get("run_id")
+        record = await self.run_manager.get(run_id) if run_id else None
+        started = time.monotonic()
+        try:
+            # A run the RunManager resumed after a restart is already executing; just wait for it
+            if record is None or not (record.finished or (record.task and not record.task.done())):
+                async with self._slots:
+                    record = await self._start_run(job, index)
+                    await self._finish_item(job, index, record, started)
+            else:
+                await self._finish_item(job, index, record, started)
+        except asyncio.CancelledError:
+            if not self._closing:
+                if record:
+                    self.run_manager.cancel(record.id, "Batch job cancelled")
+                await self._record(job, index, dict(job.results[index], status="cancelled"))
+            raise
+        except Exception as e:
+            logger.exception(f"[Batch] Item {index} of job {job.id} failed: {e}")
+            await self._record(job, index, dict(result, status="error", error=str(e)))
+
+    async def _start_run(self, job: BatchJob, index: int) -> RunRecord:
+        inputs = job.items[index]
+        while True:
+            try:
+                record = self.run_manager.start(
+                    dict(inputs, batch_job_id=job.id, save_tree="final"),
+                    user_id=inputs.get("user_id") or job.user_id or f"batch:{job.id}",
+                    priority=BATCH_PRIORITY,
+                )
+                break
+            except QueueFullError:
+                await asyncio.sleep(BATCH_RETRY_SECONDS)
+        await self._record(job, index, dict(job.results[index], status="running", run_id=record.id), finished=False)
+        return record
+
+    async def _finish_item(self, job: BatchJob, index: int, record: RunRecord, started: float):
+        if record.task and not record.task.done():
+            # Shielded: cancelling the job cancels the run explicitly, and shutdown leaves it to resume
+            await asyncio.shield(record.task)
+        tree = await self.run_manager.load_tree(record.id) or []
+        inputs = job.items[index]
+        scratchpad_id = inputs.get("scratchpad_id") or f"batch-{job.id}-{index}"
+        if tree and record.status == "done":
+            await asyncio.to_thread(self.save_tree, scratchpad_id, tree)
+        await self._record(job, index, {
+            "index": index,
+            "status": "done" if record.status == "done" else record.status,
+            "run_id": record.id,
+            "scratchpad_id": scratchpad_id,
+            "nodes": len(tree),
+            "leaves": sum(1 for node in tree if node.get("is_leaf")),
+            "seconds": round(time.monotonic() - started, 2),
+            "error": _last_log(record) if record.status == "error" else None,
+        })
+
+    async def _record(self, job: BatchJob, index: int, result: dict, finished: bool = True):
+        job.results[index] = result
+        with self.db_lock:
+            self.db.execute("UPDATE batch_items SET result = ? WHERE job_id = ? AND idx = ?", (dumps(result), job.id, index))
+            self.db.commit()
+        if finished and index not in job.completion_order:
+            job.completion_order.append(index)
+        async with job.changed:
+            job.changed.notify_all()
+
+    async def _set_job_status(self, job: BatchJob, status: str):
+        job.status = status
+        job.updated_at = datetime.datetime.utcnow().isoformat()
+        with self.db_lock:
+            self.db.execute("UPDATE batch_jobs SET status = ?, updated_at = ? WHERE id = ?", (status, job.updated_at, job.id))
+            self.db.commit()
+        async with job.changed:
+            job.changed.notify_all()
+
+    def _load(self, job_id: str) -> Optional[BatchJob]:
+        job, _ = self._load_with_owner(job_id)
+        return job
+
+    def _load_with_owner(self, job_id: str):
+        """The job and whether its owner process is still running (True if it has none)."""
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT status, user_id, created_at, updated_at, owner, owner_started FROM batch_jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if not row:
+                return None, None
+            items = self.db.execute("SELECT inputs, result FROM batch_items WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+        job = BatchJob(job_id, [json.loads(i) for i, _ in items], user_id=row[1], status=row[0],
+                       results=[json.loads(r) for _, r in items], created_at=row[2], updated_at=row[3])
+        return job, row[4] is None or _process_alive(row[4], row[5])
+
+
+def _last_log(record: RunRecord) -> Optional[str]:
+    """The error message a failed run appended to its event log."""
+    for _, data in reversed(record.events):
+        if data.startswith("{"):
+            log = json.loads(data).get("explainability_log") or []
+            return log[-1] if log else None
+    return None
@@ -0,0 +1,207 @@
+"""
+Chart Rendering Service
+
+Charts are drawn with matplotlib's object-oriented `Figure` API (no global
+pyplot state) in a process pool, so many leaves can render concurrently
+without blocking the event loop. Output is content-addressed: the file name is
+a hash of the chart spec, so identical charts are rendered once and concurrent
+runs never overwrite each other. Files are served by GET /charts/{name}.
+
+The directory is bounded: at most once every CHART_PRUNE_INTERVAL_SECONDS, a
+render deletes charts not used for CHART_MAX_AGE_SECONDS, then the least
+recently used ones until the directory is under CHART_DIR_MAX_MB. A cache hit
+counts as a use. Links to a pruned chart in an old tree return 404.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from agent_helpers.metrics import record_cache
+
+CHART_DIR = os.environ.get("CHART_DIR", "charts")
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", 2))
+CHART_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+CHART_MAX_AGE_SECONDS = int(os.environ.get("CHART_MAX_AGE_SECONDS", 7 * 24 * 3600))
+CHART_DIR_MAX_MB = int(os.environ.get("CHART_DIR_MAX_MB", 512))
+CHART_PRUNE_INTERVAL_SECONDS = 60
+
+# "<sha256>.<format>", the only names /charts/{name} will serve
+CHART_NAME = re.compile(r"^[0-9a-f]{64}\.(png|svg)$")
+
+
+@dataclass
+class Chart:
+    digest: str
+    format: str
+    path: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.digest}.{self.format}"
+
+    @property
+    def url(self) -> str:
+        return f"/charts/{self.name}"
+
+    @property
+    def content_type(self) -> str:
+        return CHART_FORMATS[self.format]
+
+
+def chart_digest(data: dict, title: str, fmt: str) -> str:
+    spec = json.dumps({"data": data, "title": title, "format": fmt}, sort_keys=True, default=str)
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+
+def render_chart(data: dict, title: str, fmt: str = "png") -> bytes:
+    """Renders a bar chart to PNG or SVG bytes. Thread- and process-safe."""
+    import io
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.bar([str(k) for k in data.keys()], list(data.values()), color="skyblue")
+    ax.set_title(title)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def prune_charts(chart_dir: str, max_age: float, max_bytes: int, keep: str = None) -> int:
+    """
+    Deletes charts (and stale temp files) last used more than `max_age`
+    seconds ago, then the least recently used until under `max_bytes`.
+    Never deletes `keep`. Returns the number of files deleted.
+    """
+    try:
+        entries = list(os.scandir(chart_dir))
+    except FileNotFoundError:
+        return 0
+    files = []
+    for entry in entries:
+        if not (CHART_NAME.match(entry.name) or entry.name.endswith(".tmp")):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+
+    cutoff = time.time() - max_age
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for mtime, size, path in files:
+        if path == keep or (mtime >= cutoff and total <= max_bytes):
+            continue
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return deleted
+
+
+def _touch(path: str) -> bool:
+    """Marks a chart as used, for pruning. False if it is gone."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _write_atomic(path: str, content: bytes):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class ChartService:
+    def __init__(self, chart_dir: str = CHART_DIR, workers: int = CHART_WORKERS):
+        self.chart_dir = chart_dir
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Renders in progress, so concurrent requests for the same chart share one
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.renders = 0
+        self.cache_hits = 0
+        self.pruned = 0
+        self._last_prune = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def path_for(self, name: str) -> Optional[str]:
+        """Path of a rendered chart by file name, or None if unknown or invalid."""
+        if not CHART_NAME.match(name):
+            return None
+        path = os.path.join(self.chart_dir, name)
+        return path if os.path.exists(path) else None
+
+    async def render(self, data: dict, title: str, fmt: str = "png") -> Chart:
+        if fmt not in CHART_FORMATS:
+            raise ValueError(f"Unsupported chart format '{fmt}'")
+        digest = chart_digest(data, title, fmt)
+        chart = Chart(digest, fmt, os.path.join(self.chart_dir, f"{digest}.{fmt}"))
+
+        if _touch(chart.path):
+            self.cache_hits += 1
+            record_cache("charts", True)
+            return chart
+        if chart.name in self._pending:
+            self.cache_hits += 1
+            record_cache("charts", True)
+            await asyncio.shield(self._pending[chart.name])
+            return chart
+
+        record_cache("charts", False)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[chart.name] = future
+        try:
+            content = await asyncio.get_running_loop().run_in_executor(self._pool(), render_chart, data, title, fmt)
+            os.makedirs(self.chart_dir, exist_ok=True)
+            await asyncio.to_thread(_write_atomic, chart.path, content)
+            self.renders += 1
+            future.set_result(None)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved; waiters re-raise it themselves
+            raise
+        finally:
+            del self._pending[chart.name]
+
+        if time.monotonic() - self._last_prune >= CHART_PRUNE_INTERVAL_SECONDS:
+            self._last_prune = time.monotonic()
+            self.pruned += await asyncio.to_thread(
+                prune_charts, self.chart_dir, CHART_MAX_AGE_SECONDS, CHART_DIR_MAX_MB * 1024 * 1024, chart.path
+            )
+        return chart
+
+    async def render_bytes(self, data: dict, title: str, fmt: str = "png") -> bytes:
+        chart = await self.render(data, title, fmt)
+        return await asyncio.to_thread(_read_bytes, chart.path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+chart_service = ChartService()
@@ -0,0 +1,165 @@
+"""
+Context Assembly
+
+Builds the `{context}` block for a prompt from web results, scratchpad
+documents and agent memory. Snippets are deduplicated, ranked by relevance to
+the hypothesis and packed into a per-prompt token budget, so prompt size (and
+with it latency and cost) stays bounded no matter how much was retrieved.
+"""
+
+import os
+import re
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from agent_helpers.logs import get_logger
+
+# Token budget for the context block of each prompt
+CONTEXT_BUDGETS: Dict[str, int] = {
+    "top_hypothesis": int(os.environ.get("CONTEXT_BUDGET_TOP", 2000)),
+    "breakdown": int(os.environ.get("CONTEXT_BUDGET_BREAKDOWN", 1500)),
+    "classify": int(os.environ.get("CONTEXT_BUDGET_CLASSIFY", 1000)),
+}
+
+# Snippets whose word shingles are this much contained in an earlier snippet are dropped
+DUPLICATE_CONTAINMENT = 0.8
+# Don't bother truncating a snippet into less room than this
+MIN_SNIPPET_TOKENS = 40
+
+_STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was", "one",
+    "our", "out", "has", "have", "his", "how", "its", "may", "new", "now", "see", "who", "did", "get",
+    "this", "that", "with", "from", "they", "will", "would", "there", "their", "what", "about", "which",
+    "when", "were", "been", "into", "than", "then", "them", "these", "those", "such", "more", "most",
+}
+
+_encoder = None
+
+logger = get_logger("context")
+
+
+def _get_encoder():
+    global _encoder, tiktoken
+    if _encoder is None and tiktoken is not None:
+        try:
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # The encoding is downloaded on first use; offline hosts estimate instead
+            logger.warning(f"[Context] tiktoken encoding unavailable ({e}), estimating token counts")
+            tiktoken = None
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, otherwise ~4 characters per token."""
+    if _get_encoder() is not None:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoder is not None:
+        return _encoder.decode(_encoder.encode(text, disallowed_special=())[:max_tokens]) + "..."
+    return text[:max_tokens * 4] + "..."
+
+
+def _terms(text: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 2 and w not in _STOPWORDS]
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _terms(text)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+@dataclass
+class Snippet:
+    text: str
+    label: str  # e.g. "Web: https://...", "Document: report.pdf", "Memory"
+    retrieval_score: Optional[float] = None  # Similarity reported by the retriever, 0-1
+    relevance: float = 0.0
+
+
+class ContextBuilder:
+    """Collects snippets from any source, then `build()`s a ranked, deduplicated, budgeted context."""
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.snippets: List[Snippet] = []
+
+    def add(self, text: str, label: str, retrieval_score: float = None):
+        if text and text.strip():
+            self.snippets.append(Snippet(text.strip(), label, retrieval_score))
+
+    def add_web_results(self, results: list):
+        for res in results or []:
+            if isinstance(res, dict):
+                self.add(res.get("content", ""), f"Web: {res.get('url', 'No URL')}", res.get("score"))
+            else:
+                self.add(str(res), "Web")
+
+    def add_documents(self, results: list):
+        """Cosmos document chunk results ({content, filename, score})."""
+        for res in results or []:
+            if isinstance(res, dict):
+                self.add(res.get("content", ""), f"Document: {res.get('filename', 'document')}", res.get("score"))
+
+    def add_memory(self, contents: List[str]):
+        for content in contents or []:
+            self.add(content, "Memory")
+
+    def _deduplicate(self) -> List[Snippet]:
+        kept: List[Snippet] = []
+        kept_shingles: List[set] = []
+        for snippet in self.snippets:
+            shingles = _shingles(snippet.text)
+            duplicate = False
+            for other in kept_shingles:
+                if shingles and other and len(shingles & other) / min(len(shingles), len(other)) >= DUPLICATE_CONTAINMENT:
+                    duplicate = True
+                    break
+            if not duplicate:
+                kept.append(snippet)
+                kept_shingles.append(shingles)
+        return kept
+
+    def _rank(self, snippets: List[Snippet], query: str) -> List[Snippet]:
+        """Scores snippets by idf-weighted overlap with the query terms, nudged by retriever scores."""
+        query_terms = set(_terms(query))
+        snippet_terms = [set(_terms(s.text)) for s in snippets]
+        n = len(snippets)
+        idf = {t: math.log((n + 1) / (sum(t in terms for terms in snippet_terms) + 1)) + 1 for t in query_terms}
+        total = sum(idf.values()) or 1.0
+
+        for snippet, terms in zip(snippets, snippet_terms):
+            snippet.relevance = sum(idf[t] for t in query_terms & terms) / total
+            if snippet.retrieval_score is not None:
+                snippet.relevance += 0.3 * max(0.0, min(1.0, float(snippet.retrieval_score)))
+        return sorted(snippets, key=lambda s: -s.relevance)
+
+    def build(self, query: str) -> str:
+        ranked = self._rank(self._deduplicate(), query)
+
+        parts = []
+        remaining = self.max_tokens
+        for snippet in ranked:
+            block = f"[{snippet.label}]\n{snippet.text}"
+            cost = count_tokens(block)
+            if cost > remaining:
+                if remaining < MIN_SNIPPET_TOKENS:
+                    break
+                block = truncate_to_tokens(block, remaining)
+                cost = remaining
+            parts.append(block)
+            remaining -= cost
+        return "\n\n".join(parts)
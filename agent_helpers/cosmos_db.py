@@ -1,9 +1,26 @@
 import os
 import uuid
+import asyncio
 import datetime
 import json
-from azure.cosmos import CosmosClient, PartitionKey
-from langchain_openai import OpenAIEmbeddings
+import threading
+
+from agent_helpers.metrics import traced
+from agent_helpers.logs import get_logger
+
+# "0" when the database and container are provisioned out of band; skips create_*_if_not_exists
+COSMOS_AUTO_PROVISION = os.environ.get("COSMOS_AUTO_PROVISION", "1") == "1"
+# Items per page for paged (continuation token) queries
+COSMOS_PAGE_SIZE = int(os.environ.get("COSMOS_PAGE_SIZE", 100))
+
+# Transactional batch limits: operations per batch and request body size
+BATCH_MAX_OPERATIONS = 100
+BATCH_MAX_BYTES = 1_800_000
+
+# Server-managed fields, not part of an item's content
+SYSTEM_FIELDS = ("_rid", "_self", "_etag", "_attachments", "_ts")
+
+logger = get_logger("cosmos")
 
 class CosmosDB:
     _instance = None
@@ -15,60 +32,97 @@ class CosmosDB:
         return cls._instance
 
     def _initialize(self):
+        # Cheap: only reads config. The client, database and container are
+        # resolved on first use (see _connect), so importing or constructing
+        # CosmosDB never makes network calls.
         self.endpoint = os.environ.get("AZURE_COSMOS_ENDPOINT")
         self.key = os.environ.get("AZURE_COSMOS_KEY")
         self.database_name = "AgentKnowledgeDB"
         self.container_name = "UnifiedData" # Stores all data types with vector support
         
         self.client = None
-        self.container = None
-        self.enabled = False
-        self.embeddings = None
+        self._container = None
+        self._enabled = False
+        self._embeddings = None
+        self._connected = False
+        self._connect_lock = threading.Lock()
+
+        if not (self.endpoint and self.key):
+            self._connected = True
+            logger.warning("[CosmosDB] Missing credentials. Running in MOCK mode (logging only).")
+
+    @property
+    def enabled(self):
+        self._connect()
+        return self._enabled
 
-        if self.endpoint and self.key:
+    @property
+    def container(self):
+        self._connect()
+        return self._container
+
+    @property
+    def embeddings(self):
+        self._connect()
+        return self._embeddings
+
+    def _connect(self):
+        if self._connected:
+            return
+        with self._connect_lock:
+            if self._connected:
+                return
+            self._connected = True
             try:
+                from azure.cosmos import CosmosClient, PartitionKey
+                from langchain_openai import OpenAIEmbeddings
+                from agent_helpers.shared_cache import CachedEmbeddings
+
                 self.client = CosmosClient(self.endpoint, self.key)
-                self.database = self.client.create_database_if_not_exists(id=self.database_name)
-                
-                # Unified container with vector search support
-                # Stores all data types: users, scratchpads, interactions, knowledge, documents, chunks
-                # NOTE: Reduced dimensions to 256 to fit within Cosmos DB Free Tier / Serverless limits (max 505)
-                # text-embedding-3-small supports dimension reduction via API
-                vector_embedding_policy = {
-                    "vectorEmbeddings": [
-                        {
-                            "path": "/vector",
-                            "dataType": "float32",
-                            "distanceFunction": "cosine",
-                            "dimensions": 256 
-                        }
-                    ]
-                }
+                if not COSMOS_AUTO_PROVISION:
+                    # Database and container already exist; skip the control-plane round trips
+                    self.database = self.client.get_database_client(self.database_name)
+                    self._container = self.database.get_container_client(self.container_name)
+                else:
+                    self.database = self.client.create_database_if_not_exists(id=self.database_name)
+                    
+                    # Unified container with vector search support
+                    # Stores all data types: users, scratchpads, interactions, knowledge, documents, chunks
+                    # NOTE: Reduced dimensions to 256 to fit within Cosmos DB Free Tier / Serverless limits (max 505)
+                    # text-embedding-3-small supports dimension reduction via API
+                    vector_embedding_policy = {
+                        "vectorEmbeddings": [
+                            {
+                                "path": "/vector",
+                                "dataType": "float32",
+                                "distanceFunction": "cosine",
+                                "dimensions": 256 
+                            }
+                        ]
+                    }
 
-                indexing_policy = {
-                    "indexingMode": "consistent",
-                    "automatic": True,
-                    "includedPaths": [{"path": "/*"}],
-                    "excludedPaths": [{"path": "/\"_etag\"/?"}, {"path": "/vector/*"}],
-                    "vectorIndexes": [{"path": "/vector", "type": "flat"}]
-                }
+                    indexing_policy = {
+                        "indexingMode": "consistent",
+                        "automatic": True,
+                        "includedPaths": [{"path": "/*"}],
+                        "excludedPaths": [{"path": "/\"_etag\"/?"}, {"path": "/vector/*"}],
+                        "vectorIndexes": [{"path": "/vector", "type": "flat"}]
+                    }
 
-                self.container = self.database.create_container_if_not_exists(
-                    id=self.container_name,
-                    partition_key=PartitionKey(path="/type"),
-                    offer_throughput=400,
-                    vector_embedding_policy=vector_embedding_policy,
-                    indexing_policy=indexing_policy
-                )
+                    self._container = self.database.create_container_if_not_exists(
+                        id=self.container_name,
+                        partition_key=PartitionKey(path="/type"),
+                        offer_throughput=400,
+                        vector_embedding_policy=vector_embedding_policy,
+                        indexing_policy=indexing_policy
+                    )
                 
-                self.enabled = True
+                self._enabled = True
                 # Initialize embeddings with reduced dimensions
-                self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small", dimensions=256)
-                print(f"[CosmosDB] Connected to {self.database_name} with unified container")
+                self._embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-3-small", dimensions=256))
+                logger.info(f"[CosmosDB] Connected to {self.database_name} with unified container")
             except Exception as e:
-                print(f"[CosmosDB] Connection failed: {e}")
-        else:
-            print("[CosmosDB] Missing credentials. Running in MOCK mode (logging only).")
+                logger.error(f"[CosmosDB] Connection failed: {e}")
 
     # --- AUTH ---
     def create_user(self, username, password):
@@ -135,6 +189,7 @@ class CosmosDB:
         return items[0] if items else None
 
     # --- LOGGING & KNOWLEDGE ---
+    @traced("cosmos_write")
     def log_interaction(self, agent_name: str, input_data: dict, output_data: dict, scratchpad_id: str = None):
         """Logs an agent's work item."""
         item = {
@@ -154,6 +209,7 @@ class CosmosDB:
             metadata={"type": "interaction", "agent": agent_name, "scratchpad_id": scratchpad_id}
         )
 
+    @traced("cosmos_write")
     def log_search(self, query: str, results: list, scratchpad_id: str = None):
         """Logs a web search query and its results."""
         item = {
@@ -177,13 +233,14 @@ class CosmosDB:
             try:
                 self.container.create_item(body=item)
             except Exception as e:
-                print(f"[CosmosDB] Error saving item: {e}")
+                logger.error(f"[CosmosDB] Error saving item: {e}")
         else:
-            print(f"[CosmosDB Mock] Saved {item['type']} item")
+            logger.debug(f"[CosmosDB Mock] Saved {item['type']} item")
 
+    @traced("cosmos_write")
     def save_knowledge(self, content: str, metadata: dict):
         if not self.enabled or not self.embeddings: 
-            print(f"[CosmosDB Mock] Would vectorize: {content[:50]}...")
+            logger.debug(f"[CosmosDB Mock] Would vectorize: {content[:50]}...")
             return
 
         try:
@@ -197,9 +254,9 @@ class CosmosDB:
                 "timestamp": datetime.datetime.utcnow().isoformat()
             }
             self.container.create_item(body=item)
-            print(f"[CosmosDB] Saved knowledge vector.")
+            logger.debug(f"[CosmosDB] Saved knowledge vector.")
         except Exception as e:
-            print(f"[CosmosDB] Error saving knowledge: {e}")
+            logger.error(f"[CosmosDB] Error saving knowledge: {e}")
 
     def search_knowledge(self, query: str, k: int = 3):
         """
@@ -233,10 +290,11 @@ class CosmosDB:
             # So we will just return empty or basic text search as fallback if vector fails.
             return [] 
         except Exception as e:
-            print(f"[CosmosDB] Vector search error: {e}")
+            logger.error(f"[CosmosDB] Vector search error: {e}")
             return []
 
     # --- DOCUMENT MANAGEMENT ---
+    @traced("cosmos_write")
     def save_document(self, scratchpad_id: str, filename: str, text: str, metadata: dict = None):
         """
         Save a document's metadata and text content
@@ -246,7 +304,7 @@ class CosmosDB:
             metadata = {}
         
         if not self.enabled:
-            print(f"[CosmosDB Mock] Would save document: {filename} for scratchpad {scratchpad_id}")
+            logger.debug(f"[CosmosDB Mock] Would save document: {filename} for scratchpad {scratchpad_id}")
             return {"id": str(uuid.uuid4()), "filename": filename}
         
         doc = {
@@ -261,10 +319,10 @@ class CosmosDB:
         
         try:
             self.container.create_item(body=doc)
-            print(f"[CosmosDB] Saved document: {filename}")
+            logger.info(f"[CosmosDB] Saved document: {filename}")
             return doc
         except Exception as e:
-            print(f"[CosmosDB] Error saving document: {e}")
+            logger.error(f"[CosmosDB] Error saving document: {e}")
             return None
     
     def get_documents(self, scratchpad_id: str):
@@ -285,7 +343,7 @@ class CosmosDB:
     def delete_document(self, document_id: str):
         """Delete a document and its chunks"""
         if not self.enabled:
-            print(f"[CosmosDB Mock] Would delete document: {document_id}")
+            logger.debug(f"[CosmosDB Mock] Would delete document: {document_id}")
             return True
         
         try:
@@ -300,16 +358,17 @@ class CosmosDB:
             for chunk in chunks:
                 self.container.delete_item(item=chunk["id"], partition_key="document_chunk")
             
-            print(f"[CosmosDB] Deleted document and {len(chunks)} chunks")
+            logger.info(f"[CosmosDB] Deleted document and {len(chunks)} chunks")
             return True
         except Exception as e:
-            print(f"[CosmosDB] Error deleting document: {e}")
+            logger.error(f"[CosmosDB] Error deleting document: {e}")
             return False
     
+    @traced("cosmos_write")
     def save_document_chunks(self, scratchpad_id: str, document_id: str, filename: str, chunks: list):
         """Save vectorized chunks for a document"""
         if not self.enabled or not self.embeddings:
-            print(f"[CosmosDB Mock] Would vectorize {len(chunks)} chunks for {filename}")
+            logger.debug(f"[CosmosDB Mock] Would vectorize {len(chunks)} chunks for {filename}")
             return
         
         try:
@@ -330,9 +389,9 @@ class CosmosDB:
                 
                 self.container.create_item(body=chunk_item)
             
-            print(f"[CosmosDB] Saved {len(chunks)} vectorized chunks for {filename}")
+            logger.info(f"[CosmosDB] Saved {len(chunks)} vectorized chunks for {filename}")
         except Exception as e:
-            print(f"[CosmosDB] Error saving chunks: {e}")
+            logger.error(f"[CosmosDB] Error saving chunks: {e}")
     
     def search_documents(self, scratchpad_id: str, query: str, top_k: int = 5):
         """
@@ -340,53 +399,120 @@ class CosmosDB:
         Returns relevant chunks for RAG
         """
         if not self.enabled or not self.embeddings:
-            return [{
-                "content": "Mock document content about the topic",
-                "filename": "mock_document.pdf",
-                "chunk_index": 0,
-                "score": 0.95
-            }]
+            return self._mock_document_results()
         
         try:
             query_vector = self.embeddings.embed_query(query)
-            
-            # Vector Search Query
-            # Note: This requires the container to have a Vector Embedding Policy and Vector Index defined.
-            sql = f"""
-            SELECT TOP {top_k} c.content, c.filename, c.chunk_index, VectorDistance(c.vector, @vector) AS score
+            return self._query_document_chunks(scratchpad_id, query_vector, top_k)
+        except Exception as e:
+            logger.error(f"[CosmosDB] Document search error: {e}")
+            return []
+
+    @traced("doc_search")
+    async def asearch_documents(self, scratchpad_id: str, query: str, top_k: int = 5):
+        """
+        Async variant of search_documents. The embedding call is awaited directly so
+        cancelling the caller aborts it; the Cosmos query runs in a worker thread.
+        """
+        if not self.enabled or not self.embeddings:
+            return self._mock_document_results()
+
+        try:
+            query_vector = await self.embeddings.aembed_query(query)
+            return await asyncio.to_thread(self._query_document_chunks, scratchpad_id, query_vector, top_k)
+        except Exception as e:
+            logger.error(f"[CosmosDB] Document search error: {e}")
+            return []
+
+    def _mock_document_results(self):
+        return [{
+            "content": "Mock document content about the topic",
+            "filename": "mock_document.pdf",
+            "chunk_index": 0,
+            "score": 0.95
+        }]
+
+    def _query_document_chunks(self, scratchpad_id: str, query_vector: list, top_k: int):
+        # Vector Search Query
+        # Note: This requires the container to have a Vector Embedding Policy and Vector Index defined.
+        sql = f"""
+        SELECT TOP {top_k} c.content, c.filename, c.chunk_index, VectorDistance(c.vector, @vector) AS score
+        FROM c 
+        WHERE c.type = 'document_chunk' AND c.scratchpad_id = @scratchpad_id
+        ORDER BY VectorDistance(c.vector, @vector)
+        """
+        params = [
+            {"name": "@scratchpad_id", "value": scratchpad_id},
+            {"name": "@vector", "value": query_vector}
+        ]
+        
+        try:
+            results = list(self.container.query_items(query=sql, parameters=params, enable_cross_partition_query=True))
+            return results
+        except Exception as vec_err:
+            logger.warning(f"[CosmosDB] Vector search failed (likely missing index policy). Falling back to recent items. Error: {vec_err}")
+            # Fallback to recent items
+            sql_fallback = f"""
+            SELECT TOP {top_k} c.content, c.filename, c.chunk_index
             FROM c 
             WHERE c.type = 'document_chunk' AND c.scratchpad_id = @scratchpad_id
-            ORDER BY VectorDistance(c.vector, @vector)
+            ORDER BY c.timestamp DESC
             """
-            params = [
-                {"name": "@scratchpad_id", "value": scratchpad_id},
-                {"name": "@vector", "value": query_vector}
-            ]
-            
-            try:
-                results = list(self.container.query_items(query=sql, parameters=params, enable_cross_partition_query=True))
-                return results
-            except Exception as vec_err:
-                print(f"[CosmosDB] Vector search failed (likely missing index policy). Falling back to recent items. Error: {vec_err}")
-                # Fallback to recent items
-                sql_fallback = f"""
-                SELECT TOP {top_k} c.content, c.filename, c.chunk_index
-                FROM c 
-                WHERE c.type = 'document_chunk' AND c.scratchpad_id = @scratchpad_id
-                ORDER BY c.timestamp DESC
-                """
-                params_fallback = [{"name": "@scratchpad_id", "value": scratchpad_id}]
-                return list(self.container.query_items(query=sql_fallback, parameters=params_fallback, enable_cross_partition_query=True))
-            
-        except Exception as e:
-            print(f"[CosmosDB] Document search error: {e}")
-            return []
+            params_fallback = [{"name": "@scratchpad_id", "value": scratchpad_id}]
+            return list(self.container.query_items(query=sql_fallback, parameters=params_fallback, enable_cross_partition_query=True))
+
+    # --- BULK TRANSFER ---
+    def query_pages(self, query: str, params: list, partition_key: str, continuation: str = None,
+                    page_size: int = COSMOS_PAGE_SIZE):
+        """
+        Yields (items, continuation) one page at a time, so only a page is held in
+        memory. The continuation token resumes the query after that page (None
+        after the last one).
+        """
+        pages = self.container.query_items(query=query, parameters=params, partition_key=partition_key,
+                                           max_item_count=page_size).by_page(continuation)
+        for page in pages:
+            items = [{k: v for k, v in item.items() if k not in SYSTEM_FIELDS} for item in page]
+            yield items, pages.continuation_token
+
+    def bulk_upsert(self, partition_key: str, items: list) -> int:
+        """
+        Upserts items that share a partition key, as transactional batches of up
+        to BATCH_MAX_OPERATIONS items. Items too large for a batch, or every item
+        on SDKs without batch support, are upserted one by one. Returns the count.
+        """
+        if not self.enabled:
+            logger.debug(f"[CosmosDB Mock] Would upsert {len(items)} {partition_key} items")
+            return len(items)
+
+        from agent_helpers.serialize import dumps_bytes
+
+        if not hasattr(self.container, "execute_item_batch"):
+            for item in items:
+                self.container.upsert_item(body=item)
+            return len(items)
+
+        batch, batch_bytes = [], 0
+        for item in items:
+            size = len(dumps_bytes(item))
+            if size > BATCH_MAX_BYTES:
+                self.container.upsert_item(body=item)
+                continue
+            if len(batch) == BATCH_MAX_OPERATIONS or batch_bytes + size > BATCH_MAX_BYTES:
+                self.container.execute_item_batch(batch_operations=batch, partition_key=partition_key)
+                batch, batch_bytes = [], 0
+            batch.append(("upsert", (item,)))
+            batch_bytes += size
+        if batch:
+            self.container.execute_item_batch(batch_operations=batch, partition_key=partition_key)
+        return len(items)
 
     # --- HYPOTHESIS TREE PERSISTENCE ---
+    @traced("cosmos_write")
     def save_tree_state(self, scratchpad_id: str, hypothesis_tree: list):
         """Save the current hypothesis tree state for a scratchpad"""
         if not self.enabled:
-            print(f"[CosmosDB Mock] Would save tree with {len(hypothesis_tree)} nodes for scratchpad {scratchpad_id}")
+            logger.debug(f"[CosmosDB Mock] Would save tree with {len(hypothesis_tree)} nodes for scratchpad {scratchpad_id}")
             return
         
         try:
@@ -408,14 +534,14 @@ class CosmosDB:
             }
             
             self.container.create_item(body=tree_item)
-            print(f"[CosmosDB] Saved hypothesis tree with {len(hypothesis_tree)} nodes")
+            logger.info(f"[CosmosDB] Saved hypothesis tree with {len(hypothesis_tree)} nodes")
         except Exception as e:
-            print(f"[CosmosDB] Error saving tree state: {e}")
+            logger.error(f"[CosmosDB] Error saving tree state: {e}")
     
     def load_tree_state(self, scratchpad_id: str):
         """Load the hypothesis tree state for a scratchpad"""
         if not self.enabled:
-            print(f"[CosmosDB Mock] Would load tree for scratchpad {scratchpad_id}")
+            logger.debug(f"[CosmosDB Mock] Would load tree for scratchpad {scratchpad_id}")
             return []
         
         try:
@@ -424,11 +550,11 @@ class CosmosDB:
             items = list(self.container.query_items(query=query, parameters=params, enable_cross_partition_query=True))
             
             if items:
-                print(f"[CosmosDB] Loaded hypothesis tree with {len(items[0].get('tree', []))} nodes")
+                logger.info(f"[CosmosDB] Loaded hypothesis tree with {len(items[0].get('tree', []))} nodes")
                 return items[0].get("tree", [])
             else:
-                print(f"[CosmosDB] No saved tree found for scratchpad {scratchpad_id}")
+                logger.info(f"[CosmosDB] No saved tree found for scratchpad {scratchpad_id}")
                 return []
         except Exception as e:
-            print(f"[CosmosDB] Error loading tree state: {e}")
+            logger.error(f"[CosmosDB] Error loading tree state: {e}")
             return []
@@ -0,0 +1,193 @@
+"""
+Deterministic Provider Stand-ins
+
+Fake chat model, embeddings, web search and memory store used when the server
+runs with FAKE_PROVIDERS=1 (benchmarks and load tests). They answer every
+prompt the agents send with well-formed output after a configurable latency,
+so graph throughput can be measured without OpenAI, Tavily or Cosmos. Cosmos
+falls back to its built-in mock mode when no credentials are set.
+
+The same input always produces the same output: whether a node is a leaf, and
+what its children are called, is derived from a hash of the prompt.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from typing import AsyncIterator, List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_LLM_LATENCY_MS = float(os.environ.get("FAKE_LLM_LATENCY_MS", 50))
+FAKE_LLM_STREAM_CHUNKS = int(os.environ.get("FAKE_LLM_STREAM_CHUNKS", 8))
+FAKE_LEAF_RATIO = float(os.environ.get("FAKE_LEAF_RATIO", 0.5))
+FAKE_SEARCH_LATENCY_MS = float(os.environ.get("FAKE_SEARCH_LATENCY_MS", 20))
+FAKE_EMBED_LATENCY_MS = float(os.environ.get("FAKE_EMBED_LATENCY_MS", 5))
+
+_ASPECTS = ["demand", "pricing", "costs", "competition", "operations", "regulation", "talent", "technology"]
+
+
+def _hash(text: str) -> int:
+    return int(hashlib.sha256(text.encode()).hexdigest()[:12], 16)
+
+
+def _field(prompt: str, label: str) -> str:
+    """Text following `label:` up to the next blank line, as laid out in our prompt templates."""
+    match = re.search(rf"{label}:\s*\n\s*(.+?)\n\s*\n", prompt, re.S)
+    return " ".join(match.group(1).split()) if match else ""
+
+
+class FakeChatModel(BaseChatModel):
+    latency_ms: float = FAKE_LLM_LATENCY_MS
+    leaf_ratio: float = FAKE_LEAF_RATIO
+    stream_chunks: int = FAKE_LLM_STREAM_CHUNKS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    # --- Responses ---
+    def _classification(self, text: str) -> dict:
+        is_leaf = (_hash(text) % 1000) / 1000 < self.leaf_ratio
+        return {
+            "classification": "leaf" if is_leaf else "branch",
+            "confidence": round((_hash(text + "c") % 100) / 100, 2),
+            "reasoning": f"Deterministic classification of '{text[:40]}'.",
+        }
+
+    def respond(self, prompt: str) -> dict:
+        if "ROOT hypotheses" in prompt:
+            topic = prompt.split("RESEARCH CONTEXT")[0][-80:].strip()
+            return {"hypotheses": [
+                {"text": f"Root hypothesis {i + 1}: {_ASPECTS[(_hash(prompt) + i) % len(_ASPECTS)]} drives the outcome",
+                 "reasoning": f"Derived from {topic[:40]}"}
+                for i in range(2)
+            ]}
+        if '"sub_hypotheses"' in prompt:
+            parent = _field(prompt, "Parent Hypothesis")
+            count = int(re.search(r"at most (\d+)", prompt).group(1)) if "at most" in prompt else 2
+            return {"sub_hypotheses": [
+                {"text": f"{parent[:60]} / {_ASPECTS[(_hash(parent) + i) % len(_ASPECTS)]} {i + 1}",
+                 "reasoning": "A necessary component of the parent."}
+                for i in range(count)
+            ]}
+        if '"classifications"' in prompt:
+            entries = re.findall(r"- \[([\d.]+)\] (.+)", prompt)
+            return {"classifications": [dict(self._classification(text), id=node_id) for node_id, text in entries]}
+        if '"classification"' in prompt:
+            return self._classification(_field(prompt, "Hypothesis"))
+        if '"analysis_required"' in prompt:
+            return {"analysis_required": f"Quantify '{_field(prompt, 'Hypothesis')[:60]}' against benchmarks",
+                    "reasoning": "Direct test of the hypothesis."}
+        if '"source"' in prompt:
+            return {"source": "Industry reports and company filings", "reasoning": "Most reliable public data."}
+        return {"result": "ok"}
+
+    def _completion(self, messages: List[BaseMessage]) -> tuple:
+        prompt = "\n".join(str(m.content) for m in messages)
+        text = json.dumps(self.respond(prompt))
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4,
+                 "total_tokens": len(prompt) // 4 + len(text) // 4}
+        return text, usage
+
+    # --- BaseChatModel ---
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        text, usage = self._completion(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        text, usage = self._completion(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        text, usage = self._completion(messages)
+        # Half the latency before the first token, the rest spread over the chunks
+        await asyncio.sleep(self.latency_ms / 2000)
+        size = max(1, len(text) // max(1, self.stream_chunks))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(self.latency_ms / 2000 / len(pieces))
+            last = i == len(pieces) - 1
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage if last else None))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, include_raw: bool = False, **kwargs):
+        """Parses the JSON completion into `schema`, shaped like the real structured-output runnable."""
+        from langchain_core.runnables import RunnableLambda
+
+        def parse(message):
+            try:
+                parsed, error = schema.model_validate_json(message.content), None
+            except Exception as e:
+                parsed, error = None, e
+            return {"raw": message, "parsed": parsed, "parsing_error": error} if include_raw else parsed
+
+        return self | RunnableLambda(parse)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: texts sharing words are similar, identical texts are identical."""
+
+    def __init__(self, dimensions: int = 256, latency_ms: float = FAKE_EMBED_LATENCY_MS):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.model = "fake-embeddings"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            vector[_hash(word) % self.dimensions] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeVectorStore:
+    """Agent memory with nothing in it, matching VectorStore's async interface."""
+
+    def __init__(self):
+        self.embeddings = FakeEmbeddings()
+
+    async def asearch(self, query: str, k: int = 3) -> str:
+        return ""
+
+    async def asearch_results(self, query: str, k: int = 3) -> list:
+        return []
+
+
+async def fake_web_search_results(query: str) -> list:
+    await asyncio.sleep(FAKE_SEARCH_LATENCY_MS / 1000)
+    return [
+        {"url": f"https://example.com/{_hash(query + str(i)) % 10000}",
+         "content": f"Result {i + 1} about {query}. " + " ".join(_ASPECTS[(_hash(query) + i) % len(_ASPECTS):]) * 4,
+         "score": round(0.9 - i * 0.1, 2)}
+        for i in range(3)
+    ]
+
+
+async def fake_web_search(query: str) -> str:
+    results = await fake_web_search_results(query)
+    return "\n".join(f"[Source: {r['url']}]\n{r['content'][:300]}..." for r in results)
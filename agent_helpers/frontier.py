@@ -0,0 +1,181 @@
+"""
+Frontier Scheduling & Run Budgets
+
+`nodes_to_process` is the frontier of the hypothesis tree. A FrontierScheduler
+decides its order every time work is added (the graph always takes item [0]),
+and a RunBudget caps tokens, wall-clock time and node count so a run returns
+the best partial tree it has instead of failing on the recursion limit.
+"""
+
+import os
+import math
+import time
+from dataclasses import dataclass, asdict, fields
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from agent_helpers.types import Hypothesis, WorkItem
+
+DEFAULT_FRONTIER = os.environ.get("FRONTIER_STRATEGY", "fifo")
+
+
+# ==========================================
+# BUDGETS
+# ==========================================
+@dataclass
+class RunBudget:
+    """Per-run limits. 0 disables a limit."""
+    max_tokens: int = int(os.environ.get("RUN_MAX_TOKENS", 0))
+    max_seconds: float = float(os.environ.get("RUN_MAX_SECONDS", 600))
+    max_nodes: int = int(os.environ.get("RUN_MAX_NODES", 40))
+    max_depth: int = 4
+    max_children: int = 2
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "RunBudget":
+        """
+        Budget with `data`'s overrides, coerced to each field's type. Unknown
+        keys are ignored; a value that is not a non-negative number (or, for
+        an int field, a whole one) raises ValueError.
+        """
+        budget = cls()
+        kinds = {f.name: f.type for f in fields(cls)}
+        for key, value in (data or {}).items():
+            if key in kinds and value is not None:
+                setattr(budget, key, _coerce_limit(key, value, kinds[key]))
+        return budget
+
+    @classmethod
+    def for_caller(cls, data: Optional[dict], trusted: bool = False) -> "RunBudget":
+        """
+        Budget for a run requested over HTTP. Untrusted callers may only
+        tighten the server's limits: larger overrides are clamped to the
+        default, and 0 (unlimited) for a limit the server enforces raises
+        ValueError. Callers with the scheduler token get `from_dict` as is.
+        """
+        budget = cls.from_dict(data)
+        if trusted:
+            return budget
+        defaults = cls()
+        for key in (data or {}):
+            ceiling = getattr(defaults, key, None)
+            if not ceiling or data[key] is None:
+                continue
+            value = getattr(budget, key)
+            if value == 0:
+                raise ValueError(f"budget.{key} of 0 (unlimited) requires X-Scheduler-Token")
+            setattr(budget, key, min(value, ceiling))
+        return budget
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def recursion_limit(self) -> int:
+        """Graph steps needed to fill the node budget: a classify and a breakdown per node plus bookkeeping."""
+        if not self.max_nodes:
+            return 200
+        return self.max_nodes * 3 + 20
+
+    def exhausted(self, usage: dict, tree: List[Hypothesis]) -> Optional[str]:
+        """Returns the reason the budget is spent, or None if there is room left."""
+        if self.max_tokens and usage.get("tokens", 0) >= self.max_tokens:
+            return f"token budget of {self.max_tokens} reached"
+        if self.max_seconds and usage.get("started_at") and time.time() - usage["started_at"] >= self.max_seconds:
+            return f"time budget of {self.max_seconds:.0f}s reached"
+        if self.max_nodes and self.nodes_left(usage, tree) == 0:
+            return f"node budget of {self.max_nodes} reached"
+        return None
+
+    def nodes_left(self, usage: dict, tree: List[Hypothesis]) -> int:
+        """Nodes this run may still create; nodes kept from a restarted tree do not count."""
+        if not self.max_nodes:
+            return self.max_children
+        created = len(tree) - usage.get("base_nodes", 0)
+        return max(0, self.max_nodes - created)
+
+
+def _coerce_limit(name: str, value, kind: type):
+    if isinstance(value, bool):
+        raise ValueError(f"budget.{name} must be a number, not {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"budget.{name} must be a number, not {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"budget.{name} must be a non-negative number, not {value!r}")
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f"budget.{name} must be a whole number, not {value!r}")
+        return int(number)
+    return number
+
+
+def budget_exhausted(state: dict) -> Optional[str]:
+    budget = RunBudget.from_dict(state.get("budget"))
+    return budget.exhausted(state.get("usage") or {}, state.get("hypothesis_tree", []))
+
+
+class TokenUsageCallback(AsyncCallbackHandler):
+    """Adds the prompt/completion tokens reported by the LLM to a usage dict."""
+
+    def __init__(self, usage: dict):
+        self.usage = usage
+
+    async def on_llm_end(self, response, **kwargs):
+        from agent_helpers.metrics import token_counts
+        prompt, completion = token_counts(response)
+        self.usage["prompt_tokens"] = self.usage.get("prompt_tokens", 0) + prompt
+        self.usage["completion_tokens"] = self.usage.get("completion_tokens", 0) + completion
+        self.usage["tokens"] = self.usage.get("tokens", 0) + prompt + completion
+        self.usage["llm_calls"] = self.usage.get("llm_calls", 0) + 1
+
+
+# ==========================================
+# FRONTIER SCHEDULERS
+# ==========================================
+class FrontierScheduler:
+    """Orders the work queue. Subclasses override `score`; higher scores run first."""
+
+    name = "base"
+
+    def score(self, item: WorkItem, node: Optional[Hypothesis]) -> float:
+        return 0.0
+
+    def push(self, queue: List[WorkItem], items: List[WorkItem], tree: List[Hypothesis]) -> List[WorkItem]:
+        node_map = {n["id"]: n for n in tree}
+        scored = [{**item, "priority": self.score(item, node_map.get(item["id"]))} for item in items]
+        # sorted() is stable, so equal scores keep insertion (FIFO) order
+        return sorted(queue + scored, key=lambda w: -w.get("priority", 0.0))
+
+
+class FifoFrontier(FrontierScheduler):
+    """Breadth-first: the original behaviour."""
+
+    name = "fifo"
+
+
+class BestFirstFrontier(FrontierScheduler):
+    """
+    Expands the most promising nodes first. A node's value is the classifier's
+    confidence that it is worth breaking down (0.5 when unknown), discounted
+    by depth so shallow, high-confidence branches are filled in before deep ones.
+    """
+
+    name = "best_first"
+
+    def score(self, item: WorkItem, node: Optional[Hypothesis]) -> float:
+        if not node:
+            return 0.0
+        depth = len(node["id"].split("."))
+        return node.get("confidence", 0.5) / depth
+
+
+FRONTIERS: Dict[str, FrontierScheduler] = {
+    FifoFrontier.name: FifoFrontier(),
+    BestFirstFrontier.name: BestFirstFrontier(),
+}
+
+
+def get_frontier(name: Optional[str]) -> FrontierScheduler:
+    return FRONTIERS.get(name or DEFAULT_FRONTIER, FRONTIERS["fifo"])
@@ -0,0 +1,133 @@
+"""
+Incremental Restart
+
+A full restart prunes every descendant of the edited node and regenerates
+them. In incremental mode the pruned subtree is kept as `graft_candidates`;
+when the edited node is broken down again, each new child is matched to an
+old child by embedding similarity and the old child's whole subtree is grafted
+back under the new child's id. Only unmatched (divergent) children are
+expanded again, so the cost of an edit is proportional to what changed.
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .types import Hypothesis
+from .logs import get_logger
+
+# "full" regenerates the edited node's subtree, "incremental" reuses what still matches
+RESTART_MODE = os.environ.get("RESTART_MODE", "full")
+RESTART_MODES = ("full", "incremental")
+# Minimum cosine similarity between a new child and an old one for the old subtree to be reused
+INCREMENTAL_MATCH_THRESHOLD = float(os.environ.get("INCREMENTAL_MATCH_THRESHOLD", 0.85))
+
+_embeddings = None
+
+logger = get_logger("incremental")
+
+
+def set_incremental_embeddings(embeddings):
+    """Embeddings model used to match children. Without one, nothing is reused."""
+    global _embeddings
+    _embeddings = embeddings
+
+
+def subtree_ids(tree: List[Hypothesis], root_id: str) -> List[str]:
+    """Ids of every descendant of `root_id`, breadth first."""
+    children: Dict[str, List[str]] = {}
+    for node in tree:
+        children.setdefault(node.get("parent_id"), []).append(node["id"])
+    ids = []
+    queue = [root_id]
+    while queue:
+        for child in children.get(queue.pop(0), []):
+            ids.append(child)
+            queue.append(child)
+    return ids
+
+
+def _renumber(node_id: str, old_prefix: str, new_prefix: str) -> str:
+    return new_prefix + node_id[len(old_prefix):]
+
+
+def graft_subtree(candidates: List[Hypothesis], old_id: str, new_node: Hypothesis) -> List[Hypothesis]:
+    """
+    Copies the descendants of `old_id` under `new_node`, renumbering ids so
+    "1.2.1.3" becomes "1.3.1.3" when "1.2.1" is grafted as "1.3.1". Updates
+    `new_node` in place with the old child's outcome.
+    """
+    by_id = {n["id"]: n for n in candidates}
+    old_node = by_id[old_id]
+    new_id = new_node["id"]
+
+    # The frontend doesn't always send children_ids, so links are rebuilt from parent_id
+    def children_of(node_id):
+        return [_renumber(n["id"], old_id, new_id) for n in candidates if n.get("parent_id") == node_id]
+
+    new_node["is_leaf"] = old_node.get("is_leaf", False)
+    new_node["children_ids"] = children_of(old_id)
+    for key in ("confidence", "status"):
+        if key in old_node:
+            new_node[key] = old_node[key]
+
+    grafted = []
+    for descendant_id in subtree_ids(candidates, old_id):
+        node = dict(by_id[descendant_id])
+        node["id"] = _renumber(node["id"], old_id, new_id)
+        node["parent_id"] = _renumber(node["parent_id"], old_id, new_id)
+        node["children_ids"] = children_of(descendant_id)
+        grafted.append(node)
+    return grafted
+
+
+async def match_children(new_children: List[Hypothesis], old_children: List[Hypothesis],
+                         threshold: float = INCREMENTAL_MATCH_THRESHOLD) -> Dict[str, Tuple[str, float]]:
+    """Greedy one-to-one matching of new child ids to (old child id, similarity)."""
+    if not new_children or not old_children or _embeddings is None:
+        return {}
+
+    vectors = np.asarray(
+        await _embeddings.aembed_documents([n["text"] for n in new_children] + [o["text"] for o in old_children]),
+        dtype=np.float32,
+    )
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors[:len(new_children)] @ vectors[len(new_children):].T
+
+    matches = {}
+    used_old = set()
+    for flat in np.argsort(-similarity, axis=None):
+        i, j = divmod(int(flat), len(old_children))
+        if similarity[i, j] < threshold:
+            break
+        new_id, old_id = new_children[i]["id"], old_children[j]["id"]
+        if new_id in matches or old_id in used_old:
+            continue
+        matches[new_id] = (old_id, float(similarity[i, j]))
+        used_old.add(old_id)
+    return matches
+
+
+async def reuse_matching_subtrees(parent_id: str, new_children: List[Hypothesis],
+                                  candidates: List[Hypothesis]) -> Tuple[List[Hypothesis], set, List[str]]:
+    """
+    Grafts the old subtrees of `parent_id` that match one of `new_children`.
+    Returns (grafted descendant nodes, ids of reused children, explainability lines).
+    """
+    old_children = [n for n in candidates if n.get("parent_id") == parent_id]
+    try:
+        matches = await match_children(new_children, old_children)
+    except Exception as e:
+        logger.warning(f"[Incremental] Matching failed, regenerating subtree: {e}")
+        return [], set(), []
+
+    grafted, logs = [], []
+    new_by_id = {n["id"]: n for n in new_children}
+    for new_id, (old_id, similarity) in matches.items():
+        nodes = graft_subtree(candidates, old_id, new_by_id[new_id])
+        grafted.extend(nodes)
+        logs.append(f"'{new_by_id[new_id]['text'][:60]}' matches my earlier point {old_id} "
+                    f"(similarity {similarity:.2f}), so I kept its {len(nodes)} sub-points instead of redoing them.")
+        logger.info(f"[Incremental] Reused {old_id} as {new_id} with {len(nodes)} descendants (similarity {similarity:.2f})")
+    return grafted, set(matches), logs
@@ -0,0 +1,231 @@
+"""
+JSON extraction for LLM output
+
+`parse_json_from_string` finds the JSON object in a completion with a single
+linear scan (the old greedy `\\{.*\\}` regex plus `json.loads` retries was
+quadratic on long outputs). `IncrementalJSONParser` consumes a completion as
+it streams and emits each element of a target array as soon as its object
+closes, so sub-hypotheses can be shown before the completion finishes.
+
+Malformed output (trailing commas, Python literals, truncated completions)
+is repaired locally by `repair_json` rather than paying for another LLM call.
+"""
+
+import re
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from agent_helpers.metrics import traced
+
+# Outcome counters per parser, e.g. PARSE_STATS["text"]["repaired"]
+PARSE_STATS: Dict[str, Dict[str, int]] = {}
+
+
+def record_parse(source: str, outcome: str):
+    stats = PARSE_STATS.setdefault(source, {"parsed": 0, "repaired": 0, "failed": 0})
+    stats[outcome] = stats.get(outcome, 0) + 1
+
+
+def iter_json_object_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """Yields (start, end) of every balanced top-level {...} in `text`, ignoring braces inside strings."""
+    depth = 0
+    start = None
+    in_string = False
+    escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            # Quotes only matter inside an object; prose around the JSON may use them freely
+            if depth:
+                in_string = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield start, i + 1
+
+
+def _extract_json(text: str) -> Optional[dict]:
+    # Prefer an explicit ```json fenced block
+    fence = text.find("```json")
+    if fence != -1:
+        close = text.find("```", fence + 7)
+        if close != -1:
+            try: return json.loads(text[fence + 7:close])
+            except ValueError: pass
+
+    # Then the last balanced object that parses
+    spans = list(iter_json_object_spans(text))
+    for start, end in reversed(spans):
+        try: return json.loads(text[start:end])
+        except ValueError: continue
+
+    # Finally the widest span, for objects whose braces are unbalanced inside strings
+    first, last = text.find("{"), text.rfind("}")
+    if first != -1 and last > first and (first, last + 1) not in spans:
+        try: return json.loads(text[first:last + 1])
+        except ValueError: pass
+    return None
+
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_SMART_QUOTES = "\u201c\u201d"
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort local repair of almost-JSON: drops code fences and prose before
+    the first brace, swaps smart quotes used as delimiters and Python literals,
+    removes trailing commas and closes strings/brackets left open by a
+    truncated completion. Smart quotes inside a string are left as text.
+    """
+    text = text.replace("```json", "").replace("```", "")
+    first = text.find("{")
+    if first == -1:
+        return text
+    text = text[first:]
+
+    out = []
+    stack = []
+    in_string = False
+    smart_string = False  # Opened by a smart quote, so one may close it too
+    escape = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"' or (smart_string and ch in _SMART_QUOTES):
+                in_string = False
+                ch = '"'
+            out.append(ch)
+        elif ch == '"' or ch in _SMART_QUOTES:
+            in_string = True
+            smart_string = ch != '"'
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # Ignore anything after the top-level object closes
+        elif ch.isalpha():
+            word = re.match(r"[A-Za-z]+", text[i:]).group(0)
+            out.append(_PY_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    repaired = "".join(out).rstrip().rstrip(",")
+    repaired += "".join(reversed(stack))
+    return _TRAILING_COMMA.sub(r"\1", repaired)
+
+
+@traced("parse")
+def parse_json_from_string(text: str, source: str = "text") -> dict:
+    data = _extract_json(text)
+    if data is not None:
+        record_parse(source, "parsed")
+        return data
+
+    try:
+        data = json.loads(repair_json(text))
+        if isinstance(data, dict):
+            record_parse(source, "repaired")
+            return data
+    except ValueError:
+        pass
+    record_parse(source, "failed")
+    return {"error": "Failed to parse JSON", "raw_text": text}
+
+
+class IncrementalJSONParser:
+    """
+    Feed it completion chunks; it returns the objects of `array_key` that
+    completed in each chunk. Works in one pass over the text regardless of how
+    it is chunked, and never re-parses earlier output.
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self.buffer = ""
+        self.pos = 0
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.last_string: Optional[str] = None
+        self.key_matched = False
+        self.array_depth: Optional[int] = None
+        self.item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.buffer += chunk
+        completed = []
+        text = self.buffer
+        for i in range(self.pos, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last_string = text[self.string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                self.string_start = i
+                self.key_matched = False
+            elif ch == ":":
+                self.key_matched = self.last_string == self.array_key
+                self.last_string = None
+            elif ch in "{[":
+                self.stack.append(ch)
+                if ch == "[" and self.key_matched and self.array_depth is None:
+                    self.array_depth = len(self.stack)
+                elif ch == "{" and self.array_depth is not None and len(self.stack) == self.array_depth + 1:
+                    self.item_start = i
+                self.key_matched = False
+            elif ch in "}]":
+                if ch == "}" and self.item_start is not None and len(self.stack) == self.array_depth + 1:
+                    try:
+                        completed.append(json.loads(text[self.item_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self.item_start = None
+                if self.stack:
+                    self.stack.pop()
+                if ch == "]" and self.array_depth is not None and len(self.stack) < self.array_depth:
+                    self.array_depth = None
+                self.key_matched = False
+            elif not ch.isspace():
+                self.key_matched = False
+        self.pos = len(text)
+        return completed
+
+    def result(self) -> dict:
+        """Parses the full completion once streaming has finished."""
+        return parse_json_from_string(self.buffer, source="stream")
@@ -0,0 +1,140 @@
+"""
+Structured Logging
+
+Replaces print() on the request path. Loggers from `get_logger` put records on
+an in-memory queue and return immediately; a background listener thread
+formats them and writes to stdout, so a slow or full stdout pipe never blocks
+the event loop. When the queue is full, records are dropped (and counted)
+rather than waited on.
+
+Every record carries the run id, graph node and hypothesis id from the
+context variables in metrics.py, so lines from concurrent runs can be told
+apart and joined with /runs/{run_id}/trace.
+
+Hypothesis tree dumps are DEBUG records and are only rendered when DEBUG is
+enabled for the logger, and then only for TREE_DUMP_SAMPLE_RATE of the calls.
+
+    LOG_LEVEL=DEBUG LOG_FORMAT=json TREE_DUMP_SAMPLE_RATE=0.1 python agent.py
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from typing import Optional
+
+from agent_helpers.metrics import current_hypothesis, current_node, current_run
+from agent_helpers.types import format_tree
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for a readable console, "json" for one object per line
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+# Fraction of tree dumps written when DEBUG is on (they can be large)
+TREE_DUMP_SAMPLE_RATE = float(os.environ.get("TREE_DUMP_SAMPLE_RATE", 1.0))
+# Records buffered for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+ROOT_LOGGER = "agent"
+
+_setup_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+dropped_records = 0
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the run / node / hypothesis of the code that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.run_id = current_run.get()
+        record.node = current_node.get()
+        record.hypothesis_id = current_hypothesis.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}"
+        run_id = getattr(record, "run_id", None)
+        if run_id:
+            node = getattr(record, "node", None)
+            line += f" [{run_id[:8]}{' ' + node if node else ''}]"
+        line += f" {record.getMessage()}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "run_id": getattr(record, "run_id", None),
+            "node": getattr(record, "node", None),
+            "hypothesis_id": getattr(record, "hypothesis_id", None),
+            "pid": record.process,
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """Installs the queue handler on the `agent` logger. Safe to call more than once."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        handler = DroppingQueueHandler(log_queue)
+        handler.addFilter(ContextFilter())
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(handler)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flushes queued records. Called at exit."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_tree(logger: logging.Logger, tree, title: str):
+    """Logs a hypothesis tree dump at DEBUG. Free unless DEBUG is enabled and the dump is sampled."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if TREE_DUMP_SAMPLE_RATE < 1 and random.random() >= TREE_DUMP_SAMPLE_RATE:
+        return
+    logger.debug("%s", format_tree(tree, title))
@@ -0,0 +1,69 @@
+"""
+Event Loop Lag Monitor
+
+Every node, SSE stream and health probe in a worker shares one event loop, so
+any blocking call delays all of them. The monitor sleeps for a fixed interval
+and records how late it wakes up; that overshoot is the lag every other
+coroutine saw at the same moment. Exposed at GET /stats/loop.
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+
+LOOP_MONITOR_INTERVAL_MS = float(os.environ.get("LOOP_MONITOR_INTERVAL_MS", 50))
+# Samples kept for the percentiles (at 50ms, about five minutes)
+LOOP_MONITOR_SAMPLES = int(os.environ.get("LOOP_MONITOR_SAMPLES", 6000))
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_ms: float = LOOP_MONITOR_INTERVAL_MS, samples: int = LOOP_MONITOR_SAMPLES):
+        self.interval = interval_ms / 1000
+        self.samples = deque(maxlen=samples)
+        self.max_lag_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - expected) * 1000)
+            self.samples.append(lag_ms)
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def reset(self):
+        self.samples.clear()
+        self.max_lag_ms = 0.0
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 2) if ordered else 0.0
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": len(ordered),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "max_ms": round(self.max_lag_ms, 2),
+        }
+
+
+loop_monitor = LoopLagMonitor()
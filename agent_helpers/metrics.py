@@ -0,0 +1,385 @@
+"""
+Metrics & Tracing
+
+Times every graph node and the sub-steps inside it (web search, vector search,
+document search, LLM, parse, Cosmos write, rate-limit wait), counts tokens and
+cost, and records cache hits. The numbers go to three places:
+
+- Prometheus: GET /metrics (aggregates per node / step / model / cache)
+- A per-run trace: GET /runs/{run_id}/trace, with seconds per hypothesis and step
+- OpenTelemetry spans, when OTEL_TRACING=1 and the SDK is installed
+
+The current run, graph node and hypothesis travel in context variables, so a
+step is attributed correctly from any coroutine or `to_thread` call beneath
+the node that started it.
+"""
+
+import os
+import json
+import time
+import functools
+import contextlib
+import contextvars
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Export spans to an OTLP collector (endpoint from OTEL_EXPORTER_OTLP_ENDPOINT, default localhost:4318)
+OTEL_TRACING = os.environ.get("OTEL_TRACING", "0") == "1"
+# Finished-run traces kept in memory for /runs/{run_id}/trace
+RUN_TRACE_RETENTION = int(os.environ.get("RUN_TRACE_RETENTION", 200))
+# USD per million (prompt, completion) tokens; extend with LLM_PRICING='{"model": [in, out]}'
+LLM_PRICING = {"gpt-4o-mini": (0.15, 0.60), "gpt-4o": (2.50, 10.00), "text-embedding-3-small": (0.02, 0.0)}
+LLM_PRICING.update({k: tuple(v) for k, v in json.loads(os.environ.get("LLM_PRICING", "{}")).items()})
+
+current_run: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_run", default=None)
+current_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_node", default=None)
+current_hypothesis: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_hypothesis", default=None)
+
+
+# ==========================================
+# PROMETHEUS
+# ==========================================
+if prometheus_client is not None:
+    from prometheus_client import Counter, Gauge, Histogram
+
+    _LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    NODE_SECONDS = Histogram("agent_node_seconds", "Graph node execution time", ["node"], buckets=_LATENCY_BUCKETS)
+    STEP_SECONDS = Histogram("agent_step_seconds", "Sub-step time inside a node", ["step", "node"],
+                             buckets=_LATENCY_BUCKETS)
+    LLM_TOKENS = Counter("agent_llm_tokens", "LLM tokens", ["model", "kind"])
+    LLM_COST = Counter("agent_llm_cost_usd", "Estimated LLM cost in USD", ["model"])
+    LLM_CALLS = Counter("agent_llm_calls", "LLM calls", ["model", "outcome"])
+    CACHE_LOOKUPS = Counter("agent_cache_lookups", "Cache lookups", ["cache", "result"])
+    RUNS = Counter("agent_runs", "Finished runs", ["status"])
+    RUN_SECONDS = Histogram("agent_run_seconds", "Run wall time", buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+    RUNS_ACTIVE = Gauge("agent_runs_active", "Runs executing now", multiprocess_mode="livesum")
+
+
+def render_metrics() -> tuple:
+    """(body, content type) for GET /metrics, aggregated across workers in multiprocess mode."""
+    if prometheus_client is None:
+        return "# prometheus_client is not installed\n", "text/plain"
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# ==========================================
+# OPENTELEMETRY
+# ==========================================
+_tracer = None
+
+
+def _init_tracer():
+    global _tracer, OTEL_TRACING
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        print(f"[Metrics] OTEL_TRACING=1 but OpenTelemetry is not installed ({e}); spans disabled")
+        OTEL_TRACING = False
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", "consultant-agent")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("agent_helpers.metrics")
+
+
+if OTEL_TRACING:
+    _init_tracer()
+
+
+def _span_attributes(**extra) -> dict:
+    attributes = {"run.id": current_run.get(), "graph.node": current_node.get(), "hypothesis.id": current_hypothesis.get()}
+    attributes.update(extra)
+    return {k: v for k, v in attributes.items() if v is not None}
+
+
+# ==========================================
+# PER-RUN TRACES
+# ==========================================
+class RunTrace:
+    """Where one run's time, tokens and cache hits went."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status = "running"
+        self.nodes: Dict[str, dict] = {}
+        self.steps: Dict[str, dict] = {}
+        self.hypotheses: Dict[str, Dict[str, float]] = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.cost_usd = 0.0
+        self.cache: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(table: dict, key: str, seconds: float):
+        entry = table.setdefault(key, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+    def add_node(self, node: str, seconds: float):
+        with self._lock:
+            self._add(self.nodes, node, seconds)
+            hypothesis = current_hypothesis.get()
+            if hypothesis:
+                per_step = self.hypotheses.setdefault(hypothesis, {})
+                per_step["total"] = per_step.get("total", 0.0) + seconds
+
+    def add_step(self, step: str, seconds: float):
+        with self._lock:
+            self._add(self.steps, step, seconds)
+            hypothesis = current_hypothesis.get()
+            if hypothesis:
+                per_step = self.hypotheses.setdefault(hypothesis, {})
+                per_step[step] = per_step.get(step, 0.0) + seconds
+
+    def to_dict(self) -> dict:
+        rounded = lambda table: {k: {"count": v["count"], "seconds": round(v["seconds"], 4)} for k, v in table.items()}
+        end = self.finished_at or time.time()
+        return {
+            "run_id": self.run_id,
+            "status": self.status,
+            "seconds": round(end - self.started_at, 3),
+            "nodes": rounded(self.nodes),
+            "steps": rounded(self.steps),
+            "hypotheses": {h: {k: round(v, 4) for k, v in s.items()} for h, s in self.hypotheses.items()},
+            "tokens": dict(self.tokens),
+            "cost_usd": round(self.cost_usd, 6),
+            "cache": self.cache,
+        }
+
+
+_traces: "OrderedDict[str, RunTrace]" = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def _trace(run_id: Optional[str] = None) -> Optional[RunTrace]:
+    run_id = run_id or current_run.get()
+    if run_id is None:
+        return None
+    with _traces_lock:
+        trace = _traces.get(run_id)
+        if trace is None:
+            trace = _traces[run_id] = RunTrace(run_id)
+            while len(_traces) > RUN_TRACE_RETENTION:
+                _traces.popitem(last=False)
+        return trace
+
+
+def get_run_trace(run_id: str) -> Optional[dict]:
+    trace = _traces.get(run_id)
+    return trace.to_dict() if trace else None
+
+
+def run_started(run_id: str):
+    _trace(run_id)
+    if prometheus_client is not None:
+        RUNS_ACTIVE.inc()
+
+
+def run_finished(run_id: str, status: str):
+    trace = _trace(run_id)
+    trace.status = status
+    trace.finished_at = time.time()
+    if prometheus_client is not None:
+        RUNS_ACTIVE.dec()
+        RUNS.labels(status).inc()
+        RUN_SECONDS.observe(trace.finished_at - trace.started_at)
+
+
+# ==========================================
+# INSTRUMENTATION
+# ==========================================
+@contextlib.contextmanager
+def span(step: str, **attributes):
+    """Times a sub-step of the current node. Works around `await`s and inside `to_thread`."""
+    otel = _tracer.start_as_current_span(step, attributes=_span_attributes(**attributes)) if _tracer else contextlib.nullcontext()
+    started = time.perf_counter()
+    try:
+        with otel:
+            yield
+    finally:
+        seconds = time.perf_counter() - started
+        if prometheus_client is not None:
+            STEP_SECONDS.labels(step, current_node.get() or "none").observe(seconds)
+        trace = _trace()
+        if trace:
+            trace.add_step(step, seconds)
+
+
+def traced(step: str):
+    """Decorator form of `span` for sync and async functions."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(step):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(step):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_node(name: str, fn):
+    """
+    Wraps a graph node: sets the run/node/hypothesis context and times it. The
+    hypothesis is the work item at the head of the queue, which is what
+    breakdown and classify nodes process. `functools.wraps` keeps the
+    signature visible, so LangGraph still injects `writer`/`config`.
+    """
+    def enter(state):
+        queue = state.get("nodes_to_process") or []
+        tokens = (current_run.set(state.get("run_id")), current_node.set(name),
+                  current_hypothesis.set(queue[0]["id"] if queue and name != "start_process" else None))
+        otel = _tracer.start_as_current_span(name, attributes=_span_attributes()) if _tracer else contextlib.nullcontext()
+        otel.__enter__()
+        return tokens, otel, time.perf_counter()
+
+    def leave(tokens, otel, started, error):
+        seconds = time.perf_counter() - started
+        otel.__exit__(type(error) if error else None, error, error.__traceback__ if error else None)
+        if prometheus_client is not None:
+            NODE_SECONDS.labels(name).observe(seconds)
+        trace = _trace()
+        if trace:
+            trace.add_node(name, seconds)
+        for var, token in zip((current_run, current_node, current_hypothesis), tokens):
+            var.reset(token)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(state, *args, **kwargs):
+            context = enter(state)
+            error = None
+            try:
+                return await fn(state, *args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                leave(*context, error)
+    else:
+        @functools.wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            context = enter(state)
+            error = None
+            try:
+                return fn(state, *args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                leave(*context, error)
+    return wrapper
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    if count <= 0:
+        return
+    result = "hit" if hit else "miss"
+    if prometheus_client is not None:
+        CACHE_LOOKUPS.labels(cache, result).inc(count)
+    trace = _trace()
+    if trace:
+        with trace._lock:
+            counts = trace.cache.setdefault(cache, {"hit": 0, "miss": 0})
+            counts[result] += count
+
+
+def token_counts(response) -> tuple:
+    """(prompt, completion) tokens of an LLMResult, from llm_output or, when streamed, usage_metadata."""
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    prompt = token_usage.get("prompt_tokens", 0)
+    completion = token_usage.get("completion_tokens", 0)
+    if not token_usage:
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt += metadata.get("input_tokens", 0)
+                completion += metadata.get("output_tokens", 0)
+    return prompt, completion
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prices = LLM_PRICING.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+class LLMMetricsCallback(AsyncCallbackHandler):
+    """Times LLM calls (excluding prompt formatting and parsing) and counts tokens and cost."""
+
+    def __init__(self):
+        self._calls: Dict[UUID, tuple] = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._start(serialized, run_id, kwargs)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._start(serialized, run_id, kwargs)
+
+    def _start(self, serialized, run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or params.get("_type") or "unknown"
+        otel = _tracer.start_span("llm", attributes=_span_attributes(**{"llm.model": model})) if _tracer else None
+        self._calls[run_id] = (model, time.perf_counter(), otel)
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        model, started, otel = self._calls.pop(run_id, ("unknown", time.perf_counter(), None))
+        seconds = time.perf_counter() - started
+        prompt, completion = token_counts(response)
+        cost = llm_cost(model, prompt, completion)
+
+        if prometheus_client is not None:
+            STEP_SECONDS.labels("llm", current_node.get() or "none").observe(seconds)
+            LLM_CALLS.labels(model, "ok").inc()
+            LLM_TOKENS.labels(model, "prompt").inc(prompt)
+            LLM_TOKENS.labels(model, "completion").inc(completion)
+            LLM_COST.labels(model).inc(cost)
+        trace = _trace()
+        if trace:
+            trace.add_step("llm", seconds)
+            with trace._lock:
+                trace.tokens["prompt"] += prompt
+                trace.tokens["completion"] += completion
+                trace.cost_usd += cost
+        if otel is not None:
+            otel.set_attribute("llm.prompt_tokens", prompt)
+            otel.set_attribute("llm.completion_tokens", completion)
+            otel.end()
+
+    async def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        model, _, otel = self._calls.pop(run_id, ("unknown", 0, None))
+        if prometheus_client is not None:
+            LLM_CALLS.labels(model, "error").inc()
+        if otel is not None:
+            otel.record_exception(error)
+            otel.end()
+
+
+llm_metrics_callback = LLMMetricsCallback()
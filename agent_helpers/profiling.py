@@ -0,0 +1,248 @@
+"""
+On-demand Run Profiling
+
+Profiles a single run when asked to, either with an `X-Profile: <mode>` header
+on POST /run_agent (plus `X-Profile-Token`) or by arming the next runs with
+POST /admin/profile. Nothing is hooked in unless a run requests it, so there
+is no cost when profiling is off. Modes:
+
+- sample  A thread samples every thread's stack every few milliseconds and
+          writes folded stacks (`*.folded`) for flamegraph.pl or speedscope.
+          Time spent idle in the event loop's `select` is time waiting on I/O.
+          Covers the whole worker while the run is active.
+- cpu     Deterministic, CPU time per function, saved as pstats (`*.prof`,
+          e.g. for snakeviz or flameprof). With yappi installed only this
+          run's coroutines and threads are counted (tagged via the run context).
+- wall    As `cpu` but wall-clock time. yappi attributes a coroutine's time
+          across `await`s correctly.
+
+Without yappi, `cpu` and `wall` fall back to cProfile on the event loop
+thread, which also counts other runs executing in the same worker.
+
+Profilers are process-global, so each worker profiles one run at a time.
+Profiles are stored in PROFILE_DIR and served by GET /runs/{run_id}/profile.
+"""
+
+import os
+import sys
+import time
+import zlib
+import asyncio
+import threading
+from collections import Counter
+from typing import Optional
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+from agent_helpers.logs import get_logger
+from agent_helpers.metrics import current_run
+
+logger = get_logger("profiling")
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5))
+# Required in X-Profile-Token / the admin endpoint; profiling is unavailable when unset
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILE_MODES = ("sample", "cpu", "wall")
+PROFILE_EXTENSIONS = {"sample": "folded", "cpu": "prof", "wall": "prof"}
+
+_lock = threading.Lock()
+_active: Optional["RunProfiler"] = None
+# Set by POST /admin/profile: profile the next `remaining` runs with `mode`
+_armed = {"mode": None, "remaining": 0}
+
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN) and token == PROFILING_TOKEN
+
+
+def arm(mode: str, runs: int = 1):
+    with _lock:
+        _armed["mode"] = mode
+        _armed["remaining"] = max(0, runs)
+
+
+def take_armed_mode() -> Optional[str]:
+    """The mode for a new run if the admin endpoint armed one, consuming one use."""
+    with _lock:
+        if _armed["remaining"] <= 0:
+            return None
+        _armed["remaining"] -= 1
+        return _armed["mode"]
+
+
+def profile_status() -> dict:
+    return {
+        "available": bool(PROFILING_TOKEN),
+        "yappi": yappi is not None,
+        "active_run": _active.run_id if _active else None,
+        "armed": dict(_armed),
+    }
+
+
+def profile_path(run_id: str) -> Optional[str]:
+    """Path of a run's stored profile, if there is one."""
+    for mode in PROFILE_MODES:
+        path = os.path.join(PROFILE_DIR, f"{run_id}.{mode}.{PROFILE_EXTENSIONS[mode]}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# ==========================================
+# STACK SAMPLER
+# ==========================================
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle_pool_thread(frame) -> bool:
+    """Executor threads waiting for work would otherwise dominate every profile."""
+    leaf = frame.f_code.co_filename
+    if not leaf.endswith(("threading.py", "queue.py")):
+        return False
+    while frame is not None:
+        if frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith("thread.py"):
+            return True
+        frame = frame.f_back
+    return False
+
+
+class StackSampler:
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or _is_idle_pool_thread(frame):
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+# ==========================================
+# RUN PROFILER
+# ==========================================
+def _tag_for(run_id: str) -> int:
+    return zlib.crc32(run_id.encode())
+
+
+def _run_tag() -> int:
+    """yappi tag of the code running now: its run, taken from the context."""
+    run_id = current_run.get()
+    return _tag_for(run_id) if run_id else 0
+
+
+class RunProfiler:
+    def __init__(self, run_id: str, mode: str):
+        self.run_id = run_id
+        self.mode = mode
+        self.engine = "sampler" if mode == "sample" else ("yappi" if yappi is not None else "cProfile")
+        self.started = time.perf_counter()
+        self._sampler: Optional[StackSampler] = None
+        self._cprofile = None
+
+    @classmethod
+    def start_for(cls, run_id: str, mode: Optional[str]) -> Optional["RunProfiler"]:
+        """Starts profiling `run_id`, or returns None if `mode` is empty or another run holds the profiler."""
+        global _active
+        if mode not in PROFILE_MODES:
+            return None
+        with _lock:
+            if _active is not None:
+                logger.warning(f"[Profiler] Run {_active.run_id} is already being profiled; not profiling {run_id}")
+                return None
+            profiler = _active = cls(run_id, mode)
+        try:
+            profiler._start()
+        except Exception as e:
+            logger.error(f"[Profiler] Failed to start: {e}")
+            _active = None
+            return None
+        logger.info(f"[Profiler] Profiling run {run_id} ({mode}, {profiler.engine})")
+        return profiler
+
+    def _start(self):
+        if self.engine == "sampler":
+            self._sampler = StackSampler()
+            self._sampler.start()
+        elif self.engine == "yappi":
+            yappi.clear_stats()
+            yappi.set_clock_type(self.mode)
+            yappi.set_tag_callback(_run_tag)
+            yappi.start(builtins=False, profile_threads=True)
+        else:
+            import cProfile
+            self._cprofile = cProfile.Profile(time.process_time if self.mode == "cpu" else time.perf_counter)
+            self._cprofile.enable()
+
+    def _halt(self):
+        """Stops the engine and returns a callable that writes its profile to a path."""
+        if self.engine == "sampler":
+            stacks = self._sampler.stop()
+
+            def write(path):
+                with open(path, "w") as f:
+                    f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            return write
+        if self.engine == "yappi":
+            yappi.stop()
+            yappi.set_tag_callback(None)
+            stats = yappi.get_func_stats(filter={"tag": _tag_for(self.run_id)})
+            return lambda path: stats.save(path, type="pstat")
+        self._cprofile.disable()
+        return self._cprofile.dump_stats
+
+    async def stop(self) -> Optional[str]:
+        """Stops profiling and writes the profile. Returns its path.
+
+        Must be called on the thread that started the profiler (cProfile can
+        only be disabled there); the file is written in a worker thread.
+        """
+        global _active
+        try:
+            write = self._halt()
+            profiled = time.perf_counter() - self.started
+            path = os.path.join(PROFILE_DIR, f"{self.run_id}.{self.mode}.{PROFILE_EXTENSIONS[self.mode]}")
+
+            def save():
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                write(path)
+
+            await asyncio.to_thread(save)
+            logger.info(f"[Profiler] Run {self.run_id} profile written to {path} ({profiled:.1f}s profiled)")
+            return path
+        except Exception as e:
+            logger.error(f"[Profiler] Failed to write profile for run {self.run_id}: {e}")
+            return None
+        finally:
+            if self.engine == "yappi":
+                yappi.clear_stats()
+            with _lock:
+                _active = None
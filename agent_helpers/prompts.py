@@ -37,15 +37,48 @@ classifier_prompt = ChatPromptTemplate.from_template(
     Context:
     {context}
     
+    Also estimate how valuable a further breakdown would be, as a confidence between 0 and 1.
+    
     Respond in JSON format:
     {{
         "classification": "leaf" | "branch",
+        "confidence": 0.0-1.0,
         "reasoning": "Explanation..."
     }}
     <|end|>
     """
 )
 
+# 2b. BATCH CLASSIFIER PROMPT (all siblings of one parent in a single call)
+batch_classifier_prompt = ChatPromptTemplate.from_template(
+    """
+    <|system|>
+    You are a senior McKinsey consultant.
+    Your task is to classify several sibling hypothesis nodes in a hypothesis tree.
+    They are all sub-hypotheses of the same parent.
+    
+    For EACH hypothesis, determine if it is a "leaf" (specific enough to be analyzed directly) or a "branch" (needs further breakdown),
+    and estimate how valuable a further breakdown would be, as a confidence between 0 and 1.
+    
+    Parent Hypothesis:
+    {parent_text}
+    
+    Hypotheses (with their ids):
+    {hypotheses}
+    
+    Context:
+    {context}
+    
+    Respond in JSON format, with one entry per hypothesis using its id:
+    {{
+        "classifications": [
+            {{ "id": "1.1", "classification": "leaf" | "branch", "confidence": 0.0-1.0, "reasoning": "Explanation..." }}
+        ]
+    }}
+    <|end|>
+    """
+)
+
 # 3. ANALYSIS PROMPT
 analysis_prompt = ChatPromptTemplate.from_template(
     """
@@ -95,7 +128,7 @@ breakdown_prompt = ChatPromptTemplate.from_template(
     """
     <|system|>
     You are a senior McKinsey consultant.
-    Your task is to break down a high-level hypothesis into more specific, testable sub-hypotheses (MECE).
+    Your task is to break down a high-level hypothesis into at most {max_children} more specific, testable sub-hypotheses (MECE).
     
     Parent Hypothesis:
     {hypothesis_text}
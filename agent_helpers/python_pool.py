@@ -0,0 +1,284 @@
+"""
+Python Analysis Worker Pool
+
+Analysis code runs in a pool of pre-warmed subprocesses (numpy/pandas already
+imported) instead of a fresh in-process `PythonREPL` per call. Each worker is
+limited to `PYTHON_WORKER_MEMORY_MB` of address space, each execution to
+`PYTHON_EXEC_CPU_SECONDS` of CPU and `PYTHON_EXEC_TIMEOUT_SECONDS` of wall time,
+and output is capped at `PYTHON_EXEC_MAX_OUTPUT` characters. A worker that
+hangs or blows a limit is killed and replaced; the server process is never
+blocked or shares memory with the code.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from agent_helpers.logs import get_logger
+
+PYTHON_POOL_SIZE = int(os.environ.get("PYTHON_POOL_SIZE", 2))
+PYTHON_EXEC_TIMEOUT_SECONDS = float(os.environ.get("PYTHON_EXEC_TIMEOUT_SECONDS", 30))
+PYTHON_EXEC_CPU_SECONDS = int(os.environ.get("PYTHON_EXEC_CPU_SECONDS", 20))
+PYTHON_WORKER_MEMORY_MB = int(os.environ.get("PYTHON_WORKER_MEMORY_MB", 1024))
+PYTHON_EXEC_MAX_OUTPUT = int(os.environ.get("PYTHON_EXEC_MAX_OUTPUT", 10000))
+# Recycle workers periodically so state leaked through imported modules doesn't pile up
+PYTHON_WORKER_MAX_TASKS = int(os.environ.get("PYTHON_WORKER_MAX_TASKS", 50))
+# Time allowed for a new worker to import numpy/pandas and report ready
+WORKER_STARTUP_TIMEOUT_SECONDS = 60
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+
+logger = get_logger("python_pool")
+
+
+@dataclass
+class ExecutionResult:
+    ok: bool
+    output: str = ""
+    error: Optional[str] = None
+    truncated: bool = False
+    timed_out: bool = False
+
+    def to_text(self) -> str:
+        text = self.output
+        if self.truncated:
+            text += f"\n... [output truncated at {PYTHON_EXEC_MAX_OUTPUT} characters]"
+        if not self.ok:
+            text += f"\n{self.error}" if text else self.error
+        return text
+
+
+def _worker_env() -> dict:
+    # Only what Python needs: API keys and other secrets stay out of the sandbox
+    env = {"PATH": os.environ.get("PATH", ""), "MPLBACKEND": "Agg", "PYTHONDONTWRITEBYTECODE": "1"}
+    for threads in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        env[threads] = "1"
+    return env
+
+
+def _limit_memory():
+    """Runs in the child before exec: caps its address space."""
+    if resource is not None and PYTHON_WORKER_MEMORY_MB:
+        limit = PYTHON_WORKER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+class PythonWorker:
+    """
+    One worker process. Requests and responses travel over a dedicated pair of
+    pipes, not the child's stdin/stdout, so nothing the executed code writes to
+    fd 1 or 2 can be mistaken for a response.
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process, workdir: tempfile.TemporaryDirectory):
+        self.process = process
+        self.workdir = workdir
+        self.tasks = 0
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._read_transport = None
+
+    @classmethod
+    async def spawn(cls) -> "PythonWorker":
+        workdir = tempfile.TemporaryDirectory(prefix="pyworker-")
+        request_read, request_write = os.pipe()
+        response_read, response_write = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-I", WORKER_SCRIPT, str(request_read), str(response_write),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                pass_fds=(request_read, response_write),
+                cwd=workdir.name,
+                env=_worker_env(),
+                preexec_fn=_limit_memory if resource is not None else None,
+            )
+        except BaseException:
+            os.close(request_write)
+            os.close(response_read)
+            workdir.cleanup()
+            raise
+        finally:
+            # The child's ends; closing ours lets a dead child show up as EOF
+            os.close(request_read)
+            os.close(response_write)
+
+        worker = cls(process, workdir)
+        try:
+            await worker._connect(request_write, response_read)
+            ready = await asyncio.wait_for(worker.reader.readline(), WORKER_STARTUP_TIMEOUT_SECONDS)
+            if not json.loads(ready or b"{}").get("ready"):
+                raise RuntimeError("worker exited during startup")
+        except BaseException:
+            await worker.kill()
+            raise
+        return worker
+
+    async def _connect(self, request_fd: int, response_fd: int):
+        loop = asyncio.get_running_loop()
+        response_pipe, request_pipe = os.fdopen(response_fd, "rb", 0), os.fdopen(request_fd, "wb", 0)
+        # Room for a full-size output line once JSON-escaped
+        self.reader = asyncio.StreamReader(limit=PYTHON_EXEC_MAX_OUTPUT * 6 + 65536)
+        try:
+            self._read_transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(self.reader), response_pipe)
+        except BaseException:
+            response_pipe.close()
+            request_pipe.close()
+            raise
+        try:
+            transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, request_pipe)
+        except BaseException:
+            request_pipe.close()
+            raise
+        self.writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def execute(self, code: str, timeout: float, cpu_seconds: int, max_output: int) -> ExecutionResult:
+        self.tasks += 1
+        request = {"id": self.tasks, "code": code, "cpu_seconds": cpu_seconds, "max_output": max_output}
+        self.writer.write((json.dumps(request) + "\n").encode())
+        await self.writer.drain()
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), timeout)
+        except asyncio.TimeoutError:
+            await self.kill()
+            return ExecutionResult(ok=False, error=f"Execution timed out after {timeout:.0f}s", timed_out=True)
+
+        if not line:
+            # Killed by RLIMIT_CPU (SIGXCPU), the memory limit or a hard crash
+            await self.process.wait()
+            return ExecutionResult(ok=False, error=f"Worker terminated (exit code {self.process.returncode}); "
+                                                   f"the code likely exceeded its CPU or memory limit")
+        data = json.loads(line)
+        if data.get("id") != request["id"]:
+            # Out of step with the worker; never hand a stale response to the caller
+            await self.kill()
+            return ExecutionResult(ok=False, error="Worker protocol error; the worker was replaced")
+        return ExecutionResult(ok=data["ok"], output=data.get("output", ""), error=data.get("error"),
+                               truncated=data.get("truncated", False))
+
+    async def kill(self):
+        if self.alive:
+            self.process.kill()
+        await self.process.wait()
+        if self.writer is not None:
+            self.writer.close()
+        if self._read_transport is not None:
+            self._read_transport.close()
+        self.workdir.cleanup()
+
+
+class PythonWorkerPool:
+    def __init__(self, size: int = PYTHON_POOL_SIZE):
+        self.size = size
+        self.idle: Optional[asyncio.Queue] = None
+        self.workers: List[PythonWorker] = []
+        self._starting: Optional[asyncio.Task] = None
+        self._replacing: Set[asyncio.Task] = set()
+        self.executions = 0
+        self.failures = 0
+        self.restarts = 0
+
+    async def start(self):
+        """Spawns and warms all workers. Safe to call more than once; retries after a failed start."""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        starting = self._starting
+        try:
+            # Shielded: a cancelled caller must not cancel the start other callers wait on
+            await asyncio.shield(starting)
+        except Exception:
+            if self._starting is starting:
+                self._starting = None
+            raise
+
+    async def _start(self):
+        self.idle = asyncio.Queue()
+        spawned = await asyncio.gather(*(PythonWorker.spawn() for _ in range(self.size)), return_exceptions=True)
+        workers = [worker for worker in spawned if isinstance(worker, PythonWorker)]
+        if len(workers) < len(spawned):
+            for worker in workers:
+                await worker.kill()
+            raise next(error for error in spawned if isinstance(error, BaseException))
+        for worker in workers:
+            self.workers.append(worker)
+            self.idle.put_nowait(worker)
+        logger.info(f"[PythonPool] {self.size} workers ready")
+
+    async def _replace(self, worker: PythonWorker):
+        await worker.kill()
+        if worker in self.workers:
+            self.workers.remove(worker)
+        self.restarts += 1
+        try:
+            fresh = await PythonWorker.spawn()
+        except Exception as e:
+            logger.error(f"[PythonPool] Failed to replace worker: {e}")
+            return
+        self.workers.append(fresh)
+        self.idle.put_nowait(fresh)
+
+    async def run(self, code: str, timeout: float = PYTHON_EXEC_TIMEOUT_SECONDS,
+                  cpu_seconds: int = PYTHON_EXEC_CPU_SECONDS, max_output: int = PYTHON_EXEC_MAX_OUTPUT) -> ExecutionResult:
+        """Executes `code` on the next free worker. Waits if all workers are busy."""
+        try:
+            await self.start()
+        except Exception as e:
+            self.failures += 1
+            return ExecutionResult(ok=False, error=f"Python workers unavailable: {e}")
+        worker = await self.idle.get()
+        healthy = False
+        try:
+            result = await worker.execute(code, timeout, cpu_seconds, max_output)
+            healthy = worker.alive and worker.tasks < PYTHON_WORKER_MAX_TASKS
+        except Exception as e:
+            result = ExecutionResult(ok=False, error=f"Worker error: {e}")
+        finally:
+            # Cancelled callers land here too; the worker may be mid-execution, so replace it
+            if healthy:
+                self.idle.put_nowait(worker)
+            else:
+                task = asyncio.ensure_future(self._replace(worker))
+                self._replacing.add(task)
+                task.add_done_callback(self._replacing.discard)
+
+        self.executions += 1
+        if not result.ok:
+            self.failures += 1
+        return result
+
+    async def shutdown(self):
+        replacing = list(self._replacing)
+        for task in replacing:
+            task.cancel()
+        await asyncio.gather(*replacing, return_exceptions=True)
+        for worker in list(self.workers):
+            await worker.kill()
+        self.workers.clear()
+        self._starting = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "idle": self.idle.qsize() if self.idle else 0,
+            "executions": self.executions,
+            "failures": self.failures,
+            "restarts": self.restarts,
+        }
+
+
+python_pool = PythonWorkerPool()
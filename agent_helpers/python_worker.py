@@ -0,0 +1,116 @@
+"""
+Sandboxed Python worker
+
+Started by `PythonWorkerPool` as `python -I python_worker.py REQUEST_FD RESPONSE_FD`,
+never imported. Pre-imports numpy/pandas, then executes one JSON request per
+line read from REQUEST_FD:
+    {"id": int, "code": str, "cpu_seconds": int, "max_output": int}
+and answers each with one JSON line on RESPONSE_FD:
+    {"id": int, "ok": bool, "output": str, "truncated": bool, "error": str | null}
+The protocol has its own pipes; fds 0-2 point at /dev/null, so os.write(1, ...),
+subprocesses and C-level printf can't write into it.
+Every execution gets a fresh namespace. Runaway CPU use trips RLIMIT_CPU and
+kills the process; the pool notices and replaces it.
+"""
+
+import io
+import os
+import sys
+import json
+import traceback
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; the pool's wall-clock timeout still applies
+    resource = None
+
+PRELOADED = {}
+for _name, _alias in (("numpy", "np"), ("pandas", "pd")):
+    try:
+        PRELOADED[_alias] = __import__(_name)
+    except ImportError:
+        pass
+
+
+class _CappedWriter(io.TextIOBase):
+    """Keeps the first `limit` characters written and drops the rest."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def write(self, text):
+        room = self.limit - self.size
+        if room > 0:
+            self.parts.append(text[:room])
+            self.size += min(len(text), room)
+        if len(text) > room:
+            self.truncated = True
+        return len(text)
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+def _limit_cpu(seconds: int):
+    """Allows `seconds` more CPU time from now; RLIMIT_CPU counts the whole process lifetime."""
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def execute(request: dict) -> dict:
+    out = _CappedWriter(int(request.get("max_output", 10000)))
+    namespace = dict(PRELOADED, __name__="__main__")
+    error = None
+    _limit_cpu(int(request.get("cpu_seconds", 0)))
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            exec(compile(request["code"], "<analysis>", "exec"), namespace)
+    except MemoryError:
+        error = "MemoryError: execution exceeded the memory limit"
+    except BaseException:
+        error = traceback.format_exc(limit=-3)
+    return {"ok": error is None, "output": out.getvalue(), "truncated": out.truncated, "error": error}
+
+
+def main():
+    request_fd, response_fd = int(sys.argv[1]), int(sys.argv[2])
+    # Subprocesses started by user code don't inherit the protocol pipes
+    os.set_inheritable(request_fd, False)
+    os.set_inheritable(response_fd, False)
+    requests = os.fdopen(request_fd, "r")
+    protocol = os.fdopen(response_fd, "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+    protocol.write(json.dumps({"ready": True, "preloaded": sorted(PRELOADED)}) + "\n")
+    protocol.flush()
+    for line in requests:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            response = execute(request)
+        except Exception as e:
+            response = {"ok": False, "output": "", "truncated": False, "error": f"Bad request: {e}"}
+        response["id"] = request_id
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
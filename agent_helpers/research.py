@@ -1,25 +1,20 @@
-from langchain_core.output_parsers import StrOutputParser
-from .prompts import classifier_prompt, analysis_prompt, source_prompt
+from .prompts import classifier_prompt, batch_classifier_prompt, analysis_prompt, source_prompt
 from agent_helpers.tools import VectorStore, web_search # Imports
-from agent_helpers.types import AgentState, Analysis, WorkItem, print_tree
+from agent_helpers.types import AgentState, Analysis, WorkItem
 from agent_helpers.cosmos_db import CosmosDB
+from agent_helpers.scheduler import limited_ainvoke
+from agent_helpers.frontier import get_frontier
+from agent_helpers.schemas import BatchClassification, Classification, llm_chain
+from agent_helpers.context import CONTEXT_BUDGETS, ContextBuilder
+from agent_helpers.research_store import get_research_store
+from agent_helpers.semantic_cache import classification_cache, classification_key, reuse_log
+from agent_helpers.metrics import span
+from agent_helpers.logs import get_logger, log_tree
 
-import json
-import re
+import asyncio
 from dataclasses import asdict, is_dataclass
 
-def parse_json_from_string(text: str) -> dict:
-    # (Use the robust parser from previous steps)
-    markdown_match = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if markdown_match:
-        try: return json.loads(markdown_match.group(1))
-        except: pass 
-    matches = list(re.finditer(r"\{.*\}", text, re.DOTALL))
-    if matches:
-        for match in reversed(matches):
-            try: return json.loads(match.group(0))
-            except: continue
-    return {"error": "Failed to parse JSON", "raw_text": text}
+logger = get_logger("research")
 
 class ResearchAgent:
     def __init__(self, llm, vector_store, web_search_tool, python_tool, chart_tool):
@@ -28,17 +23,15 @@ class ResearchAgent:
         self.web_search_tool = web_search_tool
         self.python_tool = python_tool
         self.chart_tool = chart_tool
-        print("Research Agent initialized.")
+        logger.info("Research Agent initialized.")
 
-    def get_llm_chain(self, prompt_template):
-        return prompt_template | self.llm | StrOutputParser() | parse_json_from_string
-
-    def gather_context(self, query: str) -> str:
+    async def gather_context(self, query: str) -> str:
         if not isinstance(query, str): query = str(query)
-        print(f"   [ResearchAgent] Gathering context for: '{query[:40]}...'")
+        logger.debug(f"[ResearchAgent] Gathering context for: '{query[:40]}...'")
         
-        memory_results = self.vector_store.search(query)
-        web_results = self.web_search_tool(query)
+        with span("vector_search"):
+            memory_results = await self.vector_store.asearch(query)
+        web_results = await self.web_search_tool(query)
         
         context = f"""
         --- Context from Agent Memory ---
@@ -48,51 +41,38 @@ class ResearchAgent:
         """
         return context
 
-    def classify_hypothesis(self, state: AgentState) -> dict:
-        item_to_process = state["nodes_to_process"][0]
-        remaining_nodes = state["nodes_to_process"][1:]
-        node_id = item_to_process["id"]
-        
-        # Find the node
-        node = next((h for h in state["hypothesis_tree"] if h["id"] == node_id), None)
-        if not node:
-             print(f"   [Error] Node {node_id} not found in tree. Skipping.")
-             return {"nodes_to_process": remaining_nodes}
-        
-        print(f"\n--- Executing Node: classify_hypothesis for {node_id} ---")
-        
-        # Log context analysis
-        context_log = f"I'm double-checking this hypothesis: '{node['text']}' against my research."
-        
+    async def retrieve_context(self, query: str, scratchpad_id: str = None, run_id: str = None) -> tuple:
+        """
+        Agent memory plus scratchpad documents for a query, ranked and packed into
+        the classify token budget. Documents already retrieved earlier in the run
+        are reused when they cover the query. Returns (combined_context, doc_results).
+        """
+        builder = ContextBuilder(CONTEXT_BUDGETS["classify"])
         # Get context from vector store
-        context = self.vector_store.search(node["text"])
+        with span("vector_search"):
+            builder.add_memory(await self.vector_store.asearch_results(query))
         
         # RAG Integration
-        scratchpad_id = state.get("scratchpad_id")
-        doc_context = []
+        doc_results = []
         if scratchpad_id:
             try:
-                doc_results = CosmosDB().search_documents(scratchpad_id, node["text"], top_k=3)
-                for result in doc_results:
-                    doc_context.append(f"From {result.get('filename', 'document')}: {result.get('content', '')}")
+                doc_results = await get_research_store(run_id).get_or_fetch(
+                    "documents", query, lambda: CosmosDB().asearch_documents(scratchpad_id, query, top_k=3)
+                )
+                builder.add_documents(doc_results)
             except Exception as e:
-                print(f"   [RAG] Document search failed: {e}")
-        
-        # Combine contexts
-        combined_context = context
-        if doc_context:
-            combined_context += "\n\n--- Document Context ---\n" + "\n".join(doc_context)
+                logger.error(f"[RAG] Document search failed: {e}")
         
-        chain = self.get_llm_chain(classifier_prompt)
-        response = chain.invoke({"hypothesis_text": node["text"], "context": combined_context})
-        
-        if "error" in response:
-            return {"nodes_to_process": remaining_nodes}
+        return builder.build(query), doc_results
+
+    def apply_classification(self, node: dict, response: dict, tree: list, doc_context: list) -> tuple:
+        """Updates `node` in place from a classifier response. Returns (work_item or None, decision_log)."""
+        node_id = node["id"]
 
         # Check if node already has children (force branch if so)
-        existing_children = [n for n in state["hypothesis_tree"] if n["parent_id"] == node_id]
+        existing_children = [n for n in tree if n["parent_id"] == node_id]
         if existing_children:
-            print(f"   [ResearchAgent] Node {node_id} has children. Forcing 'branch' classification.")
+            logger.info(f"[ResearchAgent] Node {node_id} has children. Forcing 'branch' classification.")
             classification = "branch"
         else:
             classification = response.get("classification", "branch")
@@ -100,37 +80,25 @@ class ResearchAgent:
         new_work_item = None
         if classification == "leaf":
             # CRITICAL FIX: Do NOT create an 'analyze' item. We are done with this node.
-            print(f"   [ResearchAgent] Node {node_id} classified as LEAF. Marking complete.")
+            logger.info(f"[ResearchAgent] Node {node_id} classified as LEAF. Marking complete.")
             new_work_item = None 
         else:
             new_work_item = WorkItem(id=node_id, action="breakdown")
             
         # Update node with classification result
         node["is_leaf"] = (classification == "leaf")
+        try:
+            node["confidence"] = float(response.get("confidence", 0.5))
+        except (TypeError, ValueError):
+            node["confidence"] = 0.5
         
         # Track tools used
-        tools_used = node.get("tools_used", [])
+        tools_used = list(node.get("tools_used", []))
         if "Web Search" not in tools_used:
             tools_used.append("Web Search")
         if doc_context and "RAG" not in tools_used:
             tools_used.append("RAG")
         node["tools_used"] = tools_used
-        
-        updated_tree = [h if h["id"] != node_id else node for h in state["hypothesis_tree"]]
-        
-        print_tree(updated_tree, title="UPDATED CLASSIFICATION")
-        
-        # Add new item if exists (Breakdown), otherwise just consume queue
-        new_nodes_to_process = remaining_nodes + ([new_work_item] if new_work_item else [])
-        
-        # Log to Cosmos DB
-        try:
-            CosmosDB().log_interaction("ResearchAgent.classify", 
-                                     {"hypothesis": node["text"], "context": combined_context}, 
-                                     response,
-                                     scratchpad_id=scratchpad_id)
-        except Exception as e:
-            print(f"   [ResearchAgent] Logging failed: {e}")
 
         # Log decision
         reasoning = response.get("reasoning", "No reasoning provided")
@@ -138,14 +106,182 @@ class ResearchAgent:
             decision_log = f"I've validated this point. It seems solid. Reasoning: {reasoning[:100]}..."
         else:
             decision_log = f"This needs more detail. I'm going to break it down further. Reasoning: {reasoning[:100]}..."
+        return new_work_item, decision_log
+
+    async def classify_hypothesis(self, state: AgentState) -> dict:
+        item_to_process = state["nodes_to_process"][0]
+        remaining_nodes = state["nodes_to_process"][1:]
+        node_id = item_to_process["id"]
+        
+        # Find the node
+        node = next((h for h in state["hypothesis_tree"] if h["id"] == node_id), None)
+        if not node:
+             logger.warning(f"[Error] Node {node_id} not found in tree. Skipping.")
+             return {"nodes_to_process": remaining_nodes}
+        # Copied: the tree in state is only changed through the patch this node returns
+        node = dict(node)
+        
+        logger.info(f"--- Executing Node: classify_hypothesis for {node_id} ---")
+        
+        # Log context analysis
+        context_log = f"I'm double-checking this hypothesis: '{node['text']}' against my research."
+        
+        scratchpad_id = state.get("scratchpad_id")
+        usage = dict(state.get("usage") or {})
+        scope, parent_context = classification_key(node, {h["id"]: h for h in state["hypothesis_tree"]}, scratchpad_id)
+        cached = await classification_cache.lookup(node["text"], scope=scope, context=parent_context)
+        if cached.hit:
+            response = cached.result["response"]
+            doc_context = cached.result["doc_context_found"]
+            context_log = reuse_log("classification", cached)
+        else:
+            combined_context, doc_context = await self.retrieve_context(node["text"], scratchpad_id, state.get("run_id"))
+
+            chain = llm_chain(self.llm, classifier_prompt, Classification)
+            response = await limited_ainvoke(chain, {"hypothesis_text": node["text"], "context": combined_context}, usage=usage)
+
+            if "error" in response:
+                return {"nodes_to_process": remaining_nodes, "usage": usage}
+            classification_cache.put(cached, {"response": response, "doc_context_found": bool(doc_context)})
+
+        new_work_item, decision_log = self.apply_classification(node, response, state["hypothesis_tree"], doc_context)
+        
+        log_tree(logger, [node], "UPDATED CLASSIFICATION")
+        
+        # Add new item if exists (Breakdown), otherwise just consume queue
+        new_nodes_to_process = get_frontier(state.get("frontier")).push(
+            remaining_nodes, [new_work_item] if new_work_item else [], [node]
+        )
+        
+        # Log to Cosmos DB
+        if not cached.hit:
+            try:
+                await asyncio.to_thread(CosmosDB().log_interaction, "ResearchAgent.classify", 
+                                         {"hypothesis": node["text"], "context": combined_context}, 
+                                         response,
+                                         scratchpad_id=scratchpad_id)
+            except Exception as e:
+                logger.error(f"[ResearchAgent] Logging failed: {e}")
 
         return {
-            "hypothesis_tree": updated_tree,
+            "hypothesis_tree": [node],
             "nodes_to_process": new_nodes_to_process,
             "last_completed_item_id": node_id,
+            "usage": usage,
             "explainability_log": [context_log, decision_log]
         }
 
+    async def classify_batch(self, state: AgentState) -> dict:
+        """
+        Classifies every queued sibling of the next node in one LLM call with one
+        shared retrieval. Siblings missing from the batch response fall back to
+        per-node calls against the same context.
+        """
+        queue = state["nodes_to_process"]
+        tree = state["hypothesis_tree"]
+        node_map = {h["id"]: h for h in tree}
+
+        head = node_map.get(queue[0]["id"])
+        if not head:
+            return await self.classify_hypothesis(state)
+
+        # Copied: the tree in state is only changed through the patch this node returns
+        siblings = [
+            dict(node_map[w["id"]]) for w in queue
+            if w["action"] == "classify" and w["id"] in node_map and node_map[w["id"]]["parent_id"] == head["parent_id"]
+        ]
+        if len(siblings) < 2:
+            return await self.classify_hypothesis(state)
+
+        batch_ids = [n["id"] for n in siblings]
+        remaining_nodes = [w for w in queue if w["id"] not in batch_ids]
+        logger.info(f"--- Executing Node: classify_hypothesis (batch) for {', '.join(batch_ids)} ---")
+
+        context_log = f"I'm double-checking {len(siblings)} related hypotheses against my research in one pass."
+
+        scratchpad_id = state.get("scratchpad_id")
+        usage = dict(state.get("usage") or {})
+
+        # Siblings classified before (or with near-identical text) are answered from the cache
+        keys = [classification_key(n, node_map, scratchpad_id) for n in siblings]
+        lookups = await asyncio.gather(*(
+            classification_cache.lookup(n["text"], scope=scope, context=parent_context)
+            for n, (scope, parent_context) in zip(siblings, keys)
+        ))
+        cached = {n["id"]: lookup for n, lookup in zip(siblings, lookups) if lookup.hit}
+        results = {node_id: lookup.result["response"] for node_id, lookup in cached.items()}
+        doc_contexts = {node_id: lookup.result["doc_context_found"] for node_id, lookup in cached.items()}
+        pending = [n for n in siblings if n["id"] not in cached]
+
+        # Siblings share their parent's topic, so one retrieval on the parent covers all of them
+        parent = node_map.get(head["parent_id"])
+        hypotheses = "\n".join(f"- [{n['id']}] {n['text']}" for n in pending)
+        combined_context = None
+        if pending:
+            query = parent["text"] if parent else " ".join(n["text"] for n in pending)
+            combined_context, doc_context = await self.retrieve_context(query, scratchpad_id, state.get("run_id"))
+
+            fresh = {}
+            if len(pending) > 1:
+                response = await limited_ainvoke(llm_chain(self.llm, batch_classifier_prompt, BatchClassification), {
+                    "parent_text": parent["text"] if parent else state["problem_statement"],
+                    "hypotheses": hypotheses,
+                    "context": combined_context
+                }, usage=usage)
+
+                if "error" not in response:
+                    for entry in response.get("classifications", []):
+                        if isinstance(entry, dict) and str(entry.get("id")) in batch_ids:
+                            fresh[str(entry["id"])] = entry
+
+            missing = [n for n in pending if n["id"] not in fresh]
+            if missing:
+                if len(pending) > 1:
+                    logger.warning(f"[ResearchAgent] Batch response missing {len(missing)} of {len(pending)} nodes. Falling back to per-node calls.")
+                chain = llm_chain(self.llm, classifier_prompt, Classification)
+                for n in missing:
+                    single = await limited_ainvoke(chain, {"hypothesis_text": n["text"], "context": combined_context}, usage=usage)
+                    if "error" not in single:
+                        fresh[n["id"]] = single
+
+            lookup_by_id = dict(zip((n["id"] for n in siblings), lookups))
+            for node_id, entry in fresh.items():
+                classification_cache.put(lookup_by_id[node_id], {"response": entry, "doc_context_found": bool(doc_context)})
+                doc_contexts[node_id] = doc_context
+            results.update(fresh)
+
+        new_work_items = []
+        decision_logs = []
+        for n in siblings:
+            if n["id"] not in results:
+                continue
+            work_item, decision_log = self.apply_classification(n, results[n["id"]], tree, doc_contexts[n["id"]])
+            if work_item:
+                new_work_items.append(work_item)
+            if n["id"] in cached:
+                decision_log = f"{reuse_log('classification', cached[n['id']])} {decision_log}"
+            decision_logs.append(f"({n['id']}) {decision_log}")
+
+        patch = [n for n in siblings if n["id"] in results]
+        log_tree(logger, patch, "UPDATED CLASSIFICATION (BATCH)")
+
+        if pending:
+            try:
+                await asyncio.to_thread(CosmosDB().log_interaction, "ResearchAgent.classify_batch",
+                                         {"hypotheses": hypotheses, "context": combined_context},
+                                         {"classifications": [results[n["id"]] for n in pending if n["id"] in results]},
+                                         scratchpad_id=scratchpad_id)
+            except Exception as e:
+                logger.error(f"[ResearchAgent] Logging failed: {e}")
+
+        return {
+            "hypothesis_tree": patch,
+            "nodes_to_process": get_frontier(state.get("frontier")).push(remaining_nodes, new_work_items, patch),
+            "last_completed_item_id": head["id"],
+            "usage": usage,
+            "explainability_log": [context_log] + decision_logs
+        }
+
     # identify_analysis removed as requested
     def identify_analysis(self, state: AgentState) -> dict:
         # Placeholder if needed, but we are removing the workflow
@@ -0,0 +1,121 @@
+"""
+Per-run Research Store
+
+Every snippet a run retrieves (web results, document chunks) is kept with its
+embedding. When a child node asks for context, the store first checks whether
+its parent's or siblings' snippets already cover the query (cosine similarity
+above `RESEARCH_REUSE_THRESHOLD`) and only goes to Tavily/Cosmos on a miss.
+"""
+
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from agent_helpers.metrics import record_cache
+from agent_helpers.logs import get_logger
+
+RESEARCH_REUSE_THRESHOLD = float(os.environ.get("RESEARCH_REUSE_THRESHOLD", 0.6))
+# A hit needs at least this many stored snippets above the threshold
+RESEARCH_REUSE_MIN_SNIPPETS = int(os.environ.get("RESEARCH_REUSE_MIN_SNIPPETS", 2))
+
+_embeddings = None
+_stores: Dict[str, "ResearchStore"] = {}
+
+logger = get_logger("research_store")
+
+
+def set_research_embeddings(embeddings):
+    """Embeddings model used by all stores. Without one, stores always fetch."""
+    global _embeddings
+    _embeddings = embeddings
+
+
+class ResearchStore:
+    def __init__(self, run_id: str, embeddings=None, threshold: float = RESEARCH_REUSE_THRESHOLD):
+        self.run_id = run_id
+        self.embeddings = embeddings
+        self.threshold = threshold
+        # kind -> stored snippets and a matrix of their unit-normalised embeddings
+        self.snippets: Dict[str, List[dict]] = {}
+        self.vectors: Dict[str, Optional[np.ndarray]] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind: str, outcome: str):
+        stats = self.stats.setdefault(kind, {"hits": 0, "misses": 0})
+        stats[outcome] += 1
+        record_cache(f"research_{kind}", outcome == "hits")
+
+    @staticmethod
+    def _normalise(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _lookup(self, kind: str, query_vector: np.ndarray, k: int) -> List[dict]:
+        matrix = self.vectors.get(kind)
+        if matrix is None:
+            return []
+        similarities = matrix @ query_vector
+        order = np.argsort(-similarities)
+        matches = [i for i in order if similarities[i] >= self.threshold]
+        if len(matches) < min(RESEARCH_REUSE_MIN_SNIPPETS, k):
+            return []
+        return [self.snippets[kind][i] for i in matches[:k]]
+
+    async def _add(self, kind: str, results: List[dict]):
+        results = [r for r in results if isinstance(r, dict) and r.get("content")]
+        if not results:
+            return
+        vectors = self._normalise(await self.embeddings.aembed_documents([r["content"] for r in results]))
+        self.snippets.setdefault(kind, []).extend(results)
+        existing = self.vectors.get(kind)
+        self.vectors[kind] = vectors if existing is None else np.vstack([existing, vectors])
+
+    async def get_or_fetch(self, kind: str, query: str, fetch: Callable[[], Awaitable[List[dict]]], k: int = 3) -> List[dict]:
+        """
+        Returns up to `k` stored snippets of `kind` that cover `query`, or calls
+        `fetch()` and stores its results. `fetch` must return dicts with "content".
+        """
+        if self.embeddings is None:
+            return await fetch()
+
+        try:
+            query_vector = self._normalise(await self.embeddings.aembed_query(query))
+            cached = self._lookup(kind, query_vector, k)
+        except Exception as e:
+            logger.warning(f"[ResearchStore] Lookup failed, fetching instead: {e}")
+            return await fetch()
+
+        if cached:
+            self._count(kind, "hits")
+            logger.debug(f"[ResearchStore] {kind} hit for '{query[:40]}...' ({len(cached)} snippets reused)")
+            return cached
+
+        self._count(kind, "misses")
+        logger.debug(f"[ResearchStore] {kind} miss for '{query[:40]}...'")
+        results = await fetch()
+        try:
+            await self._add(kind, results or [])
+        except Exception as e:
+            logger.warning(f"[ResearchStore] Failed to store results: {e}")
+        return results
+
+    def summary(self) -> str:
+        parts = [f"{kind} {s['hits']} hits / {s['misses']} misses" for kind, s in self.stats.items()]
+        return ", ".join(parts) or "no lookups"
+
+
+def get_research_store(run_id: Optional[str]) -> ResearchStore:
+    """The store for a run. Calls without a run id get a throwaway store."""
+    if not run_id:
+        return ResearchStore(None, _embeddings)
+    if run_id not in _stores:
+        _stores[run_id] = ResearchStore(run_id, _embeddings)
+    return _stores[run_id]
+
+
+def release_research_store(run_id: str):
+    store = _stores.pop(run_id, None)
+    if store:
+        logger.info(f"[ResearchStore] Run {run_id}: {store.summary()}")
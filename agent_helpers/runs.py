@@ -0,0 +1,632 @@
+"""
+Run Manager
+
+Executes agent graphs as background tasks so a run outlives the HTTP request
+that started it. Every run gets an id, graph state is checkpointed to a local
+SQLite file through LangGraph, and every SSE event is appended to a per-run
+event log. A client that reconnects with `Last-Event-ID` gets the missed
+events replayed instead of starting the run over.
+
+A run nobody is watching is cancelled once its last subscriber has been gone
+for `RUN_DISCONNECT_GRACE_SECONDS`. Cancelling the task interrupts whatever
+LLM, search or embedding call the current graph node is awaiting.
+
+Runs wait for a slot from the shared AdmissionController before executing and
+report their queue position to subscribers while they wait.
+
+Several worker processes can share the run database (see gunicorn_conf.py).
+A run executes on the worker that owns it; another worker asked for its
+events polls `run_events` and `runs.status` every RUN_POLL_SECONDS, and ends
+the stream when the owner finishes the run. If the owner process has died,
+the polling worker claims the run and resumes it from its checkpoint. The
+owner's start time is stored next to its pid (`runs.owner_started`), so a
+new process that was given a dead owner's pid does not keep its runs.
+Cancelling such a run records the request in `runs.cancel_reason`, which the
+owner picks up on its next poll, and remote subscribers stamp
+`runs.watched_at` so the owner does not cancel a run someone still watches.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import datetime
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from agent_helpers.scheduler import AdmissionController, Ticket, admission_controller
+from agent_helpers.frontier import RunBudget
+from agent_helpers.metrics import current_run, run_finished, run_started
+from agent_helpers.profiling import RunProfiler
+from agent_helpers.serialize import dumps, sse_frame
+from agent_helpers.sse import DONE_EVENT, HEARTBEAT_FRAME, SSE_HEARTBEAT_SECONDS, backlogged, coalesce
+from agent_helpers.tree import HypothesisTree, apply_tree_update, as_tree
+from agent_helpers.logs import get_logger
+
+RUNS_DB_PATH = os.environ.get("RUNS_DB_PATH", "agent_runs.sqlite")
+CHECKPOINT_DB_PATH = os.environ.get("CHECKPOINT_DB_PATH", "agent_checkpoints.sqlite")
+RUN_RETENTION_SECONDS = int(os.environ.get("RUN_RETENTION_SECONDS", 600))
+RUN_DISCONNECT_GRACE_SECONDS = float(os.environ.get("RUN_DISCONNECT_GRACE_SECONDS", 15))
+DISCONNECT_POLL_SECONDS = 1.0
+# How often runs owned by another worker are polled, and owned runs checked for cancel requests
+RUN_POLL_SECONDS = float(os.environ.get("RUN_POLL_SECONDS", 0.5))
+# How long a write waits for another worker's lock on the runs database
+RUNS_DB_BUSY_TIMEOUT_SECONDS = float(os.environ.get("RUNS_DB_BUSY_TIMEOUT_SECONDS", 10))
+
+FINISHED_STATUSES = ("done", "error", "cancelled")
+
+logger = get_logger("runs")
+
+
+def format_sse(seq: int, data: str) -> str:
+    """SSE frame with an id so the browser (or our client) can resume."""
+    return f"id: {seq}\ndata: {data}\n\n"
+
+
+def process_start(pid: int) -> Optional[int]:
+    """Start time of process `pid` in clock ticks since boot, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # starttime is field 22; the command name (field 2) may contain spaces and parentheses
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _process_alive(pid: int, started: Optional[int] = None) -> bool:
+    """Whether `pid` is running and, if `started` is known, is still the process that started then."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return started is None or process_start(pid) == started
+
+
+class RunRecord:
+    """In-memory view of a run: its inputs, status and event log."""
+
+    def __init__(self, run_id: str, inputs: dict, status: str = "pending", events: List[Tuple[int, str]] = None):
+        self.id = run_id
+        self.inputs = inputs
+        self.status = status
+        self.events: List[Tuple[int, str]] = events or []
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.cancel_timer: Optional[asyncio.TimerHandle] = None
+        self.cancel_reason: Optional[str] = None
+        self.ticket: Optional[Ticket] = None
+        # Pid and start time of the worker executing the run
+        self.owner: Optional[int] = os.getpid()
+        self.owner_started: Optional[int] = process_start(os.getpid())
+        # Nodes return tree patches; events carry the whole tree, rebuilt here from the patches
+        self.tree: Optional[HypothesisTree] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def remote(self) -> bool:
+        """Executing in another worker process; followed by polling the database."""
+        return self.owner is not None and self.owner != os.getpid() and not self.finished
+
+    @property
+    def last_event_id(self) -> int:
+        return self.events[-1][0] if self.events else 0
+
+    def summary(self) -> dict:
+        return {
+            "run_id": self.id,
+            "status": self.status,
+            "events": len(self.events),
+            "last_event_id": self.last_event_id,
+            "subscribers": self.subscribers,
+            "scratchpad_id": self.inputs.get("scratchpad_id"),
+        }
+
+
+class RunManager:
+    """
+    Owns the compiled, checkpointed graph and every run executed on it.
+
+    `graph_factory(checkpointer=...)` must return a compiled LangGraph app and
+    `event_builder(node_name, state_update, inputs)` turns one graph update into
+    the JSON payload sent to the client. `on_finish(run_id)`, if given, is called
+    once a run's task ends, to release per-run resources.
+    """
+
+    def __init__(self, graph_factory: Callable[..., Any], event_builder: Callable[[str, Any, dict], dict],
+                 db_path: str = RUNS_DB_PATH, checkpoint_path: str = CHECKPOINT_DB_PATH,
+                 admission: AdmissionController = None, on_finish: Callable[[str], None] = None):
+        self.graph_factory = graph_factory
+        self.event_builder = event_builder
+        self.on_finish = on_finish
+        self.admission = admission or admission_controller
+        self.checkpoint_path = checkpoint_path
+        self.graph = None
+        self.runs: Dict[str, RunRecord] = {}
+        self._checkpoint_conn = None
+        self._closing = False
+        self._cancel_watcher: Optional[asyncio.Task] = None
+        # Event and status writes waiting to be committed, and the task committing them
+        self._writes: List[Tuple[str, tuple]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=RUNS_DB_BUSY_TIMEOUT_SECONDS)
+        # Held for every use of `db`: the loop thread and the threads that poll for other
+        # workers' runs (and BatchManager, which shares the connection) all use it
+        self.db_lock = threading.Lock()
+        # WAL lets workers read the log while another one appends to it
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"PRAGMA busy_timeout = {int(RUNS_DB_BUSY_TIMEOUT_SECONDS * 1000)}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id TEXT PRIMARY KEY, status TEXT, inputs TEXT, created_at TEXT, updated_at TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS run_events ("
+            " run_id TEXT, seq INTEGER, data TEXT, PRIMARY KEY (run_id, seq))"
+        )
+        # owner: worker process executing the run, so several workers can share one database,
+        # and owner_started its start time, as pids are reused. cancel_reason: cancel requested through another worker. watched_at: last poll by a remote subscriber.
+        for column in ("owner INTEGER", "cancel_reason TEXT", "watched_at REAL", "owner_started INTEGER"):
+            try:
+                self.db.execute(f"ALTER TABLE runs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+        self.db.commit()
+
+    # --- LIFECYCLE ---
+    async def startup(self):
+        """Opens the checkpointer, compiles the graph and resumes interrupted runs."""
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        self._checkpoint_conn = await aiosqlite.connect(self.checkpoint_path)
+        self.graph = self.graph_factory(checkpointer=AsyncSqliteSaver(self._checkpoint_conn))
+        logger.info(f"[RunManager] Checkpointing runs to {self.checkpoint_path}")
+
+        rows = self.db.execute(
+            "SELECT id, owner, owner_started FROM runs WHERE status IN ('pending', 'running')"
+        ).fetchall()
+        for run_id, owner, owner_started in rows:
+            if not await asyncio.to_thread(self._claim, run_id, owner, owner_started):
+                continue
+            record = await self.get(run_id)
+            if record:
+                logger.info(f"[RunManager] Resuming interrupted run {run_id}")
+                self._resume(record)
+        self._cancel_watcher = asyncio.create_task(self._watch_cancel_requests())
+
+    def _claim(self, run_id: str, owner: Optional[int], owner_started: Optional[int]) -> bool:
+        """Takes over an interrupted run unless another live worker process still owns it."""
+        if owner is not None and owner != os.getpid() and _process_alive(owner, owner_started):
+            return False
+        try:
+            with self.db_lock:
+                cursor = self.db.execute(
+                    "UPDATE runs SET owner = ?, owner_started = ?, cancel_reason = NULL WHERE id = ? AND owner IS ?",
+                    (os.getpid(), process_start(os.getpid()), run_id, owner),
+                )
+                self.db.commit()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"[RunManager] Could not claim run {run_id}: {e}")
+            return False
+        return cursor.rowcount == 1
+
+    def _resume(self, record: RunRecord):
+        record.owner = os.getpid()
+        record.owner_started = process_start(os.getpid())
+        record.ticket = self.admission.enqueue(record.id, record.inputs.get("user_id"), force=True)
+        self._spawn(record, resume=True)
+
+    async def shutdown(self):
+        """Stops live tasks without marking them finished so they resume on next startup."""
+        self._closing = True
+        tasks = [record.task for record in self.runs.values() if record.task and not record.task.done()]
+        if self._cancel_watcher:
+            tasks.append(self._cancel_watcher)
+        for task in tasks:
+            task.cancel()
+        # Their checkpoint writes must finish before the connection closes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._writer:
+            await self._writer
+        if self._checkpoint_conn:
+            await self._checkpoint_conn.close()
+
+    # --- RUNS ---
+    def start(self, inputs: dict, user_id: str = None, priority: int = 0) -> RunRecord:
+        """Queues a new run. Raises QueueFullError when the admission queue is at capacity."""
+        run_id = str(uuid.uuid4())
+        ticket = self.admission.enqueue(run_id, user_id, priority)
+        inputs = dict(inputs, run_id=run_id, user_id=user_id)
+        record = RunRecord(run_id, inputs)
+        record.ticket = ticket
+        now = datetime.datetime.utcnow().isoformat()
+        with self.db_lock:
+            self.db.execute(
+                "INSERT INTO runs (id, status, inputs, created_at, updated_at, owner, owner_started)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, record.status, json.dumps(inputs), now, now, record.owner, record.owner_started),
+            )
+            self.db.commit()
+        self.runs[run_id] = record
+        self._spawn(record)
+        return record
+
+    async def get(self, run_id: str) -> Optional[RunRecord]:
+        """Returns a live run, or rebuilds a finished/interrupted one from the run log."""
+        record = self.runs.get(run_id)
+        if record is not None:
+            if record.remote:
+                await self._poll_remote(record)
+            return record
+
+        row, events = await asyncio.to_thread(self._read_run, run_id)
+        if not row:
+            return None
+        # Another lookup may have loaded the run while this one was reading
+        if run_id in self.runs:
+            return self.runs[run_id]
+        record = RunRecord(run_id, json.loads(row[1]), status=row[0], events=[tuple(e) for e in events])
+        record.owner, record.owner_started = row[2], row[3]
+        self.runs[run_id] = record
+        if record.finished:
+            self._schedule_eviction(record)
+        return record
+
+    def _read_run(self, run_id: str) -> Tuple[Optional[tuple], list]:
+        with self.db_lock:
+            row = self.db.execute(
+                "SELECT status, inputs, owner, owner_started FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            if not row:
+                return None, []
+            events = self.db.execute(
+                "SELECT seq, data FROM run_events WHERE run_id = ? ORDER BY seq", (run_id,)
+            ).fetchall()
+        return row, events
+
+    async def load_tree(self, run_id: str) -> Optional[list]:
+        """Latest checkpointed hypothesis tree for a run, so restarts need not re-send it."""
+        if not self.graph:
+            return None
+        snapshot = await self.graph.aget_state({"configurable": {"thread_id": run_id}})
+        if not snapshot or not snapshot.values:
+            return None
+        return snapshot.values.get("hypothesis_tree")
+
+    def cancel(self, run_id: str, reason: str = "Cancelled by user") -> bool:
+        """
+        Cancels a live run. Returns False if it is unknown or already finished.
+        A run owned by another worker is cancelled by that worker on its next poll.
+        """
+        record = self.runs.get(run_id)
+        if record and record.remote:
+            return self._request_cancel(run_id, reason)
+        if not record or record.finished or not record.task or record.task.done():
+            return False
+        logger.info(f"[RunManager] Cancelling run {run_id}: {reason}")
+        record.cancel_reason = reason
+        record.task.cancel()
+        return True
+
+    async def stream(self, run_id: str, last_event_id: int = 0, request=None) -> AsyncIterator[str]:
+        """
+        Yields SSE frames after `last_event_id`, then follows the run until it finishes.
+        A run owned by another worker is followed through the database.
+        If `request` is given, stops following once the client has disconnected.
+        A backlog the client has fallen behind on is coalesced (see sse.py), and a
+        heartbeat comment is sent when nothing else has been for a while.
+        """
+        record = await self.get(run_id)
+        if not record:
+            yield sse_frame({'explainability_log': [f'Error: Unknown run {run_id}.']})
+            return
+
+        self._attach(record)
+        try:
+            cursor = last_event_id
+            last_sent = time.monotonic()
+            while True:
+                # Sequence numbers start at 1 and are contiguous, so they double as list offsets
+                pending = record.events[cursor:]
+                if backlogged(pending):
+                    pending = await asyncio.to_thread(coalesce, pending)
+                for seq, data in pending:
+                    yield format_sse(seq, data)
+                    cursor = seq
+                if pending:
+                    last_sent = time.monotonic()
+
+                if record.finished and cursor >= record.last_event_id:
+                    return
+
+                timeout = min(DISCONNECT_POLL_SECONDS, max(0.0, last_sent + SSE_HEARTBEAT_SECONDS - time.monotonic()))
+                if record.remote:
+                    await asyncio.sleep(min(timeout, RUN_POLL_SECONDS))
+                    await self._poll_remote(record, watching=True)
+                else:
+                    async with record.changed:
+                        try:
+                            await asyncio.wait_for(
+                                record.changed.wait_for(lambda: record.last_event_id > cursor or record.finished),
+                                timeout=timeout,
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+
+                if time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS and record.last_event_id <= cursor:
+                    yield HEARTBEAT_FRAME
+                    last_sent = time.monotonic()
+
+                if request is not None and await request.is_disconnected():
+                    logger.info(f"[RunManager] Client disconnected from run {run_id}")
+                    return
+        finally:
+            self._detach(record)
+
+    # --- OTHER WORKERS' RUNS ---
+    def _read_remote(self, run_id: str, after: int, watching: bool = False) -> Tuple[Optional[tuple], list, bool]:
+        """
+        New events and the status of another worker's run; runs in a thread. If
+        the owner has died the run is claimed, and the last value is True.
+        """
+        with self.db_lock:
+            if watching:
+                self.db.execute("UPDATE runs SET watched_at = ? WHERE id = ?", (time.time(), run_id))
+                self.db.commit()
+            # Status first: once it reads finished, every event of the run is already in the log
+            row = self.db.execute("SELECT status, owner, owner_started FROM runs WHERE id = ?", (run_id,)).fetchone()
+            events = self.db.execute(
+                "SELECT seq, data FROM run_events WHERE run_id = ? AND seq > ? ORDER BY seq", (run_id, after)
+            ).fetchall()
+        claimed = (row is not None and row[0] not in FINISHED_STATUSES and row[1] != os.getpid()
+                   and self._claim(run_id, row[1], row[2]))
+        return row, events, claimed
+
+    async def _poll_remote(self, record: RunRecord, watching: bool = False):
+        """
+        Catches up on a run owned by another worker, and takes it over if that
+        worker has died. `watching` marks the run as followed by a subscriber here.
+        """
+        try:
+            row, events, claimed = await asyncio.to_thread(
+                self._read_remote, record.id, record.last_event_id, watching
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning(f"[RunManager] Polling run {record.id} failed, retrying: {e}")
+            return
+        # A concurrent poll may have added some of these already
+        record.events.extend(tuple(e) for e in events if e[0] > record.last_event_id)
+        if not row or not record.remote:
+            return
+        record.status, record.owner, record.owner_started = row
+        if record.finished:
+            self._schedule_eviction(record)
+        elif claimed:
+            logger.warning(f"[RunManager] Worker {row[1]} is gone; resuming run {record.id}")
+            self._resume(record)
+
+    def _request_cancel(self, run_id: str, reason: str) -> bool:
+        try:
+            with self.db_lock:
+                cursor = self.db.execute(
+                    "UPDATE runs SET cancel_reason = ? WHERE id = ? AND status IN ('pending', 'running')",
+                    (reason, run_id),
+                )
+                self.db.commit()
+        except sqlite3.OperationalError as e:
+            logger.error(f"[RunManager] Could not request cancellation of run {run_id}: {e}")
+            return False
+        return cursor.rowcount == 1
+
+    def _read_cancel_requests(self) -> List[Tuple[str, str]]:
+        with self.db_lock:
+            return self.db.execute(
+                "SELECT id, cancel_reason FROM runs WHERE owner = ? AND cancel_reason IS NOT NULL"
+                " AND status IN ('pending', 'running')", (os.getpid(),)
+            ).fetchall()
+
+    async def _watch_cancel_requests(self):
+        """Cancels this worker's runs when a cancel for them arrives through another worker."""
+        while True:
+            await asyncio.sleep(RUN_POLL_SECONDS)
+            if not any(record.task and not record.task.done() for record in self.runs.values()):
+                continue
+            try:
+                requests = await asyncio.to_thread(self._read_cancel_requests)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"[RunManager] Checking for cancel requests failed: {e}")
+                continue
+            for run_id, reason in requests:
+                record = self.runs.get(run_id)
+                if record and not record.cancel_reason:
+                    self.cancel(run_id, reason)
+
+    def _watched_elsewhere(self, run_id: str) -> bool:
+        with self.db_lock:
+            row = self.db.execute("SELECT watched_at FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return bool(row and row[0] and time.time() - row[0] < RUN_DISCONNECT_GRACE_SECONDS)
+
+    # --- INTERNALS ---
+    def _attach(self, record: RunRecord):
+        record.subscribers += 1
+        if record.cancel_timer:
+            record.cancel_timer.cancel()
+            record.cancel_timer = None
+
+    def _detach(self, record: RunRecord):
+        record.subscribers -= 1
+        # The owner decides about runs followed from another worker, from their watched_at
+        if record.subscribers == 0 and not record.finished and not record.remote:
+            # Give the client a chance to reconnect with Last-Event-ID before dropping the work
+            record.cancel_timer = asyncio.get_event_loop().call_later(
+                RUN_DISCONNECT_GRACE_SECONDS, self._cancel_unwatched, record
+            )
+
+    def _cancel_unwatched(self, record: RunRecord):
+        record.cancel_timer = None
+        if record.subscribers or record.finished:
+            return
+        try:
+            watched = self._watched_elsewhere(record.id)
+        except sqlite3.OperationalError:
+            watched = False
+        if watched:
+            record.cancel_timer = asyncio.get_event_loop().call_later(
+                RUN_DISCONNECT_GRACE_SECONDS, self._cancel_unwatched, record
+            )
+            return
+        self.cancel(record.id, "Client disconnected")
+
+    def _spawn(self, record: RunRecord, resume: bool = False):
+        record.task = asyncio.create_task(self._execute(record, resume))
+
+    async def _execute(self, record: RunRecord, resume: bool):
+        budget = RunBudget.from_dict(record.inputs.get("budget"))
+        config = {"configurable": {"thread_id": record.id}, "recursion_limit": budget.recursion_limit()}
+        graph_input = record.inputs
+        if resume:
+            snapshot = await self.graph.aget_state(config)
+            # Only continue from the checkpoint if the run got far enough to write one
+            if snapshot and snapshot.values:
+                graph_input = None
+                record.tree = as_tree(snapshot.values.get("hypothesis_tree"))
+
+        # Attributes work outside the nodes (tree saves in the event builder) to this run's trace
+        current_run.set(record.id)
+        started = False
+        profiler = None
+        try:
+            await self._wait_for_slot(record)
+            await self._set_status(record, "running")
+            run_started(record.id)
+            started = True
+            if record.inputs.get("profile"):
+                profiler = RunProfiler.start_for(record.id, record.inputs["profile"])
+            # "custom" carries provisional output that nodes push while they are still running
+            async for mode, output in self.graph.astream(graph_input, config=config, stream_mode=["updates", "custom"]):
+                if mode == "custom":
+                    await self._append(record, dumps(dict(output, run_id=record.id)))
+                    continue
+                for node_name, state_update in output.items():
+                    if isinstance(state_update, dict) and "hypothesis_tree" in state_update:
+                        record.tree = apply_tree_update(record.tree, state_update["hypothesis_tree"])
+                        state_update = dict(state_update, hypothesis_tree=record.tree)
+                    # The builder persists the tree to Cosmos, so keep it (and encoding the tree) off the event loop
+                    data = await asyncio.to_thread(self._encode_event, record, node_name, state_update)
+                    await self._append(record, data)
+
+            await self._append(record, DONE_EVENT)
+            await self._set_status(record, "done")
+
+        except asyncio.CancelledError:
+            if not self._closing:
+                reason = record.cancel_reason or "Cancelled"
+                await self._append(record, dumps({
+                    "run_id": record.id,
+                    "explainability_log": [f"Run cancelled: {reason}."],
+                    "activity": {"node": "cancelled", "status": "done"},
+                }))
+                await self._append(record, DONE_EVENT)
+                await self._set_status(record, "cancelled")
+            raise
+
+        except Exception as e:
+            error_msg = f"Agent Runtime Error: {str(e)}"
+            logger.exception(f"[RunManager] Run {record.id} failed: {error_msg}")
+            await self._append(record, dumps({
+                "run_id": record.id,
+                "explainability_log": [error_msg],
+                "activity": {"node": "error", "status": "done"},
+            }))
+            await self._set_status(record, "error")
+
+        finally:
+            if profiler:
+                # On the loop thread: cProfile can only be disabled from the thread that enabled it
+                await profiler.stop()
+            if started:
+                run_finished(record.id, record.status)
+            if record.ticket:
+                await self.admission.release(record.ticket)
+            if self.on_finish:
+                self.on_finish(record.id)
+
+    def _encode_event(self, record: RunRecord, node_name: str, state_update: Any) -> str:
+        payload = self.event_builder(node_name, state_update, record.inputs)
+        payload["run_id"] = record.id
+        return dumps(payload)
+
+    async def _wait_for_slot(self, record: RunRecord):
+        if not record.ticket:
+            return
+
+        async def report_position(position: int, queued: int):
+            await self._append(record, dumps({
+                "run_id": record.id,
+                "queue": {"position": position, "queued": queued},
+                "explainability_log": [f"Waiting for a free agent slot (position {position} of {queued})."],
+                "activity": {"node": "queue", "status": "working"},
+            }))
+
+        await self.admission.wait(record.ticket, report_position)
+
+    async def _append(self, record: RunRecord, data: str):
+        seq = record.last_event_id + 1
+        record.events.append((seq, data))
+        self._write("INSERT INTO run_events (run_id, seq, data) VALUES (?, ?, ?)", (record.id, seq, data))
+        async with record.changed:
+            record.changed.notify_all()
+
+    async def _set_status(self, record: RunRecord, status: str):
+        record.status = status
+        self._write(
+            "UPDATE runs SET status = ?, updated_at = ? WHERE id = ?",
+            (status, datetime.datetime.utcnow().isoformat(), record.id),
+        )
+        async with record.changed:
+            record.changed.notify_all()
+        if record.finished:
+            self._schedule_eviction(record)
+
+    def _write(self, sql: str, params: tuple):
+        """
+        Queues a run log write. Writes are committed in order, a batch per
+        transaction, in a thread: subscribers here read the in-memory log, so
+        only replay and other workers wait for them.
+        """
+        self._writes.append((sql, params))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._flush_writes())
+
+    async def _flush_writes(self):
+        while self._writes:
+            batch, self._writes = self._writes, []
+            try:
+                await asyncio.to_thread(self._commit, batch)
+            except sqlite3.OperationalError as e:
+                # Still delivered to this worker's subscribers; only replay from the log loses them
+                logger.error(f"[RunManager] Could not persist {len(batch)} run log writes: {e}")
+
+    def _commit(self, batch: List[Tuple[str, tuple]]):
+        with self.db_lock:
+            try:
+                for sql, params in batch:
+                    self.db.execute(sql, params)
+                self.db.commit()
+            except sqlite3.OperationalError:
+                self.db.rollback()
+                raise
+
+    def _schedule_eviction(self, record: RunRecord):
+        # Finished runs stay replayable from SQLite; only drop the in-memory copy
+        asyncio.get_event_loop().call_later(RUN_RETENTION_SECONDS, self.runs.pop, record.id, None)
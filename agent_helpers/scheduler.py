@@ -0,0 +1,296 @@
+"""
+Run Scheduler
+
+Two layers of flow control shared by every run in the process:
+
+1. Admission control: a bounded queue of runs waiting for one of
+   `MAX_CONCURRENT_RUNS` slots. Higher priority goes first, and among equal
+   priorities the user with the fewest active (then recently served) runs
+   goes first, so one user submitting a burst cannot starve everyone else.
+   The user and priority of an HTTP run come from `admission_identity`:
+   callers are keyed by client address and cannot raise their priority,
+   unless they present SCHEDULER_TOKEN.
+2. Provider rate limits: token buckets per provider for requests/min and
+   tokens/min, so bursts queue locally instead of turning into 429s.
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from agent_helpers.metrics import llm_metrics_callback, span
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", 4))
+MAX_QUEUED_RUNS = int(os.environ.get("MAX_QUEUED_RUNS", 100))
+# Callers sending this as X-Scheduler-Token choose their own fairness key and priority
+SCHEDULER_TOKEN = os.environ.get("SCHEDULER_TOKEN", "")
+# Key clients by the first X-Forwarded-For address; only safe behind a proxy that sets it
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "0") == "1"
+# Highest priority other callers get; they can still lower theirs
+MAX_UNTRUSTED_PRIORITY = 0
+
+# Completion budget reserved per LLM call on top of the prompt estimate
+COMPLETION_TOKENS_ESTIMATE = 600
+
+
+class QueueFullError(Exception):
+    """Raised when the run queue is at capacity."""
+
+
+def estimate_tokens(value: Any) -> int:
+    """Cheap token estimate (~4 chars per token) for rate limiting."""
+    if isinstance(value, dict):
+        return sum(estimate_tokens(v) for v in value.values())
+    return len(str(value)) // 4 + 1
+
+
+# ==========================================
+# PROVIDER RATE LIMITS
+# ==========================================
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` units per second up to `capacity`."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Waits until `amount` units are available and takes them. Returns seconds waited."""
+        # A single request larger than the bucket would never fit; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        # The lock keeps waiters FIFO so large requests are not starved by small ones
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return waited
+                delay = (amount - self.available) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+class ProviderLimiter:
+    """Requests/min and tokens/min limits for one upstream provider. A limit of 0 disables it."""
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self, tokens: int = 0):
+        waited = 0.0
+        if self.requests:
+            waited += await self.requests.acquire(1)
+        if self.tokens and tokens:
+            waited += await self.tokens.acquire(tokens)
+        self.calls += 1
+        if waited:
+            self.throttled += 1
+            self.wait_seconds += waited
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+# Provider quotas are per account, so with several worker processes each gets an equal share
+WORKER_COUNT = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+PROVIDER_LIMITS = {
+    "openai": ProviderLimiter(
+        "openai",
+        requests_per_minute=float(os.environ.get("OPENAI_RPM", 500)) / WORKER_COUNT,
+        tokens_per_minute=float(os.environ.get("OPENAI_TPM", 200000)) / WORKER_COUNT,
+    ),
+    "tavily": ProviderLimiter(
+        "tavily",
+        requests_per_minute=float(os.environ.get("TAVILY_RPM", 100)) / WORKER_COUNT,
+    ),
+}
+
+
+def provider_limiter(name: str) -> ProviderLimiter:
+    if name not in PROVIDER_LIMITS:
+        PROVIDER_LIMITS[name] = ProviderLimiter(name)
+    return PROVIDER_LIMITS[name]
+
+
+def _llm_config(usage: dict = None) -> dict:
+    callbacks = [llm_metrics_callback]
+    if usage is not None:
+        from agent_helpers.frontier import TokenUsageCallback
+        callbacks.append(TokenUsageCallback(usage))
+    return {"callbacks": callbacks}
+
+
+async def limited_ainvoke(chain, inputs: dict, provider: str = "openai", usage: dict = None):
+    """
+    Invokes a chain after reserving request and token budget with the provider limiter.
+    If `usage` is given, the tokens reported by the LLM are added to it.
+    """
+    with span("rate_limit"):
+        await provider_limiter(provider).acquire(tokens=estimate_tokens(inputs) + COMPLETION_TOKENS_ESTIMATE)
+    return await chain.ainvoke(inputs, config=_llm_config(usage))
+
+
+async def limited_astream(chain, inputs: dict, provider: str = "openai", usage: dict = None):
+    """Streaming counterpart of `limited_ainvoke`; yields the chain's output chunks."""
+    with span("rate_limit"):
+        await provider_limiter(provider).acquire(tokens=estimate_tokens(inputs) + COMPLETION_TOKENS_ESTIMATE)
+    async for chunk in chain.astream(inputs, config=_llm_config(usage)):
+        yield chunk
+
+
+# ==========================================
+# ADMISSION CONTROL
+# ==========================================
+def client_address(request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return request.client.host if request.client else "unknown"
+
+
+def trusted_caller(request) -> bool:
+    """Whether the request carries the scheduler token."""
+    return bool(SCHEDULER_TOKEN) and request.headers.get("x-scheduler-token") == SCHEDULER_TOKEN
+
+
+def admission_identity(request, user_id: str = None, priority: int = 0) -> Tuple[str, int]:
+    """
+    Fairness key and priority for a run requested over HTTP. The body's
+    `user_id` and `priority` are only honoured for trusted callers; anyone
+    else could otherwise pick a fresh user per run, or outrank everyone.
+    """
+    client = f"client:{client_address(request)}"
+    if trusted_caller(request):
+        return user_id or client, priority
+    return client, min(priority, MAX_UNTRUSTED_PRIORITY)
+
+
+class Ticket:
+    """A run's place in the admission queue."""
+
+    _counter = itertools.count()
+
+    def __init__(self, key: str, user: str, priority: int = 0):
+        self.key = key
+        self.user = user
+        self.priority = priority
+        self.seq = next(Ticket._counter)
+        self.granted = False
+
+
+class AdmissionController:
+    """Bounded priority queue in front of a fixed number of run slots."""
+
+    def __init__(self, max_active: int = MAX_CONCURRENT_RUNS, max_queued: int = MAX_QUEUED_RUNS):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.waiting: List[Ticket] = []
+        self.active = 0
+        self.active_by_user: Dict[str, int] = {}
+        # Slots granted per user since the queue was last empty; breaks ties between users
+        self.served_by_user: Dict[str, int] = {}
+        self.changed = asyncio.Condition()
+
+    def enqueue(self, key: str, user: str, priority: int = 0, force: bool = False) -> Ticket:
+        """Adds a run to the queue. Raises QueueFullError unless `force` (used for resumed runs)."""
+        if not force and len(self.waiting) >= self.max_queued:
+            raise QueueFullError(f"Run queue is full ({self.max_queued} waiting)")
+        ticket = Ticket(key, user or "anonymous", priority)
+        self.waiting.append(ticket)
+        return ticket
+
+    def _ordered(self) -> List[Ticket]:
+        return sorted(
+            self.waiting,
+            key=lambda t: (
+                -t.priority,
+                self.active_by_user.get(t.user, 0),
+                self.served_by_user.get(t.user, 0),
+                t.seq,
+            ),
+        )
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based queue position, or 0 once the ticket holds a slot."""
+        if ticket.granted:
+            return 0
+        return self._ordered().index(ticket) + 1
+
+    def _dispatch(self) -> bool:
+        granted = False
+        while self.active < self.max_active and self.waiting:
+            ticket = self._ordered()[0]
+            self.waiting.remove(ticket)
+            ticket.granted = True
+            self.active += 1
+            self.active_by_user[ticket.user] = self.active_by_user.get(ticket.user, 0) + 1
+            self.served_by_user[ticket.user] = self.served_by_user.get(ticket.user, 0) + 1
+            granted = True
+        if not self.waiting:
+            self.served_by_user.clear()
+        return granted
+
+    async def wait(self, ticket: Ticket, on_position: Callable[[int, int], Awaitable[None]] = None):
+        """Waits for a slot, reporting `(position, queue_length)` whenever the position changes."""
+        last_position = None
+        while True:
+            async with self.changed:
+                if self._dispatch():
+                    self.changed.notify_all()
+                position = self.position(ticket)
+                if ticket.granted:
+                    return
+                if position == last_position:
+                    await self.changed.wait()
+                    continue
+            last_position = position
+            if on_position:
+                await on_position(position, len(self.waiting))
+
+    async def release(self, ticket: Ticket):
+        """Frees the ticket's slot, or drops it from the queue if it never got one."""
+        async with self.changed:
+            if ticket.granted:
+                ticket.granted = False
+                self.active -= 1
+                self.active_by_user[ticket.user] -= 1
+                if not self.active_by_user[ticket.user]:
+                    del self.active_by_user[ticket.user]
+            elif ticket in self.waiting:
+                self.waiting.remove(ticket)
+            self._dispatch()
+            self.changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "queued": len(self.waiting),
+            "max_queued": self.max_queued,
+            "providers": {name: limiter.stats() for name, limiter in PROVIDER_LIMITS.items()},
+        }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,95 @@
+"""
+Typed LLM output schemas
+
+Used by the structured-output path (`LLM_OUTPUT_MODE=structured`): the model
+is bound with `with_structured_output`, so responses arrive schema-validated
+instead of as free-form text. When the provider's parse still fails, the raw
+output is repaired locally and validated against the same model.
+`llm_chain` builds the chain for either mode.
+"""
+
+import os
+from typing import List, Literal, Optional, Type
+
+from langchain_core.output_parsers import StrOutputParser
+from pydantic import BaseModel, Field, ValidationError
+
+from agent_helpers.json_stream import parse_json_from_string, record_parse
+from agent_helpers.logs import get_logger
+
+# "text" parses free-form completions, "structured" binds the LLM to typed schemas
+LLM_OUTPUT_MODE = os.environ.get("LLM_OUTPUT_MODE", "text")
+
+logger = get_logger("schemas")
+
+
+class HypothesisItem(BaseModel):
+    text: str = Field(description="The hypothesis statement")
+    reasoning: str = Field(default="", description="Why this hypothesis follows from the research")
+
+
+class TopHypotheses(BaseModel):
+    hypotheses: List[HypothesisItem]
+
+
+class Breakdown(BaseModel):
+    sub_hypotheses: List[HypothesisItem]
+
+
+class Classification(BaseModel):
+    classification: Literal["leaf", "branch"]
+    confidence: float = Field(default=0.5, ge=0, le=1, description="How valuable a further breakdown would be")
+    reasoning: str = ""
+
+
+class SiblingClassification(Classification):
+    id: str = Field(description="Id of the hypothesis being classified")
+
+
+class BatchClassification(BaseModel):
+    classifications: List[SiblingClassification]
+
+
+def _raw_text(raw) -> str:
+    """Text of a raw AIMessage: JSON content, or the arguments of the first tool call."""
+    if raw is None:
+        return ""
+    content = getattr(raw, "content", "") or ""
+    if content:
+        return content if isinstance(content, str) else str(content)
+    tool_calls = (getattr(raw, "additional_kwargs", {}) or {}).get("tool_calls") or []
+    if tool_calls:
+        return tool_calls[0].get("function", {}).get("arguments", "")
+    return ""
+
+
+def structured_result(output: dict, schema: Type[BaseModel]) -> dict:
+    """
+    Turns `with_structured_output(..., include_raw=True)` output into the plain
+    dict the agents consume, repairing the raw text locally if parsing failed.
+    """
+    source = f"structured.{schema.__name__}"
+    parsed = output.get("parsed")
+    if parsed is not None and output.get("parsing_error") is None:
+        record_parse(source, "parsed")
+        return parsed.model_dump()
+
+    text = _raw_text(output.get("raw"))
+    data = parse_json_from_string(text, source=f"{source}.repair")
+    if "error" not in data:
+        try:
+            validated = schema.model_validate(data)
+            record_parse(source, "repaired")
+            return validated.model_dump()
+        except ValidationError as e:
+            logger.warning(f"[Structured] {schema.__name__} failed validation after repair: {e}")
+    record_parse(source, "failed")
+    return {"error": f"Failed to parse {schema.__name__}", "raw_text": text}
+
+
+def llm_chain(llm, prompt_template, schema: Optional[Type[BaseModel]] = None):
+    """prompt | llm chain returning a dict: schema-bound in structured mode, else parsed from the text."""
+    if schema is not None and LLM_OUTPUT_MODE == "structured":
+        structured_llm = llm.with_structured_output(schema, include_raw=True)
+        return prompt_template | structured_llm | (lambda output: structured_result(output, schema))
+    return prompt_template | llm | StrOutputParser() | parse_json_from_string
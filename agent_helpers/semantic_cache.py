@@ -0,0 +1,182 @@
+"""
+Semantic LLM Result Cache
+
+Restarting a node after a small wording edit used to regenerate its whole
+subtree. Breakdown and classification results are cached against an embedding
+of the hypothesis text, and a new request whose text is within
+`SEMANTIC_CACHE_MAX_DISTANCE` cosine distance of a cached one reuses its result.
+
+Entries are scoped (scratchpad, prompt parameters) so results are never reused
+across different documents or settings, and evicted LRU-first once the cache
+holds `SEMANTIC_CACHE_SIZE` entries or after `SEMANTIC_CACHE_TTL_SECONDS`.
+Runs without a scratchpad pass no scope and bypass the cache: nothing ties
+one guest's run to another's. A classification also depends on the node's
+parent and siblings, so `classification_key` embeds the parent's text with
+the node's and puts the siblings' texts in the scope.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+from agent_helpers.metrics import record_cache
+from agent_helpers.logs import get_logger
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_MAX_DISTANCE = float(os.environ.get("SEMANTIC_CACHE_MAX_DISTANCE", 0.08))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 1000))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 24 * 3600))
+
+_embeddings = None
+
+logger = get_logger("semantic_cache")
+
+
+def set_cache_embeddings(embeddings):
+    """Embeddings model used by all caches. Without one, every lookup misses."""
+    global _embeddings
+    _embeddings = embeddings
+
+
+@dataclass
+class CacheLookup:
+    text: str
+    scope: Optional[Tuple]
+    vector: Optional[np.ndarray] = None
+    result: Optional[dict] = None  # Set on a hit
+    distance: Optional[float] = None
+    matched_text: Optional[str] = None
+
+    @property
+    def hit(self) -> bool:
+        return self.result is not None
+
+
+@dataclass
+class CacheEntry:
+    text: str
+    scope: Tuple
+    vector: np.ndarray
+    result: dict
+    created_at: float
+
+
+class SemanticCache:
+    def __init__(self, name: str, max_distance: float = SEMANTIC_CACHE_MAX_DISTANCE,
+                 max_entries: int = SEMANTIC_CACHE_SIZE, ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Ordered oldest-used first, so popitem(last=False) evicts the LRU entry
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for key in [k for k, e in self.entries.items() if e.created_at < cutoff]:
+            del self.entries[key]
+            self.evictions += 1
+
+    def nearest(self, vector: np.ndarray, scope: Tuple) -> Tuple[Optional[int], float]:
+        """Key and cosine distance of the closest live entry in `scope`."""
+        best_key, best_distance = None, float("inf")
+        for key, entry in self.entries.items():
+            if entry.scope != scope:
+                continue
+            distance = 1.0 - float(entry.vector @ vector)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key, best_distance
+
+    async def lookup(self, text: str, scope: Optional[Tuple] = (), context: str = "") -> CacheLookup:
+        """
+        Nearest cached result for `text` (embedded after `context`, if given).
+        A `scope` of None always misses, and `put` ignores the lookup.
+        """
+        lookup = CacheLookup(text=text, scope=scope)
+        if not SEMANTIC_CACHE_ENABLED or _embeddings is None or scope is None:
+            return lookup
+        try:
+            lookup.vector = self._normalise(await _embeddings.aembed_query(f"{context}\n{text}" if context else text))
+        except Exception as e:
+            logger.warning(f"[SemanticCache] Embedding failed, skipping cache: {e}")
+            return lookup
+
+        self._expire()
+        key, distance = self.nearest(lookup.vector, scope)
+        if key is not None and distance <= self.max_distance:
+            entry = self.entries[key]
+            self.entries.move_to_end(key)
+            self.hits += 1
+            record_cache(f"semantic_{self.name}", True)
+            lookup.result = entry.result
+            lookup.distance = distance
+            lookup.matched_text = entry.text
+            logger.debug(f"[SemanticCache] {self.name} hit (distance {distance:.3f}) for '{text[:40]}...'")
+        else:
+            self.misses += 1
+            record_cache(f"semantic_{self.name}", False)
+        return lookup
+
+    def put(self, lookup: CacheLookup, result: dict):
+        """Caches `result` for a missed lookup. Failed responses are never cached."""
+        if lookup.vector is None or not isinstance(result, dict) or "error" in result:
+            return
+        self.entries[self._next_key] = CacheEntry(lookup.text, lookup.scope, lookup.vector, result, time.time())
+        self._next_key += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "max_distance": self.max_distance,
+        }
+
+
+def reuse_log(kind: str, lookup: CacheLookup) -> str:
+    """Explainability line for a reused result."""
+    if lookup.matched_text == lookup.text:
+        return f"I've already worked out the {kind} for this exact point, so I'm reusing it."
+    return (f"This is nearly identical to '{lookup.matched_text[:80]}' (distance {lookup.distance:.3f}), "
+            f"so I'm reusing that {kind} instead of starting over.")
+
+
+def classification_key(node: dict, node_map: Mapping[str, dict], scratchpad_id: Optional[str]) -> Tuple[Optional[Tuple], str]:
+    """
+    (scope, context) for classifying `node`. Excluding the node itself from
+    its siblings also keeps siblings from matching each other.
+    """
+    if not scratchpad_id:
+        return None, ""
+    parent = node_map.get(node.get("parent_id"))
+    if not parent:
+        return (scratchpad_id, ()), ""
+    siblings = tuple(sorted(
+        node_map[child_id]["text"] for child_id in parent.get("children_ids") or ()
+        if child_id != node["id"] and child_id in node_map
+    ))
+    return (scratchpad_id, siblings), parent["text"]
+
+
+breakdown_cache = SemanticCache("breakdown")
+classification_cache = SemanticCache("classification")
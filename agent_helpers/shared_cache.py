@@ -0,0 +1,280 @@
+"""
+Shared Cache Tier
+
+With several worker processes, per-process caches mean every worker pays for
+the same embeddings, searches and completions. This module gives all workers
+on a machine (or a cluster, with Redis) one key-value cache:
+
+- Redis when `REDIS_URL` is set and the `redis` package is installed
+- LMDB (memory-mapped, multi-process safe) when `lmdb` is installed
+- SQLite in WAL mode otherwise, which needs nothing beyond the stdlib
+
+Values are JSON. Keys are namespaced and hashed, so callers can pass any text.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, List, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from agent_helpers.metrics import record_cache
+from agent_helpers.logs import get_logger
+
+SHARED_CACHE_BACKEND = os.environ.get("SHARED_CACHE_BACKEND", "auto")  # auto | redis | lmdb | sqlite | off
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "shared_cache")
+REDIS_URL = os.environ.get("REDIS_URL")
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", 3600))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# Completions are sampled at temperature 0.7, so exact-prompt reuse is opt-in
+SHARED_LLM_CACHE = os.environ.get("SHARED_LLM_CACHE", "0") == "1"
+LMDB_MAP_SIZE = int(os.environ.get("LMDB_MAP_SIZE_MB", 1024)) * 1024 * 1024
+
+logger = get_logger("shared_cache")
+
+
+def cache_key(namespace: str, *parts: str) -> str:
+    digest = hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+class SharedCache:
+    """Backend interface. `ttl` is in seconds; None keeps the entry until evicted."""
+    name = "none"
+
+    def get(self, key: str) -> Optional[Any]:
+        return None
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        return [self.get(k) for k in keys]
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class RedisCache(SharedCache):
+    name = "redis"
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def get_many(self, keys):
+        return [json.loads(raw) if raw is not None else None for raw in self.client.mget(keys)] if keys else []
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+
+# LMDB has no expiry, so entries carry their own deadline
+def _wrap(value: Any, ttl: Optional[int]) -> bytes:
+    return json.dumps({"e": time.time() + ttl if ttl else None, "v": value}).encode()
+
+
+def _unwrap(raw: Optional[bytes]) -> Optional[Any]:
+    if raw is None:
+        return None
+    entry = json.loads(raw)
+    if entry["e"] is not None and entry["e"] < time.time():
+        return None
+    return entry["v"]
+
+
+class LMDBCache(SharedCache):
+    name = "lmdb"
+
+    def __init__(self, path: str):
+        import lmdb
+        os.makedirs(path, exist_ok=True)
+        self.env = lmdb.open(path, map_size=LMDB_MAP_SIZE, max_readers=512, lock=True)
+
+    def get(self, key):
+        with self.env.begin() as txn:
+            return _unwrap(txn.get(key.encode()))
+
+    def get_many(self, keys):
+        with self.env.begin() as txn:
+            return [_unwrap(txn.get(k.encode())) for k in keys]
+
+    def set(self, key, value, ttl=None):
+        try:
+            with self.env.begin(write=True) as txn:
+                txn.put(key.encode(), _wrap(value, ttl))
+        except Exception as e:
+            # A full map is a cache miss next time, not an error for the caller
+            logger.warning(f"[SharedCache] LMDB write failed: {e}")
+
+
+class SQLiteCache(SharedCache):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, "cache.sqlite")
+        self._local = threading.local()
+        self.writes = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets every worker process read while one writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl if ttl else None),
+            )
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[SharedCache] SQLite write failed: {e}")
+
+
+def _open_backend() -> SharedCache:
+    backend = SHARED_CACHE_BACKEND
+    if backend == "off":
+        return SharedCache()
+    if backend in ("auto", "redis") and REDIS_URL:
+        try:
+            return RedisCache(REDIS_URL)
+        except Exception as e:
+            logger.warning(f"[SharedCache] Redis unavailable ({e}), falling back to a local backend")
+    if backend in ("auto", "lmdb"):
+        try:
+            return LMDBCache(os.path.join(SHARED_CACHE_PATH, "lmdb"))
+        except ImportError:
+            pass
+    return SQLiteCache(SHARED_CACHE_PATH)
+
+
+_cache: Optional[SharedCache] = None
+_cache_lock = threading.Lock()
+
+
+def shared_cache() -> SharedCache:
+    """The process-wide handle to the shared cache, opened on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _open_backend()
+                logger.info(f"[SharedCache] Using {_cache.name} backend")
+    return _cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embeddings model so every worker shares computed vectors.
+    It is itself an `Embeddings`, so it drops in anywhere (FAISS included).
+    """
+
+    def __init__(self, embeddings, namespace: str = None):
+        self.embeddings = embeddings
+        model = getattr(embeddings, "model", type(embeddings).__name__)
+        dimensions = getattr(embeddings, "dimensions", None)
+        self.namespace = namespace or f"emb:{model}:{dimensions}"
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name == "embeddings":  # Not set yet (e.g. while unpickling)
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _keys(self, texts):
+        return [cache_key(self.namespace, t) for t in texts]
+
+    def _count(self, total: int, missing: int):
+        self.hits += total - missing
+        self.misses += missing
+        record_cache("embeddings", True, total - missing)
+        record_cache("embeddings", False, missing)
+
+    def _store(self, keys, vectors):
+        cache = shared_cache()
+        for key, vector in zip(keys, vectors):
+            cache.set(key, list(vector), EMBEDDING_CACHE_TTL_SECONDS)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = self._keys(texts)
+        vectors = shared_cache().get_many(keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        self._count(len(texts), len(missing))
+        if missing:
+            fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+            self._store([keys[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        import asyncio
+        keys = self._keys(texts)
+        vectors = await asyncio.to_thread(shared_cache().get_many, keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        self._count(len(texts), len(missing))
+        if missing:
+            fresh = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            await asyncio.to_thread(self._store, [keys[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def install_llm_cache():
+    """Routes exact-prompt LLM cache lookups through the shared tier (when SHARED_LLM_CACHE=1)."""
+    if not SHARED_LLM_CACHE:
+        return
+    from langchain_core.caches import BaseCache
+    from langchain_core.globals import set_llm_cache
+    from langchain_core.load import dumps, loads
+
+    class SharedLLMCache(BaseCache):
+        def lookup(self, prompt, llm_string):
+            value = shared_cache().get(cache_key("llm", llm_string, prompt))
+            return loads(value) if value is not None else None
+
+        def update(self, prompt, llm_string, return_val):
+            shared_cache().set(cache_key("llm", llm_string, prompt), dumps(list(return_val)))
+
+        def clear(self, **kwargs):
+            pass
+
+    set_llm_cache(SharedLLMCache())
+    logger.info("[SharedCache] LLM completions are cached in the shared tier")
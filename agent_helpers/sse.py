@@ -0,0 +1,179 @@
+"""
+SSE Transport
+
+What sits between a run's event log and the socket:
+
+- Heartbeats: a `: ping` comment after SSE_HEARTBEAT_SECONDS without a frame,
+  so proxies and load balancers don't drop a stream that is waiting on a long
+  LLM call. EventSource clients ignore comments.
+- Compression: gzip, or brotli when installed, negotiated from the client's
+  Accept-Encoding. The compressor is flushed after every frame so each event
+  reaches the client as soon as it is produced rather than when a block fills.
+- Coalescing: the server only pulls the next frame when the socket has room
+  (uvicorn waits for the transport to drain), so a slow client shows up as a
+  backlog in the run's event log. Instead of replaying that backlog frame by
+  frame, each of which carries the whole tree, the backlog is folded into one
+  frame with the latest tree and all of the skipped log lines. The frame keeps
+  the id of the last event it covers, so Last-Event-ID resumes stay exact.
+"""
+
+import os
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from agent_helpers.serialize import dumps, loads
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+# "auto" compresses when the client accepts it, "off" never does
+SSE_COMPRESSION = os.environ.get("SSE_COMPRESSION", "auto")
+SSE_GZIP_LEVEL = int(os.environ.get("SSE_GZIP_LEVEL", 6))
+SSE_BROTLI_QUALITY = int(os.environ.get("SSE_BROTLI_QUALITY", 5))
+# A backlog over either limit is coalesced before sending
+SSE_BACKLOG_EVENTS = int(os.environ.get("SSE_BACKLOG_EVENTS", 8))
+SSE_BACKLOG_BYTES = int(os.environ.get("SSE_BACKLOG_BYTES", 256 * 1024))
+
+HEARTBEAT_FRAME = ": ping\n\n"
+DONE_EVENT = "[DONE]"
+
+# Headers that stop intermediaries from buffering or transforming the stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+# ==========================================
+# COALESCING
+# ==========================================
+def backlogged(events: List[Tuple[int, str]]) -> bool:
+    return len(events) > SSE_BACKLOG_EVENTS or sum(len(data) for _, data in events) > SSE_BACKLOG_BYTES
+
+
+def _merge(frames: List[Tuple[int, dict]]) -> Tuple[int, dict]:
+    """Folds consecutive state updates into the last one, keeping every log line and the latest tree."""
+    seq, merged = frames[-1][0], dict(frames[-1][1])
+    merged["explainability_log"] = [line for _, f in frames for line in (f.get("explainability_log") or [])]
+    # Nodes that don't touch the tree send it empty; the last non-empty one is current
+    trees = [f["hypothesis_tree"] for _, f in frames if f.get("hypothesis_tree")]
+    if trees:
+        merged["hypothesis_tree"] = trees[-1]
+    completed = [f["last_completed_item_id"] for _, f in frames if f.get("last_completed_item_id")]
+    if completed:
+        merged["last_completed_item_id"] = completed[-1]
+    provisional = [node for _, f in frames for node in (f.get("provisional_nodes") or [])]
+    if provisional:
+        merged["provisional_nodes"] = provisional
+    elif "provisional_nodes" in merged:
+        del merged["provisional_nodes"]
+    merged["coalesced"] = len(frames)
+    return seq, merged
+
+
+def coalesce(events: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """
+    Collapses a backlog of (seq, data) events. State updates are merged into one;
+    provisional nodes are dropped once a later update supersedes them (their log
+    lines are kept) and merged otherwise. [DONE] always passes through.
+    """
+    out: List[Tuple[int, str]] = []
+    updates: List[Tuple[int, dict]] = []
+    drafts: List[Tuple[int, dict]] = []
+
+    def flush():
+        if updates:
+            seq, merged = _merge(updates)
+            out.append((seq, dumps(merged)))
+            updates.clear()
+        if drafts:
+            seq, merged = _merge(drafts)
+            out.append((seq, dumps(merged)))
+            drafts.clear()
+
+    for seq, data in events:
+        if data == DONE_EVENT:
+            flush()
+            out.append((seq, data))
+            continue
+        payload = loads(data)
+        if "provisional_nodes" in payload:
+            drafts.append((seq, payload))
+        else:
+            # A state update supersedes the drafts before it; keep their log lines only
+            for _, draft in drafts:
+                draft.pop("provisional_nodes", None)
+            updates.extend(drafts)
+            drafts.clear()
+            updates.append((seq, payload))
+    flush()
+    return out
+
+
+# ==========================================
+# COMPRESSION
+# ==========================================
+class FrameCompressor:
+    """Streaming compressor that emits a decodable chunk per frame."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=SSE_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(SSE_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, frame: str) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(frame.encode()) + self._brotli.flush()
+        return self._zlib.compress(frame.encode()) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """"br" or "gzip" if the client accepts it and compression is on, else None."""
+    if SSE_COMPRESSION == "off" or not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        q = params.strip()[2:] if params.strip().startswith("q=") else "1"
+        try:
+            if float(q) > 0:
+                accepted.add(name.strip())
+        except ValueError:
+            continue
+    if "br" in accepted and brotli is not None:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+async def compress_frames(frames: AsyncIterator[str], encoding: str) -> AsyncIterator[bytes]:
+    compressor = FrameCompressor(encoding)
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame)
+        yield compressor.finish()
+    finally:
+        # Runs the inner stream's cleanup (subscriber count) when the client goes away mid-send
+        await frames.aclose()
+
+
+def event_stream_response(frames: AsyncIterator[str], request=None,
+                          headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """A text/event-stream response of `frames`, compressed if the client accepts it."""
+    headers = dict(STREAM_HEADERS, **(headers or {}))
+    encoding = negotiate_encoding(request.headers.get("accept-encoding") if request is not None else None)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+        frames = compress_frames(frames, encoding)
+    return StreamingResponse(frames, media_type="text/event-stream", headers=headers)
@@ -1,42 +1,57 @@
 from langchain_core.output_parsers import StrOutputParser
 from .prompts import top_hypothesis_prompt, breakdown_prompt
 from .types import AgentState, Hypothesis, WorkItem 
-from agent_helpers.types import print_tree 
 from agent_helpers.cosmos_db import CosmosDB 
-import json
-import re
-
-def parse_json_from_string(text: str) -> dict:
-    # Robust JSON Parsing
-    markdown_match = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if markdown_match:
-        try: return json.loads(markdown_match.group(1))
-        except: pass
-    matches = list(re.finditer(r"\{.*\}", text, re.DOTALL))
-    if matches:
-        for match in reversed(matches):
-            try: return json.loads(match.group(0))
-            except: continue
-    return {"error": "Failed to parse JSON", "raw_text": text}
+from agent_helpers.scheduler import limited_ainvoke, limited_astream
+from agent_helpers.frontier import RunBudget, get_frontier
+from agent_helpers.json_stream import IncrementalJSONParser
+from agent_helpers.schemas import LLM_OUTPUT_MODE, Breakdown, TopHypotheses, llm_chain
+from agent_helpers.context import CONTEXT_BUDGETS, ContextBuilder
+from agent_helpers.research_store import get_research_store
+from agent_helpers.semantic_cache import breakdown_cache, reuse_log
+from agent_helpers.incremental import reuse_matching_subtrees
+from agent_helpers.logs import get_logger, log_tree
+from langgraph.types import StreamWriter
+import os
+import asyncio
+
+# Stream breakdown completions token by token and surface each sub-hypothesis as soon as it parses
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "1") == "1"
+logger = get_logger("strategist")
 
 class StrategistAgent:
     def __init__(self, llm, web_search_tool):
+        # web_search_tool returns raw result dicts; ContextBuilder ranks and budgets them
         self.llm = llm
         self.web_search = web_search_tool
 
-    def get_llm_chain(self, prompt_template):
-        return prompt_template | self.llm | StrOutputParser() | parse_json_from_string
+    async def stream_json_items(self, prompt_template, inputs: dict, array_key: str, on_item, usage: dict) -> dict:
+        """
+        Streams a completion, calling `on_item(index, item)` for each element of
+        `array_key` as soon as its object closes. Returns the fully parsed response.
+        """
+        chain = prompt_template | self.llm | StrOutputParser()
+        parser = IncrementalJSONParser(array_key)
+        index = 0
+        async for chunk in limited_astream(chain, inputs, usage=usage):
+            for item in parser.feed(chunk):
+                if isinstance(item, dict):
+                    on_item(index, item)
+                index += 1
+        return parser.result()
 
-    def formulate_top_hypothesis(self, state: AgentState) -> dict:
-        print("\n--- Executing Node: formulate_top_hypothesis ---")
+    async def formulate_top_hypothesis(self, state: AgentState) -> dict:
+        logger.info("--- Executing Node: formulate_top_hypothesis ---")
         problem = state["problem_statement"]
         
         # Log the start of the strategy phase
         initial_log = f"I'm starting by analyzing your problem: '{problem}' to figure out the best approach."
         
         # 1. RESEARCH FIRST
-        print(f"   [Strategist] Researching problem context: '{problem[:30]}...'")
-        context = self.web_search(problem)
+        logger.debug(f"[Strategist] Researching problem context: '{problem[:30]}...'")
+        builder = ContextBuilder(CONTEXT_BUDGETS["top_hypothesis"])
+        store = get_research_store(state.get("run_id"))
+        builder.add_web_results(await store.get_or_fetch("web", problem, lambda: self.web_search(problem)))
         
         search_log = f"I'm looking up some initial information about '{problem}' to get up to speed."
         
@@ -44,16 +59,20 @@ class StrategistAgent:
         scratchpad_id = state.get("scratchpad_id")
         doc_context_found = False
         if scratchpad_id:
-            print(f"   [Strategist] Searching documents for scratchpad: {scratchpad_id}")
-            doc_context = CosmosDB().search_documents(scratchpad_id, problem)
-            if doc_context:
-                print(f"   [Strategist] Found relevant document context.")
-                context += f"\n\n[INTERNAL DOCUMENTS]:\n{doc_context}"
+            logger.debug(f"[Strategist] Searching documents for scratchpad: {scratchpad_id}")
+            doc_results = await store.get_or_fetch(
+                "documents", problem, lambda: CosmosDB().asearch_documents(scratchpad_id, problem), k=5
+            )
+            if doc_results:
+                logger.debug(f"[Strategist] Found relevant document context.")
+                builder.add_documents(doc_results)
                 doc_context_found = True
+        context = builder.build(problem)
         
         # 2. THEN FORMULATE
-        chain = self.get_llm_chain(top_hypothesis_prompt)
-        response = chain.invoke({"problem": problem, "context": context})
+        chain = llm_chain(self.llm, top_hypothesis_prompt, TopHypotheses)
+        usage = dict(state.get("usage") or {})
+        response = await limited_ainvoke(chain, {"problem": problem, "context": context}, usage=usage)
         
         hypotheses_list = response.get("hypotheses", [])
         if isinstance(hypotheses_list, dict): hypotheses_list = [hypotheses_list]
@@ -90,77 +109,139 @@ class StrategistAgent:
             ))
             new_work_items.append(WorkItem(id=node_id, action="breakdown"))
 
-        print_tree(new_nodes, title="INITIAL HYPOTHESES (DATA-DRIVEN)")
+        log_tree(logger, new_nodes, "INITIAL HYPOTHESES (DATA-DRIVEN)")
         
         try:
-            CosmosDB().log_interaction("StrategistAgent.formulate_top_hypothesis", 
+            await asyncio.to_thread(CosmosDB().log_interaction, "StrategistAgent.formulate_top_hypothesis", 
                                      {"problem": problem, "context": context}, 
                                      response)
         except Exception as e:
-            print(f"   [Strategist] Logging failed: {e}")
+            logger.error(f"[Strategist] Logging failed: {e}")
 
         return {
             "hypothesis_tree": new_nodes,
-            "nodes_to_process": new_work_items,
+            "nodes_to_process": get_frontier(state.get("frontier")).push([], new_work_items, new_nodes),
+            "usage": usage,
             "explainability_log": [initial_log, search_log, "I've come up with a few initial hypotheses based on what I found."]
         }
 
-    def breakdown_hypothesis(self, state: AgentState) -> dict:
-        item_to_process = state["nodes_to_process"][0]
-        remaining_nodes = state["nodes_to_process"][1:]
-        parent_id = item_to_process["id"]
-        
-        parent_node = next(h for h in state["hypothesis_tree"] if h["id"] == parent_id)
-        print(f"\n--- Executing Node: breakdown_hypothesis for {parent_id} ---")
-        
-        # Log action
-        action_log = f"I'm going to break down this point: '{parent_node['text']}' to understand it better."
+    async def generate_breakdown(self, state: AgentState, parent_node: dict, budget: RunBudget, usage: dict,
+                                 writer: StreamWriter = None) -> tuple:
+        """Researches a hypothesis and asks the LLM to break it down. Returns (response, context, doc_context_found)."""
+        parent_id = parent_node["id"]
 
         # 1. RESEARCH FIRST
-        print(f"   [Strategist] Researching context for: '{parent_node['text']}'")
-        context = self.web_search(parent_node["text"])
+        logger.debug(f"[Strategist] Researching context for: '{parent_node['text']}'")
+        builder = ContextBuilder(CONTEXT_BUDGETS["breakdown"])
+        # Children usually ask about what their parent already retrieved; the store reuses it
+        store = get_research_store(state.get("run_id"))
+        query = parent_node["text"]
+        builder.add_web_results(await store.get_or_fetch("web", query, lambda: self.web_search(query)))
         
-        research_log = f"I'm searching for specific details about '{parent_node['text']}'."
-
         scratchpad_id = state.get("scratchpad_id")
         doc_context_found = False
         if scratchpad_id:
-            print(f"   [Strategist] Searching documents for scratchpad: {scratchpad_id}")
-            doc_context = CosmosDB().search_documents(scratchpad_id, parent_node["text"])
-            if doc_context:
-                print(f"   [Strategist] Found relevant document context.")
-                context += f"\n\n[INTERNAL DOCUMENTS]:\n{doc_context}"
+            logger.debug(f"[Strategist] Searching documents for scratchpad: {scratchpad_id}")
+            doc_results = await store.get_or_fetch(
+                "documents", query, lambda: CosmosDB().asearch_documents(scratchpad_id, query), k=5
+            )
+            if doc_results:
+                logger.debug(f"[Strategist] Found relevant document context.")
+                builder.add_documents(doc_results)
                 doc_context_found = True
+        context = builder.build(parent_node["text"])
         
         # 2. THEN BREAKDOWN
-        chain = self.get_llm_chain(breakdown_prompt)
-        response = chain.invoke({"hypothesis_text": parent_node["text"], "context": context})
+        prompt_inputs = {
+            "hypothesis_text": parent_node["text"],
+            "context": context,
+            "max_children": budget.max_children
+        }
+        if LLM_STREAMING and LLM_OUTPUT_MODE == "text" and writer:
+            first_index = len([h for h in state["hypothesis_tree"] if h["parent_id"] == parent_id]) + 1
+            # The same cap breakdown_hypothesis applies to the final list; later items would never become nodes
+            limit = min(budget.max_children, budget.nodes_left(usage, state["hypothesis_tree"]))
+
+            def emit_provisional(index: int, sub: dict):
+                if index >= limit:
+                    return
+                # Shown immediately; the final node list arrives with the node's state update
+                writer({
+                    "provisional_nodes": [{
+                        "id": f"{parent_id}.{first_index + index}",
+                        "parent_id": parent_id,
+                        "text": sub.get("text", ""),
+                        "reasoning": sub.get("reasoning", ""),
+                        "provisional": True
+                    }],
+                    "explainability_log": [f"Drafting sub-point for {parent_id}: {sub.get('text', '')[:80]}"],
+                    "activity": {"node": "breakdown_hypothesis", "item_id": parent_id, "status": "working"}
+                })
+
+            response = await self.stream_json_items(breakdown_prompt, prompt_inputs, "sub_hypotheses", emit_provisional, usage)
+        else:
+            chain = llm_chain(self.llm, breakdown_prompt, Breakdown)
+            response = await limited_ainvoke(chain, prompt_inputs, usage=usage)
+        return response, context, doc_context_found
+
+    async def breakdown_hypothesis(self, state: AgentState, writer: StreamWriter = None) -> dict:
+        item_to_process = state["nodes_to_process"][0]
+        remaining_nodes = state["nodes_to_process"][1:]
+        parent_id = item_to_process["id"]
         
+        # Copied: the tree in state is only changed through the patch this node returns
+        parent_node = dict(next(h for h in state["hypothesis_tree"] if h["id"] == parent_id))
+        logger.info(f"--- Executing Node: breakdown_hypothesis for {parent_id} ---")
+        
+        # Log action
+        action_log = f"I'm going to break down this point: '{parent_node['text']}' to understand it better."
+
+        budget = RunBudget.from_dict(state.get("budget"))
+        usage = dict(state.get("usage") or {})
+
+        # A near-identical hypothesis (e.g. a restart after a wording edit) reuses its earlier breakdown
+        # Runs without a scratchpad don't share results (scope None bypasses the cache)
+        scratchpad_id = state.get("scratchpad_id")
+        scope = (scratchpad_id, budget.max_children) if scratchpad_id else None
+        cached = await breakdown_cache.lookup(parent_node["text"], scope=scope)
+        if cached.hit:
+            response = cached.result["response"]
+            doc_context_found = cached.result["doc_context_found"]
+            context = None
+            research_log = reuse_log("breakdown", cached)
+        else:
+            response, context, doc_context_found = await self.generate_breakdown(state, parent_node, budget, usage, writer)
+            research_log = f"I'm searching for specific details about '{parent_node['text']}'."
+            if "error" not in response:
+                breakdown_cache.put(cached, {"response": response, "doc_context_found": doc_context_found})
+
         # FIX: Handle Error - Mark as leaf, do NOT queue 'analyze'
         if "error" in response:
-            print(f"   [Strategist] Breakdown failed for {parent_id}. Marking as leaf.")
+            logger.warning(f"[Strategist] Breakdown failed for {parent_id}. Marking as leaf.")
             parent_node["is_leaf"] = True
             
-            updated_tree = [h if h["id"] != parent_id else parent_node for h in state["hypothesis_tree"]]
             # Just return remaining nodes, do not add 'analyze'
             return {
-                "hypothesis_tree": updated_tree,
+                "hypothesis_tree": [parent_node],
                 "nodes_to_process": remaining_nodes,
+                "usage": usage,
                 "explainability_log": [f"I couldn't break this down further, so I'll mark it as complete."]
             }
 
-        sub_hypotheses = response.get("sub_hypotheses", [])[:2]
+        # Never create more children than the node budget has room for
+        max_children = min(budget.max_children, budget.nodes_left(usage, state["hypothesis_tree"]))
+        sub_hypotheses = response.get("sub_hypotheses", [])[:max_children]
         
         # FIX: No subs - Mark as leaf, do NOT queue 'analyze'
         if not sub_hypotheses:
-            print(f"   [Strategist] No sub-hypotheses found for {parent_id}. Marking as leaf.")
+            logger.warning(f"[Strategist] No sub-hypotheses found for {parent_id}. Marking as leaf.")
             parent_node["is_leaf"] = True
             
-            updated_tree = [h if h["id"] != parent_id else parent_node for h in state["hypothesis_tree"]]
             # Just return remaining nodes, do not add 'analyze'
             return {
-                "hypothesis_tree": updated_tree,
+                "hypothesis_tree": [parent_node],
                 "nodes_to_process": remaining_nodes,
+                "usage": usage,
                 "explainability_log": [f"I think this point is solid enough as is. Marking it complete."]
             }
         
@@ -168,9 +249,9 @@ class StrategistAgent:
         new_work_items = []
         
         existing_kids = [h for h in state["hypothesis_tree"] if h["parent_id"] == parent_id]
-        if len(existing_kids) >= 2:
-            print(f"   [Strategist] Node {parent_id} already has {len(existing_kids)} children. Skipping breakdown.")
-            return {"nodes_to_process": remaining_nodes}
+        if len(existing_kids) >= budget.max_children:
+            logger.info(f"[Strategist] Node {parent_id} already has {len(existing_kids)} children. Skipping breakdown.")
+            return {"nodes_to_process": remaining_nodes, "usage": usage}
             
         start_index = len(existing_kids) + 1
 
@@ -179,8 +260,8 @@ class StrategistAgent:
             depth = len(child_id.split('.'))
             
             # MAX DEPTH LOGIC
-            if depth >= 4:
-                print(f"   [Strategist] Node {child_id} reached max depth (4). Marking as LEAF.")
+            if depth >= budget.max_depth:
+                logger.info(f"[Strategist] Node {child_id} reached max depth ({budget.max_depth}). Marking as LEAF.")
                 is_leaf = True
                 next_action = None # No further action
             else:
@@ -203,20 +284,39 @@ class StrategistAgent:
             
             if next_action:
                 new_work_items.append(WorkItem(id=child_id, action=next_action))
+
+        # Incremental restart: graft back the old subtrees of children that survived the edit
+        graft_candidates = state.get("graft_candidates") or []
+        grafted, reuse_logs = [], []
+        if graft_candidates and parent_id == state.get("restart_node_id"):
+            grafted, reused_ids, reuse_logs = await reuse_matching_subtrees(parent_id, new_nodes, graft_candidates)
+            graft_candidates = []  # Old branches that didn't match are regenerated, not reused
+            # Reused nodes are done, except any the old run never finished expanding
+            reused = [n for n in new_nodes if n["id"] in reused_ids] + grafted
+            unfinished = [n for n in reused if not n["is_leaf"] and not n.get("children_ids")]
+            new_work_items = [w for w in new_work_items if w["id"] not in reused_ids] + [
+                WorkItem(id=n["id"], action="classify" if len(n["id"].split('.')) >= 2 else "breakdown")
+                for n in unfinished
+            ]
+            # Reused nodes cost nothing, so they don't count against the node budget
+            usage["base_nodes"] = usage.get("base_nodes", 0) + len(grafted)
             
         parent_node["children_ids"] = [n["id"] for n in new_nodes]
-        updated_tree = [h if h["id"] != parent_id else parent_node for h in state["hypothesis_tree"]] + new_nodes
-        print_tree(updated_tree, title=f"BREAKDOWN OF {parent_id}")
+        patch = [parent_node] + new_nodes + grafted
+        log_tree(logger, patch, f"BREAKDOWN OF {parent_id}")
 
-        try:
-            CosmosDB().log_interaction("StrategistAgent.breakdown_hypothesis", 
-                                     {"parent_hypothesis": parent_node["text"], "context": context}, 
-                                     response)
-        except Exception as e:
-            print(f"   [Strategist] Logging failed: {e}")
+        if not cached.hit:
+            try:
+                await asyncio.to_thread(CosmosDB().log_interaction, "StrategistAgent.breakdown_hypothesis", 
+                                         {"parent_hypothesis": parent_node["text"], "context": context}, 
+                                         response)
+            except Exception as e:
+                logger.error(f"[Strategist] Logging failed: {e}")
 
         return {
-            "hypothesis_tree": updated_tree,
-            "nodes_to_process": remaining_nodes + new_work_items,
-            "explainability_log": [action_log, research_log, f"I've identified some sub-points for {parent_id}."]
+            "hypothesis_tree": patch,
+            "nodes_to_process": get_frontier(state.get("frontier")).push(remaining_nodes, new_work_items, patch),
+            "usage": usage,
+            "graft_candidates": graft_candidates,
+            "explainability_log": [action_log, research_log, f"I've identified some sub-points for {parent_id}."] + reuse_logs
         }
\ No newline at end of file
@@ -1,22 +1,36 @@
 import os
-import matplotlib.pyplot as plt
+import asyncio
 import json
 import warnings
 
-# --- LangChain / AI Imports ---
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain.docstore.document import Document
-from langchain_experimental.utilities import PythonREPL
-
-# --- CRITICAL FIX: Use TavilySearchResults from Community ---
-# The 'langchain_tavily' package's TavilySearch class returns a different format.
-# We use the community version which reliably returns a List[Dict].
-try:
-    from langchain_community.tools.tavily_search import TavilySearchResults
-except ImportError:
-    # Fallback if community is missing (unlikely)
-    from langchain_tavily import TavilySearchResults
+# Heavy dependencies (FAISS, Tavily, langchain_experimental, matplotlib) are
+# imported where they are first used, so importing this module stays cheap.
+from agent_helpers.python_pool import python_pool
+from agent_helpers.charts import CHART_DIR, chart_digest, chart_service, render_chart
+from agent_helpers.shared_cache import CachedEmbeddings, SEARCH_CACHE_TTL_SECONDS, cache_key, shared_cache
+from agent_helpers.metrics import record_cache
+from agent_helpers.logs import get_logger
+
+# Memory-map the agent memory index so worker processes share it
+FAISS_MMAP = os.environ.get("FAISS_MMAP", "1") == "1"
+
+logger = get_logger("tools")
+
+_tavily_cls = None
+
+def _tavily_tool(max_results: int = 3):
+    global _tavily_cls
+    if _tavily_cls is None:
+        # --- CRITICAL FIX: Use TavilySearchResults from Community ---
+        # The 'langchain_tavily' package's TavilySearch class returns a different format.
+        # We use the community version which reliably returns a List[Dict].
+        try:
+            from langchain_community.tools.tavily_search import TavilySearchResults
+        except ImportError:
+            # Fallback if community is missing (unlikely)
+            from langchain_tavily import TavilySearchResults
+        _tavily_cls = TavilySearchResults
+    return _tavily_cls(max_results=max_results)
 
 # ==========================================
 # TOOL 1: Vector Store
@@ -24,21 +38,45 @@ except ImportError:
 class VectorStore:
     def __init__(self):
         if "OPENAI_API_KEY" not in os.environ:
-            print("Error: OPENAI_API_KEY not found.")
+            logger.error("OPENAI_API_KEY not found.")
             return
 
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        from langchain_openai import OpenAIEmbeddings
+        # Shared across worker processes, so each text is embedded once per machine
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-3-small"))
         self.db_path = "agent_memory"
         
         if os.path.exists(self.db_path):
             try:
-                self.db = FAISS.load_local(self.db_path, self.embeddings, allow_dangerous_deserialization=True)
+                self.db = self._load_db()
             except:
                 self._create_new_db()
         else:
             self._create_new_db()
 
+    def _load_db(self):
+        """
+        Loads the index memory-mapped and read-only when FAISS supports it, so
+        every worker process shares one copy through the page cache.
+        """
+        import pickle
+        import faiss
+        from langchain_community.vectorstores import FAISS
+
+        index_path = os.path.join(self.db_path, "index.faiss")
+        if FAISS_MMAP:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                with open(os.path.join(self.db_path, "index.pkl"), "rb") as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                return FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+            except Exception as e:
+                logger.warning(f"[VectorStore] Memory-mapped load failed ({e}), loading into memory")
+        return FAISS.load_local(self.db_path, self.embeddings, allow_dangerous_deserialization=True)
+
     def _create_new_db(self):
+        from langchain_community.vectorstores import FAISS
+        from langchain.docstore.document import Document
         dummy_doc = Document(page_content="Agent memory initialized.")
         self.db = FAISS.from_documents([dummy_doc], self.embeddings)
         self.db.save_local(self.db_path)
@@ -50,10 +88,47 @@ class VectorStore:
             return "\n".join([f"[Memory] {res.page_content}" for res in results])
         except: return ""
 
+    async def asearch(self, query: str, k: int = 3) -> str:
+        """Async variant; cancelling the caller aborts the pending embedding request."""
+        results = await self.asearch_results(query, k=k)
+        return "\n".join([f"[Memory] {content}" for content in results])
+
+    async def asearch_results(self, query: str, k: int = 3) -> list:
+        """Raw memory snippets, for callers that assemble their own context."""
+        try:
+            results = await self.db.asimilarity_search(query, k=k)
+            return [res.page_content for res in results]
+        except Exception: return []
+
 # ==========================================
 # TOOL 2: Web Search (Fixed)
 # ==========================================
 from agent_helpers.cosmos_db import CosmosDB
+from agent_helpers.scheduler import provider_limiter
+
+def _format_search_results(results) -> str:
+    # Safety Check: Ensure results is a list
+    if isinstance(results, str):
+        return f"[Search Output] {results}" # Handle raw string return
+
+    context = ""
+    # Iterate assuming List[Dict]
+    for res in results:
+        # Handle case where res might not be a dict
+        if isinstance(res, dict):
+            url = res.get('url', 'No URL')
+            content = res.get('content', 'No Content')
+            context += f"\n[Source: {url}]\n{content[:300]}...\n"
+        else:
+            context += f"\n[Result] {str(res)}\n"
+    return context
+
+def _log_search(query: str, results):
+    # Log to Cosmos DB
+    try:
+        CosmosDB().log_search(query, results if isinstance(results, list) else [{"raw": str(results)}])
+    except Exception as log_err:
+        logger.error(f"[WebSearch] Logging failed: {log_err}")
 
 def web_search(query: str) -> str:
     """Executes a real web search."""
@@ -61,45 +136,71 @@ def web_search(query: str) -> str:
         return "[Simulated Search] No API Key found."
 
     try:
-        print(f"   [WebSearch] Searching: '{query[:40]}...'")
+        logger.debug(f"[WebSearch] Searching: '{query[:40]}...'")
         
         # FIX: Use TavilySearchResults (returns list of dicts)
-        tool = TavilySearchResults(max_results=3) 
+        tool = _tavily_tool(max_results=3)
         results = tool.invoke({"query": query})
-        
-        # Safety Check: Ensure results is a list
         if isinstance(results, str):
-            return f"[Search Output] {results}" # Handle raw string return
-            
-        context = ""
-        # Iterate assuming List[Dict]
-        for res in results:
-            # Handle case where res might not be a dict
-            if isinstance(res, dict):
-                url = res.get('url', 'No URL')
-                content = res.get('content', 'No Content')
-                context += f"\n[Source: {url}]\n{content[:300]}...\n"
-            else:
-                context += f"\n[Result] {str(res)}\n"
-        
-        # Log to Cosmos DB
-        try:
-            CosmosDB().log_search(query, results if isinstance(results, list) else [{"raw": str(results)}])
-        except Exception as log_err:
-            print(f"   [WebSearch] Logging failed: {log_err}")
+            return _format_search_results(results)
 
+        context = _format_search_results(results)
+        _log_search(query, results)
         return context
 
     except Exception as e:
-        print(f"   [WebSearch] Error: {e}")
+        logger.error(f"[WebSearch] Error: {e}")
         return "[Error in Web Search]"
 
+async def aweb_search_results(query: str) -> list:
+    """
+    Async web search returning the raw result dicts ({url, content, ...}).
+    Cancelling the caller aborts the pending Tavily request.
+    """
+    if "TAVILY_API_KEY" not in os.environ:
+        return [{"url": "simulated", "content": "[Simulated Search] No API Key found."}]
+
+    # Every worker shares recent results, so a repeated query costs one Tavily call
+    key = cache_key("search", " ".join(query.lower().split()))
+    cached = await asyncio.to_thread(shared_cache().get, key)
+    record_cache("web_search", bool(cached))
+    if cached:
+        logger.debug(f"[WebSearch] Cache hit: '{query[:40]}...'")
+        return cached
+
+    try:
+        logger.debug(f"[WebSearch] Searching: '{query[:40]}...'")
+        await provider_limiter("tavily").acquire()
+        tool = _tavily_tool(max_results=3)
+        results = await tool.ainvoke({"query": query})
+        if isinstance(results, str):
+            return [{"url": "raw", "content": results}]
+
+        # Cosmos client is synchronous (and embeds the results), keep it off the event loop
+        await asyncio.to_thread(_log_search, query, results)
+        results = [res if isinstance(res, dict) else {"content": str(res)} for res in results]
+        if results:
+            await asyncio.to_thread(shared_cache().set, key, results, SEARCH_CACHE_TTL_SECONDS)
+        return results
+
+    except Exception as e:
+        logger.error(f"[WebSearch] Error: {e}")
+        return []
+
+async def aweb_search(query: str) -> str:
+    """Async web search formatted as a context string."""
+    results = await aweb_search_results(query)
+    if not results:
+        return "[Error in Web Search]"
+    return _format_search_results(results)
+
 # ==========================================
 # TOOL 3: Python REPL
 # ==========================================
 def run_python_analysis(code: str) -> str:
-    print(f"[PythonREPL] Executing analysis...")
+    logger.debug(f"[PythonREPL] Executing analysis...")
     try:
+        from langchain_experimental.utilities import PythonREPL
         repl = PythonREPL()
         clean_code = code.replace("```python", "").replace("```", "").strip()
         result = repl.run(clean_code)
@@ -107,18 +208,40 @@ def run_python_analysis(code: str) -> str:
     except Exception as e:
         return f"Error executing Python code: {e}"
 
+async def arun_python_analysis(code: str) -> str:
+    """
+    Runs analysis code on the sandboxed worker pool: pre-warmed subprocesses
+    with CPU, memory, time and output limits. Awaiting it never blocks the loop.
+    """
+    logger.debug(f"[PythonPool] Executing analysis...")
+    clean_code = code.replace("```python", "").replace("```", "").strip()
+    result = await python_pool.run(clean_code)
+    if not result.ok:
+        return f"Error executing Python code: {result.to_text()}"
+    return f"Analysis Result:\n{result.to_text()}"
+
 # ==========================================
 # TOOL 4: Chart Generator
 # ==========================================
-def generate_chart(data: dict, title: str, filename: str = "chart_output.png") -> str:
-    print(f"[ChartGen] Generating chart: '{title}'...")
+def generate_chart(data: dict, title: str, filename: str = None) -> str:
+    """Renders in-process. Without a filename the chart is saved under its content hash."""
+    logger.debug(f"[ChartGen] Generating chart: '{title}'...")
     try:
-        plt.switch_backend('Agg') 
-        plt.figure(figsize=(10, 6))
-        plt.bar(list(data.keys()), list(data.values()), color='skyblue')
-        plt.title(title)
-        plt.savefig(filename)
-        plt.close()
+        fmt = "svg" if filename and filename.endswith(".svg") else "png"
+        if not filename:
+            os.makedirs(CHART_DIR, exist_ok=True)
+            filename = os.path.join(CHART_DIR, f"{chart_digest(data, title, fmt)}.{fmt}")
+        with open(filename, "wb") as f:
+            f.write(render_chart(data, title, fmt))
         return f"Chart saved to {filename}"
+    except Exception as e:
+        return f"Error generating chart: {e}"
+
+async def agenerate_chart(data: dict, title: str, fmt: str = "png") -> str:
+    """Renders on the chart process pool; identical charts are only rendered once."""
+    logger.debug(f"[ChartGen] Generating chart: '{title}'...")
+    try:
+        chart = await chart_service.render(data, title, fmt)
+        return f"Chart saved to {chart.path} (served at {chart.url})"
     except Exception as e:
         return f"Error generating chart: {e}"
\ No newline at end of file
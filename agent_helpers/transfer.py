@@ -0,0 +1,250 @@
+"""
+Bulk Export & Import
+
+Moves a user's data in and out of Cosmos as NDJSON, one item per line:
+their scratchpads, then each page's hypothesis trees, documents and document
+chunks (with their vectors). Items are written as stored, minus the
+server-managed fields, so an import into another account is an upsert of the
+same ids and can be re-run safely.
+
+    {"type": "export", "version": 1, "user_id": "...", "exported_at": "..."}
+    {"type": "scratchpad", "id": "...", ...}
+    {"type": "document_chunk", "id": "...", "vector": [...], ...}
+    {"type": "export_checkpoint", "continuation": "..."}
+    {"type": "export_end", "counts": {...}}
+
+Both directions run in constant memory. Export reads Cosmos a page at a time
+with continuation tokens, and the children of a page of scratchpads are
+fetched with one query per type rather than per scratchpad. After each page
+a checkpoint line carries the token; passing it back as `continuation`
+resumes an interrupted export after that page. Import reads the request body
+as it arrives and upserts in transactional batches per partition key, with
+at most IMPORT_CONCURRENCY batches in flight; the body is not read further
+until one finishes.
+
+Exports can be gzip or brotli compressed. Imports are decompressed according
+to Content-Encoding, and gzip is also recognised from its magic bytes.
+"""
+
+import os
+import time
+import zlib
+import asyncio
+import datetime
+from typing import AsyncIterator, Callable, Iterator, List, Optional
+
+from agent_helpers.cosmos_db import CosmosDB
+from agent_helpers.serialize import dumps_bytes, loads
+from agent_helpers.logs import get_logger
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Items upserted per batch, and batches in flight at once, on import
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 100))
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", 4))
+# Longest NDJSON line accepted on import; a chunk with its vector is well under this
+IMPORT_MAX_LINE_BYTES = int(os.environ.get("IMPORT_MAX_LINE_BYTES", 8 * 1024 * 1024))
+EXPORT_GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", 6))
+EXPORT_BROTLI_QUALITY = int(os.environ.get("EXPORT_BROTLI_QUALITY", 5))
+
+EXPORT_FORMAT_VERSION = 1
+CHILD_TYPES = ("hypothesis_tree", "document", "document_chunk")
+EXPORT_TYPES = ("scratchpad",) + CHILD_TYPES
+# Framing lines, skipped on import
+MARKER_TYPES = ("export", "export_checkpoint", "export_end")
+
+# compression -> (media type, file extension)
+EXPORT_COMPRESSIONS = {None: ("application/x-ndjson", ".ndjson"), "gzip": ("application/gzip", ".ndjson.gz")}
+if brotli is not None:
+    EXPORT_COMPRESSIONS["br"] = ("application/x-brotli", ".ndjson.br")
+
+DECODE_ERRORS = (zlib.error, brotli.error) if brotli is not None else (zlib.error,)
+
+SCRATCHPAD_QUERY = "SELECT * FROM c WHERE c.user_id = @user_id"
+CHILD_QUERY = "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.scratchpad_id)"
+
+logger = get_logger("transfer")
+
+
+def _line(item: dict) -> bytes:
+    return dumps_bytes(item) + b"\n"
+
+
+# ==========================================
+# EXPORT
+# ==========================================
+def _scratchpad_pages(db: CosmosDB, user_id: str, continuation: Optional[str]):
+    if not db.enabled:
+        yield [dict(pad, type="scratchpad") for pad in db.get_scratchpads(user_id)], None
+        return
+    yield from db.query_pages(SCRATCHPAD_QUERY, [{"name": "@user_id", "value": user_id}], "scratchpad", continuation)
+
+
+def _child_pages(db: CosmosDB, item_type: str, scratchpad_ids: List[str]) -> Iterator[List[dict]]:
+    if not db.enabled:
+        if item_type == "document":
+            for scratchpad_id in scratchpad_ids:
+                yield [dict(doc, type="document") for doc in db.get_documents(scratchpad_id)]
+        return
+    for items, _ in db.query_pages(CHILD_QUERY, [{"name": "@ids", "value": scratchpad_ids}], item_type):
+        yield items
+
+
+def export_lines(user_id: str, continuation: Optional[str] = None) -> Iterator[bytes]:
+    """NDJSON for a user's data, one chunk per page of items."""
+    db = CosmosDB()
+    counts = dict.fromkeys(EXPORT_TYPES, 0)
+    started = time.perf_counter()
+    yield _line({"type": "export", "version": EXPORT_FORMAT_VERSION, "user_id": user_id,
+                 "exported_at": datetime.datetime.utcnow().isoformat(), "resumed_from": continuation})
+    try:
+        for pads, token in _scratchpad_pages(db, user_id, continuation):
+            counts["scratchpad"] += len(pads)
+            yield b"".join(_line(pad) for pad in pads)
+            scratchpad_ids = [pad["id"] for pad in pads]
+            for item_type in CHILD_TYPES:
+                if not scratchpad_ids:
+                    break
+                for items in _child_pages(db, item_type, scratchpad_ids):
+                    counts[item_type] += len(items)
+                    yield b"".join(_line(item) for item in items)
+            yield _line({"type": "export_checkpoint", "continuation": token})
+    except Exception as e:
+        # The response has started; ending without export_end tells the importer the file is incomplete
+        logger.error(f"[Transfer] Export for {user_id} failed after {counts}: {e}")
+        raise
+    logger.info(f"[Transfer] Exported {counts} for {user_id} in {time.perf_counter() - started:.1f}s")
+    yield _line({"type": "export_end", "counts": counts})
+
+
+def _compressor(compression: str):
+    if compression == "br":
+        compressor = brotli.Compressor(quality=EXPORT_BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def export_stream(user_id: str, continuation: Optional[str] = None, compression: Optional[str] = None) -> Iterator[bytes]:
+    """
+    `export_lines`, compressed when asked. A sync iterator: the response
+    pulls each chunk in the threadpool, so Cosmos reads don't block the loop.
+    """
+    if not compression:
+        yield from export_lines(user_id, continuation)
+        return
+    compress, finish = _compressor(compression)
+    for chunk in export_lines(user_id, continuation):
+        out = compress(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+# ==========================================
+# IMPORT
+# ==========================================
+def _decompressor(encoding: Optional[str]) -> Callable[[bytes], bytes]:
+    """Incremental decoder for the body. With no Content-Encoding, gzip is detected from the first bytes."""
+    encoding = (encoding or "").strip().lower()
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("brotli is not installed on this server")
+        return brotli.Decompressor().process
+    if encoding not in ("", "identity", "gzip"):
+        raise ValueError(f"Unsupported Content-Encoding '{encoding}'")
+
+    state = {"decoder": zlib.decompressobj(31) if encoding == "gzip" else None, "detected": encoding == "gzip"}
+
+    def decompress(chunk: bytes) -> bytes:
+        if not state["detected"] and chunk:
+            state["detected"] = True
+            if chunk[:2] == b"\x1f\x8b":
+                state["decoder"] = zlib.decompressobj(31)
+        return state["decoder"].decompress(chunk) if state["decoder"] else chunk
+
+    return decompress
+
+
+async def import_stream(chunks: AsyncIterator[bytes], encoding: Optional[str] = None,
+                        user_id: Optional[str] = None) -> dict:
+    """
+    Upserts the items in an NDJSON export as it is read. `user_id`, when
+    given, becomes the owner of the imported scratchpads. Raises ValueError
+    for a malformed body, including a line over IMPORT_MAX_LINE_BYTES;
+    batches already written stay written.
+    """
+    db = CosmosDB()
+    decompress = _decompressor(encoding)
+    counts = dict.fromkeys(EXPORT_TYPES, 0)
+    buffers = {item_type: [] for item_type in EXPORT_TYPES}
+    in_flight = set()
+    summary = {"lines": 0, "skipped": 0, "complete": False}
+    started = time.perf_counter()
+
+    async def settle(return_when):
+        nonlocal in_flight
+        done, in_flight = await asyncio.wait(in_flight, return_when=return_when)
+        for task in done:
+            task.result()
+
+    async def flush(item_type: str):
+        batch, buffers[item_type] = buffers[item_type], []
+        if not batch:
+            return
+        if len(in_flight) >= IMPORT_CONCURRENCY:
+            await settle(asyncio.FIRST_COMPLETED)
+        in_flight.add(asyncio.create_task(asyncio.to_thread(db.bulk_upsert, item_type, batch)))
+        counts[item_type] += len(batch)
+
+    async def handle(line: bytes):
+        line = line.strip()
+        if not line:
+            return
+        summary["lines"] += 1
+        try:
+            item = loads(line)
+        except ValueError:
+            raise ValueError(f"Line {summary['lines']} is not valid JSON")
+        item_type = item.get("type") if isinstance(item, dict) else None
+        if item_type in MARKER_TYPES:
+            if item_type == "export" and item.get("version", 0) > EXPORT_FORMAT_VERSION:
+                raise ValueError(f"Export format version {item['version']} is newer than this server's ({EXPORT_FORMAT_VERSION})")
+            summary["complete"] = item_type == "export_end"
+            return
+        if item_type not in EXPORT_TYPES or not item.get("id"):
+            summary["skipped"] += 1
+            return
+        if user_id and item_type == "scratchpad":
+            item["user_id"] = user_id
+        buffers[item_type].append(item)
+        if len(buffers[item_type]) >= IMPORT_BATCH_SIZE:
+            await flush(item_type)
+
+    try:
+        pending = b""
+        async for chunk in chunks:
+            lines = (pending + decompress(chunk)).split(b"\n")
+            pending = lines.pop()
+            if len(pending) > IMPORT_MAX_LINE_BYTES:
+                raise ValueError(f"Line {summary['lines'] + len(lines) + 1} is longer than {IMPORT_MAX_LINE_BYTES} bytes")
+            for line in lines:
+                if len(line) > IMPORT_MAX_LINE_BYTES:
+                    raise ValueError(f"Line {summary['lines'] + 1} is longer than {IMPORT_MAX_LINE_BYTES} bytes")
+                await handle(line)
+        await handle(pending)
+        for item_type in EXPORT_TYPES:
+            await flush(item_type)
+    except DECODE_ERRORS as e:
+        raise ValueError(f"Body could not be decompressed: {e}")
+    finally:
+        if in_flight:
+            # Let started batches finish before reporting; the first failure is raised
+            await settle(asyncio.ALL_COMPLETED)
+
+    logger.info(f"[Transfer] Imported {counts} in {time.perf_counter() - started:.1f}s"
+                f"{'' if summary['complete'] else ' (no export_end line: the export may be truncated)'}")
+    return dict(summary, imported=counts, seconds=round(time.perf_counter() - started, 2))
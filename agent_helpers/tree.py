@@ -0,0 +1,128 @@
+"""
+Hypothesis Tree State
+
+`AgentState.hypothesis_tree` is a reducer channel. Nodes return only the
+hypotheses they created or changed, and `merge_tree` patches them into the
+tree by id: a known id replaces its node, a new one is appended. Nodes no
+longer rebuild the list themselves. `replace_tree` sets the whole tree (a
+new run, or the pruned tree of a restart).
+
+The reducer patches a shallow copy (the list and its index, not the nodes):
+the previous value may be held by a checkpoint snapshot that has not been
+serialized yet, and checkpoints must keep the tree of their own step.
+
+The tree itself is a `HypothesisTree`, a list of the usual Hypothesis dicts
+that keeps an id -> position index, so applying a patch needs no scan; the
+copy is one pass over pointers, with no node dicts copied.
+Nodes stay plain dicts because they go unchanged to the checkpointer, SSE
+payloads, Cosmos and the frontend. Their ids, parent ids, statuses and tool
+names are interned as they enter the tree, so the copies repeated across
+nodes (each child's parent_id, each children_ids entry) share one string.
+
+On LangGraph versions with DeltaChannel, checkpoints store each step's patch
+rather than the whole tree, plus a full snapshot every
+TREE_SNAPSHOT_FREQUENCY updates; older versions fall back to an ordinary
+reducer channel. Checkpoints written before this change hold the plain list,
+which both load as is.
+"""
+
+import os
+import sys
+import copy
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langgraph.types import Overwrite
+
+try:
+    from langgraph.channels.delta import DeltaChannel
+except ImportError:
+    DeltaChannel = None
+
+# Tree updates between full checkpoint snapshots (DeltaChannel only)
+TREE_SNAPSHOT_FREQUENCY = int(os.environ.get("TREE_SNAPSHOT_FREQUENCY", 200))
+
+_INTERNED_FIELDS = ("id", "parent_id", "status")
+_INTERNED_LISTS = ("children_ids", "tools_used")
+
+
+def _intern(node: Dict[str, Any]) -> Dict[str, Any]:
+    for key in _INTERNED_FIELDS:
+        value = node.get(key)
+        if type(value) is str:
+            node[key] = sys.intern(value)
+    for key in _INTERNED_LISTS:
+        values = node.get(key)
+        if values:
+            node[key] = [sys.intern(v) if type(v) is str else v for v in values]
+    return node
+
+
+class HypothesisTree(list):
+    """A list of Hypothesis dicts indexed by id. Change it through `upsert` only."""
+
+    __slots__ = ("_index",)
+
+    def __init__(self, nodes: Iterable[Dict[str, Any]] = ()):
+        super().__init__()
+        self._index: Dict[str, int] = {}
+        self.upsert(nodes)
+
+    def upsert(self, nodes: Iterable[Dict[str, Any]]) -> "HypothesisTree":
+        for node in nodes:
+            node = _intern(node)
+            position = self._index.get(node["id"])
+            if position is None:
+                self._index[node["id"]] = len(self)
+                self.append(node)
+            else:
+                self[position] = node
+        return self
+
+    def get_node(self, node_id: str) -> Optional[Dict[str, Any]]:
+        position = self._index.get(node_id)
+        return self[position] if position is not None else None
+
+    def __copy__(self) -> "HypothesisTree":
+        # Used by merge_tree and by LangGraph for conditional edges; the default copy would share `_index`
+        tree = HypothesisTree()
+        tree.extend(self)
+        tree._index = dict(self._index)
+        return tree
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def as_tree(nodes: Optional[Iterable[Dict[str, Any]]]) -> HypothesisTree:
+    return nodes if isinstance(nodes, HypothesisTree) else HypothesisTree(nodes or ())
+
+
+def merge_tree(tree: Optional[List[Dict[str, Any]]], writes: Sequence[List[Dict[str, Any]]]) -> HypothesisTree:
+    """DeltaChannel reducer: applies a batch of patches, in order, to a copy of the tree."""
+    tree = copy.copy(tree) if isinstance(tree, HypothesisTree) else HypothesisTree(tree or ())
+    for nodes in writes:
+        tree.upsert(nodes or ())
+    return tree
+
+
+def _merge_tree_single(tree: Optional[List[Dict[str, Any]]], nodes: List[Dict[str, Any]]) -> HypothesisTree:
+    return merge_tree(tree, [nodes])
+
+
+TREE_CHANNEL = (DeltaChannel(merge_tree, snapshot_frequency=TREE_SNAPSHOT_FREQUENCY)
+                if DeltaChannel is not None else _merge_tree_single)
+
+
+def replace_tree(nodes: Iterable[Dict[str, Any]]) -> Overwrite:
+    """A state update that sets the whole tree instead of patching it."""
+    return Overwrite(HypothesisTree(nodes))
+
+
+def apply_tree_update(tree: Optional[HypothesisTree], update: Any) -> HypothesisTree:
+    """
+    Applies a node's `hypothesis_tree` update (patch or `replace_tree`) the way
+    the channel does, but in place: for callers that own `tree` outright.
+    """
+    if isinstance(update, Overwrite):
+        return HypothesisTree(update.value or ())
+    return as_tree(tree).upsert(update or ())
@@ -1,4 +1,6 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
+
+from agent_helpers.tree import TREE_CHANNEL
 
 class Hypothesis(TypedDict):
     id: str
@@ -10,6 +12,7 @@ class Hypothesis(TypedDict):
     is_leaf: bool
     depth: int
     tools_used: List[str]  # e.g., ["Web Search", "RAG", "Python"]
+    confidence: float  # Classifier confidence that the node is worth breaking down
 
 class Analysis(TypedDict):
     """Represents the analysis required for a leaf hypothesis."""
@@ -23,11 +26,12 @@ class WorkItem(TypedDict):
     """A single item in the agent's to-do list."""
     id: str
     action: str # "breakdown", "classify", "analyze"
+    priority: float # Set by the frontier scheduler; higher runs first
 
 class AgentState(TypedDict):
     """The central state of the graph."""
     problem_statement: str
-    hypothesis_tree: List[Hypothesis]
+    hypothesis_tree: Annotated[List[Hypothesis], TREE_CHANNEL]  # Nodes return patches; see tree.py
     nodes_to_process: List[WorkItem]
     last_completed_item_id: Optional[str]
     analyses_needed: List[Analysis]
@@ -37,39 +41,37 @@ class AgentState(TypedDict):
     scratchpad_id: Optional[str]
     root_id_offset: int
     parent_node_id: Optional[str]
+    run_id: Optional[str]
+    user_id: Optional[str]
+    frontier: Optional[str]  # Name of the FrontierScheduler ordering nodes_to_process
+    budget: Optional[Dict[str, Any]]  # RunBudget limits
+    usage: Dict[str, Any]  # Tokens spent, start time, LLM calls
+    restart_mode: Optional[str]  # "full" or "incremental"
+    graft_candidates: List[Hypothesis]  # Pruned subtree an incremental restart may reuse
     
-def print_tree(tree: List[Hypothesis], title="CURRENT HYPOTHESIS TREE"):
-    """Prints the hypothesis tree structure to the console."""
-    print("\n" + "="*50)
-    print(f"| {title.upper()}")
-    print("="*50)
-    
-    # Helper to print a single node and its children recursively
-    def print_node(node_id, indent=""):
-        node = next((h for h in tree if h["id"] == node_id), None)
-        if not node: return
-        
+def format_tree(tree: List[Hypothesis], title="CURRENT HYPOTHESIS TREE") -> str:
+    """Renders the hypothesis tree structure as indented text."""
+    children: Dict[str, List[Hypothesis]] = {}
+    for h in tree:
+        children.setdefault(h.get("parent_id"), []).append(h)
+    for kids in children.values():
+        # Keep 1.1 before 1.2
+        kids.sort(key=lambda x: x["id"])
+    ids = {h["id"] for h in tree}
+
+    lines = ["=" * 50, f"| {title.upper()}", "=" * 50]
+
+    def add_node(node, indent=""):
         leaf_marker = " (LEAF)" if node.get("is_leaf", False) else ""
-        
-        # Print the node
-        print(f"{indent}* ({node['id']}){leaf_marker}: {node['text']}")
-        # print(f"{indent}  [Reasoning]: {node['reasoning'][:100]}...") # Optional: Uncomment for more detail
-        
-        # Find children and print them
-        children = [h for h in tree if h.get("parent_id") == node_id]
-        # Sort children to keep 1.1 before 1.2
-        children.sort(key=lambda x: x["id"])
-        
-        for child in children:
-            print_node(child["id"], indent + "  ")
-    
-    # FIX: Find ALL roots (nodes with parent_id="0"), not just "1"
-    roots = [h for h in tree if h["parent_id"] == "0"]
-    roots.sort(key=lambda x: x["id"]) # Ensure 1 prints before 2
-    
-    if roots:
-        for root in roots:
-            print_node(root["id"])
-    else:
-        print("Tree is empty.")
-    print("="*50)
\ No newline at end of file
+        lines.append(f"{indent}* ({node['id']}){leaf_marker}: {node['text']}")
+        for child in children.get(node["id"], []):
+            add_node(child, indent + "  ")
+
+    # All roots (parent_id="0", or a parent outside `tree` when rendering a patch), not just "1"
+    roots = [root for parent_id, kids in children.items() if parent_id not in ids for root in kids]
+    for root in roots:
+        add_node(root)
+    if not roots:
+        lines.append("Tree is empty.")
+    lines.append("=" * 50)
+    return "\n".join(lines)
@@ -0,0 +1,400 @@
+"""
+Offline graph benchmark
+
+Runs the hypothesis graph against deterministic stand-ins (FAKE_PROVIDERS=1:
+fake chat model, web search and embeddings, Cosmos in local mock mode) and
+reports throughput and per-node latency with no network or API keys involved.
+
+Modes:
+    graph  compiles `build_graph()` and drives it directly with `astream`
+    api    starts the server in-process and streams POST /run_agent over HTTP
+
+Reported per mode: runs/sec, run latency p50/p95, per-node p50/p95, SSE bytes
+per run, time to first event (api), peak RSS and CPU seconds per run. Results
+are written as JSON; pass a previous file as --baseline to fail (exit code 1)
+when a metric regresses by more than --tolerance.
+
+Usage:
+    python benchmarks/graph_benchmark.py [--mode graph|api|both] [--runs 20] [--concurrency 4]
+        [--max-nodes 30] [--llm-latency-ms 50] [--out results.json] [--baseline base.json]
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PROBLEMS = [
+    "How can a regional bakery chain grow operating profit by 20% in two years?",
+    "Should a mid-size logistics company build its own electric delivery fleet?",
+    "Why is customer churn rising at a subscription meal-kit business?",
+    "How should a hospital network reduce emergency department wait times?",
+    "Is entering the Southeast Asian market worthwhile for a B2B payroll startup?",
+    "What is driving margin erosion at a specialty chemicals manufacturer?",
+]
+
+# Metric -> direction; a change the wrong way beyond the tolerance is a regression
+HIGHER_IS_BETTER = {"runs_per_sec"}
+COMPARED_PREFIXES = ("runs_per_sec", "run_seconds_p95", "cpu_seconds_per_run", "peak_rss_mb",
+                     "sse_bytes_per_run", "ttfe_seconds_p95", "node_ms_p95.")
+# Fast nodes (a few ms) jitter by more than any tolerance; ignore smaller absolute changes
+NODE_NOISE_FLOOR_MS = 5.0
+
+
+# Real credentials are dropped so nothing can reach OpenAI, Tavily or Cosmos
+PROVIDER_SECRETS = ("OPENAI_API_KEY", "TAVILY_API_KEY", "COSMOS_ENDPOINT", "COSMOS_KEY")
+
+
+def add_fake_provider_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--search-latency-ms", type=float, default=20)
+    parser.add_argument("--leaf-ratio", type=float, default=0.5, help="Share of nodes the fake LLM classifies as leaves")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the semantic and shared caches on")
+    parser.add_argument("--provider-limits", action="store_true", help="Keep the OpenAI/Tavily rate limits")
+
+
+def fake_provider_env(args, workdir: str) -> dict:
+    """Environment overrides for a server on fake providers, with all state under `workdir`."""
+    env = {
+        "FAKE_PROVIDERS": "1",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_SEARCH_LATENCY_MS": str(args.search_latency_ms),
+        "FAKE_LEAF_RATIO": str(args.leaf_ratio),
+        "RUNS_DB_PATH": os.path.join(workdir, "runs.sqlite"),
+        "CHECKPOINT_DB_PATH": os.path.join(workdir, "checkpoints.sqlite"),
+        "CHART_DIR": os.path.join(workdir, "charts"),
+        "SHARED_CACHE_BACKEND": "sqlite" if args.with_caches else "off",
+        "SHARED_CACHE_PATH": os.path.join(workdir, "shared_cache"),
+        "SEMANTIC_CACHE": "1" if args.with_caches else "0",
+    }
+    if not args.provider_limits:
+        # The fakes have no rate limits; the production token buckets would dominate the numbers
+        env.update({"OPENAI_RPM": "1000000", "OPENAI_TPM": "1000000000", "TAVILY_RPM": "1000000"})
+    return env
+
+
+def configure_environment(args, workdir: str):
+    """Must run before `agent` is imported: the modules read their settings at import."""
+    os.environ.update(fake_provider_env(args, workdir))
+    os.environ["MAX_CONCURRENT_RUNS"] = str(args.concurrency)
+    for key in PROVIDER_SECRETS:
+        os.environ.pop(key, None)
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run_input(problem: str, max_nodes: int) -> dict:
+    from agent_helpers.frontier import RunBudget
+    return {
+        "problem_statement": problem, "scratchpad_id": None, "existing_tree": None,
+        "restart_node_id": None, "root_id_offset": 0, "parent_node_id": None, "frontier": None,
+        "budget": RunBudget.from_dict({"max_nodes": max_nodes}).to_dict(), "restart_mode": None,
+    }
+
+
+def node_timings(events: list) -> list:
+    """[(node, seconds)] from (arrival time, node) pairs: each node owns the gap since the previous one."""
+    timings, previous = [], 0.0
+    for at, node in events:
+        timings.append((node, at - previous))
+        previous = at
+    return timings
+
+
+# --- Drivers: each returns one run's measurements ---
+async def run_graph_once(graph, problem: str, max_nodes: int) -> dict:
+    import agent
+    from agent_helpers.frontier import RunBudget
+    from agent_helpers.runs import format_sse
+    from agent_helpers.tree import apply_tree_update
+
+    inputs = run_input(problem, max_nodes)
+    config = {"recursion_limit": RunBudget.from_dict(inputs["budget"]).recursion_limit()}
+    started = time.perf_counter()
+    nodes, sse_bytes, seq, first_event, nodes_in_tree, tree = [], 0, 0, None, 0, None
+    async for mode, output in graph.astream(inputs, config=config, stream_mode=["updates", "custom"]):
+        at = time.perf_counter() - started
+        first_event = first_event if first_event is not None else at
+        # Size the frames exactly as RunManager would send them
+        if mode == "custom":
+            seq += 1
+            sse_bytes += len(format_sse(seq, json.dumps(output)).encode())
+            continue
+        for node_name, update in output.items():
+            # Nodes return tree patches; RunManager sends the whole tree
+            if update and "hypothesis_tree" in update:
+                tree = apply_tree_update(tree, update["hypothesis_tree"])
+                update = dict(update, hypothesis_tree=tree)
+            payload = await asyncio.to_thread(agent.build_event_payload, node_name, update, inputs)
+            seq += 1
+            sse_bytes += len(format_sse(seq, json.dumps(payload)).encode())
+            nodes.append((at, node_name))
+            nodes_in_tree = len(payload["hypothesis_tree"]) or nodes_in_tree
+    return {"ok": True, "seconds": time.perf_counter() - started, "ttfe": first_event,
+            "nodes": node_timings(nodes), "sse_bytes": sse_bytes, "tree_size": nodes_in_tree}
+
+
+async def run_api_once(port: int, problem: str, max_nodes: int) -> dict:
+    from benchmarks.sse_client import stream_sse
+    body = {"problem_statement": problem, "budget": {"max_nodes": max_nodes}}
+    result = await stream_sse("127.0.0.1", port, "/run_agent", body)
+    nodes, tree_size = [], 0
+    for at, payload in result.payloads():
+        # Provisional ("custom") and queue-position frames also carry an activity, but don't end a node
+        node = (payload.get("activity") or {}).get("node")
+        if node and node != "queue" and "provisional_nodes" not in payload:
+            nodes.append((at, node))
+            tree_size = len(payload.get("hypothesis_tree") or []) or tree_size
+    ok = result.ok and any(data == "[DONE]" for _, data in result.events)
+    return {"ok": ok, "error": result.error or (None if ok else f"HTTP {result.status}, no [DONE]"),
+            "seconds": result.elapsed, "ttfe": result.time_to_first_event, "nodes": node_timings(nodes),
+            "sse_bytes": result.bytes_received, "tree_size": tree_size}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def running_server():
+    """Serves `agent:app` on a free port inside this process, yielding the port once ready."""
+    import uvicorn
+    import agent
+    from benchmarks.sse_client import request_json
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(agent.app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    try:
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            try:
+                status, body = await request_json("127.0.0.1", port, "GET", "/health/ready")
+                if status == 200:
+                    break
+                if body.get("stage") == "failed":
+                    raise RuntimeError(f"Server failed to initialize: {body.get('error')}")
+            except ConnectionError:
+                pass
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("Server did not become ready")
+        yield port
+    finally:
+        server.should_exit = True
+        await task
+
+
+async def measure(run_once, args, quiet) -> dict:
+    """Runs `args.warmup` unmeasured runs, then `args.runs` at `args.concurrency`, and summarises."""
+    for i in range(args.warmup):
+        with quiet():
+            await run_once(PROBLEMS[i % len(PROBLEMS)] + " (warm-up)")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            # A distinct statement per run, so no run is served from another's caches unless intended
+            try:
+                return await run_once(f"{PROBLEMS[i % len(PROBLEMS)]} [run {i}]")
+            except Exception as e:
+                return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    with quiet():
+        runs = await asyncio.gather(*(one(i) for i in range(args.runs)))
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+    return summarize(runs, wall, cpu)
+
+
+def summarize(runs: list, wall: float, cpu: float) -> dict:
+    completed = [r for r in runs if r["ok"]]
+    per_node = defaultdict(list)
+    for r in completed:
+        for node, seconds in r["nodes"]:
+            per_node[node].append(seconds * 1000)
+    seconds = [r["seconds"] for r in completed]
+    ttfe = [r["ttfe"] for r in completed if r.get("ttfe") is not None]
+    return {
+        "runs": len(runs),
+        "errors": len(runs) - len(completed),
+        "error_samples": sorted({r.get("error") or "unknown" for r in runs if not r["ok"]})[:5],
+        "wall_seconds": round(wall, 3),
+        "runs_per_sec": round(len(completed) / wall, 3) if wall else 0.0,
+        "run_seconds_p50": round(percentile(seconds, 50), 4),
+        "run_seconds_p95": round(percentile(seconds, 95), 4),
+        "ttfe_seconds_p50": round(percentile(ttfe, 50), 4),
+        "ttfe_seconds_p95": round(percentile(ttfe, 95), 4),
+        "node_ms_p50": {node: round(percentile(v, 50), 2) for node, v in sorted(per_node.items())},
+        "node_ms_p95": {node: round(percentile(v, 95), 2) for node, v in sorted(per_node.items())},
+        "node_counts": {node: len(v) for node, v in sorted(per_node.items())},
+        "tree_size_mean": round(sum(r["tree_size"] for r in completed) / len(completed), 1) if completed else 0,
+        "sse_bytes_per_run": round(sum(r["sse_bytes"] for r in completed) / len(completed)) if completed else 0,
+        # In api mode the server runs in this process, so this includes the client's share
+        "cpu_seconds_per_run": round(cpu / len(runs), 4) if runs else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def flatten(metrics: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """Regressions as (mode, metric, baseline, current, relative change)."""
+    regressions = []
+    for mode, metrics in current["results"].items():
+        before = flatten(baseline.get("results", {}).get(mode, {}))
+        for metric, value in flatten(metrics).items():
+            if not metric.startswith(COMPARED_PREFIXES) or not before.get(metric):
+                continue
+            change = (value - before[metric]) / before[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if metric.startswith("node_ms_") and abs(value - before[metric]) < NODE_NOISE_FLOOR_MS:
+                continue
+            if worse > tolerance:
+                regressions.append((mode, metric, before[metric], value, change))
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_report(mode: str, m: dict):
+    print(f"\n[{mode}] {m['runs']} runs, {m['errors']} errors, {m['runs_per_sec']} runs/sec, "
+          f"mean tree {m['tree_size_mean']} nodes")
+    print(f"  run latency   p50 {m['run_seconds_p50']:.3f}s  p95 {m['run_seconds_p95']:.3f}s")
+    print(f"  first event   p50 {m['ttfe_seconds_p50']:.3f}s  p95 {m['ttfe_seconds_p95']:.3f}s")
+    print(f"  SSE bytes/run {m['sse_bytes_per_run']}   CPU/run {m['cpu_seconds_per_run']:.3f}s   "
+          f"peak RSS {m['peak_rss_mb']} MB")
+    print(f"  {'node':<26} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for node, count in m["node_counts"].items():
+        print(f"  {node:<26} {count:>6} {m['node_ms_p50'][node]:>9.1f} {m['node_ms_p95'][node]:>9.1f}")
+    for error in m["error_samples"]:
+        print(f"  error: {error}")
+
+
+async def run_benchmarks(args) -> dict:
+    import agent
+
+    # The agents log progress for every node; keep the report readable
+    if not args.verbose:
+        logging.getLogger("agent").setLevel(logging.WARNING)
+
+    def quiet():
+        return contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+
+    results = {}
+    if args.mode in ("graph", "both"):
+        with quiet():
+            agent.initialize_agents()
+        if not agent.agents:
+            raise SystemExit("Agent initialization failed; rerun with --verbose")
+        graph = agent.build_graph()
+        results["graph"] = await measure(lambda p: run_graph_once(graph, p, args.max_nodes), args, quiet)
+    if args.mode in ("api", "both"):
+        with quiet():
+            server = running_server()
+            port = await server.__aenter__()
+        try:
+            results["api"] = await measure(lambda p: run_api_once(port, p, args.max_nodes), args, quiet)
+        finally:
+            with quiet():
+                await server.__aexit__(None, None, None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["graph", "api", "both"], default="graph")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-nodes", type=int, default=30, help="RunBudget.max_nodes per run (tree size)")
+    add_fake_provider_args(parser)
+    parser.add_argument("--out", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression (0.15 = 15%%)")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' own output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="graph-bench-") as workdir:
+        configure_environment(args, workdir)
+        results = asyncio.run(run_benchmarks(args))
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "verbose")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "commit": git_commit()},
+        "results": results,
+    }
+    for mode, metrics in results.items():
+        print_report(mode, metrics)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            print("\nWarning: baseline was recorded with a different configuration")
+        regressions = compare(baseline, report, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for mode, metric, before, after, change in regressions:
+                print(f"  [{mode}] {metric}: {before} -> {after} ({change:+.1%})")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Import-time profile
+
+Imports a module in a fresh interpreter with `python -X importtime` and
+reports where the time goes: the slowest individual imports and the total per
+top-level package. Use it to check that importing the server stays cheap and
+that heavy dependencies are only pulled in when first used.
+
+Usage:
+    python benchmarks/import_profile.py [module] [--top 25] [--json out.json]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(module: str) -> list:
+    """Runs the import and returns [(name, self_us, cumulative_us, depth)] in import order."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:], file=sys.stderr)
+        raise SystemExit(f"Importing {module} failed")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def summarise(entries: list, top: int) -> dict:
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+    total_us = sum(self_us for _, self_us, _, _ in entries)
+    slowest = sorted(entries, key=lambda e: -e[2])[:top]
+    return {
+        "total_seconds": round(total_us / 1e6, 3),
+        "modules": len(entries),
+        "slowest_imports": [{"module": n, "cumulative_ms": round(c / 1000, 1), "self_ms": round(s / 1000, 1)}
+                            for n, s, c, _ in slowest],
+        "packages": [{"package": p, "ms": round(us / 1000, 1)}
+                     for p, us in sorted(by_package.items(), key=lambda x: -x[1])[:top]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("module", nargs="?", default="agent")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = summarise(profile_imports(args.module), args.top)
+    report["module"] = args.module
+
+    print(f"import {args.module}: {report['total_seconds']:.3f}s across {report['modules']} modules\n")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for entry in report["slowest_imports"]:
+        print(f"{entry['cumulative_ms']:>14.1f} {entry['self_ms']:>8.1f}  {entry['module']}")
+    print(f"\n{'ms':>14}  package")
+    for entry in report["packages"]:
+        print(f"{entry['ms']:>14.1f}  {entry['package']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
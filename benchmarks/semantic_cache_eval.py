@@ -0,0 +1,80 @@
+"""
+Semantic cache evaluation
+
+Sweeps SEMANTIC_CACHE_MAX_DISTANCE over labelled (original, edited) hypothesis
+pairs and reports, per threshold, how often an edit would reuse the cached
+result (hit rate) and how often that reuse was correct (precision). Pick the
+largest distance whose false-reuse rate you can live with.
+
+Usage:
+    python benchmarks/semantic_cache_eval.py [pairs.jsonl] [--thresholds 0.02,0.05,0.08]
+
+Each line of the pairs file is {"original": ..., "edited": ..., "equivalent": bool},
+where `equivalent` says whether the original's breakdown is still right for the edit.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+
+DEFAULT_PAIRS = os.path.join(os.path.dirname(__file__), "semantic_cache_pairs.jsonl")
+DEFAULT_THRESHOLDS = "0.02,0.04,0.06,0.08,0.10,0.15,0.20"
+
+
+def load_pairs(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def cosine_distances(embeddings, pairs: list) -> list:
+    originals = np.asarray(embeddings.embed_documents([p["original"] for p in pairs]), dtype=np.float32)
+    edits = np.asarray(embeddings.embed_documents([p["edited"] for p in pairs]), dtype=np.float32)
+    originals /= np.linalg.norm(originals, axis=1, keepdims=True)
+    edits /= np.linalg.norm(edits, axis=1, keepdims=True)
+    return list(1.0 - np.sum(originals * edits, axis=1))
+
+
+def evaluate(distances: list, labels: list, threshold: float) -> dict:
+    reused = [d <= threshold for d in distances]
+    hits = sum(reused)
+    correct = sum(1 for r, eq in zip(reused, labels) if r and eq)
+    equivalent = sum(labels)
+    return {
+        "threshold": threshold,
+        "hit_rate": hits / len(labels),
+        "precision": correct / hits if hits else 1.0,
+        "recall": correct / equivalent if equivalent else 0.0,
+        "false_reuses": hits - correct,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pairs", nargs="?", default=DEFAULT_PAIRS)
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--model", default="text-embedding-3-small")
+    args = parser.parse_args()
+
+    load_dotenv()
+    pairs = load_pairs(args.pairs)
+    distances = cosine_distances(OpenAIEmbeddings(model=args.model), pairs)
+    labels = [bool(p["equivalent"]) for p in pairs]
+
+    print(f"{len(pairs)} pairs ({sum(labels)} equivalent), model {args.model}\n")
+    for pair, distance in sorted(zip(pairs, distances), key=lambda x: x[1]):
+        mark = "=" if pair["equivalent"] else "x"
+        print(f"  {distance:.3f} {mark} {pair['edited'][:70]}")
+
+    print(f"\n{'max distance':>12} {'hit rate':>9} {'precision':>10} {'recall':>7} {'false reuses':>13}")
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        r = evaluate(distances, labels, threshold)
+        print(f"{r['threshold']:>12.3f} {r['hit_rate']:>9.0%} {r['precision']:>10.0%} {r['recall']:>7.0%} {r['false_reuses']:>13}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+SSE serialization microbenchmark
+
+Measures the CPU cost of turning one graph update into an SSE frame, the work
+done for every event of every run, on synthetic hypothesis trees of growing
+size. Compares the previous path (`_to_jsonable` over the update, then
+`json.dumps` of the payload) with agent_helpers.serialize on each available
+backend (stdlib json, and orjson when installed).
+
+Usage:
+    python benchmarks/serialize_benchmark.py [--nodes 100 1000 5000] [--events 200] [--json out.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from dataclasses import asdict, is_dataclass
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from agent_helpers.serialize import BACKENDS  # noqa: E402
+
+
+def legacy_to_jsonable(obj):
+    """The converter agent.py applied to every state update before this module existed."""
+    if obj is None:
+        return None
+    if isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return {k: legacy_to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [legacy_to_jsonable(v) for v in obj]
+    if hasattr(obj, "model_dump") and callable(getattr(obj, "model_dump")):
+        return legacy_to_jsonable(obj.model_dump())
+    if hasattr(obj, "dict") and callable(getattr(obj, "dict")):
+        return legacy_to_jsonable(obj.dict())
+    if is_dataclass(obj):
+        return legacy_to_jsonable(asdict(obj))
+    return str(obj)
+
+
+def make_tree(size: int) -> list:
+    """A breadth-first tree with three children per node and realistic text lengths."""
+    tree = []
+    for i in range(size):
+        node_id = "1" if i == 0 else f"{tree[(i - 1) // 3]['id']}.{(i - 1) % 3 + 1}"
+        parent_id = "0" if i == 0 else tree[(i - 1) // 3]["id"]
+        tree.append({
+            "id": node_id,
+            "text": f"Hypothesis {node_id}: pricing pressure in segment {i % 7} is eroding gross margin",
+            "reasoning": "Recent filings and analyst notes point to discounting by two competitors. " * 3,
+            "status": "pending",
+            "parent_id": parent_id,
+            "children_ids": [f"{node_id}.{k}" for k in (1, 2, 3) if 3 * i + k < size],
+            "is_leaf": 3 * i + 1 >= size,
+            "depth": node_id.count("."),
+            "tools_used": ["Web Search", "RAG"],
+            "confidence": 0.72,
+        })
+    return tree
+
+
+def make_update(tree: list) -> dict:
+    return {
+        "hypothesis_tree": tree,
+        "nodes_to_process": [{"id": h["id"], "action": "breakdown", "priority": 0.5} for h in tree[-20:]],
+        "last_completed_item_id": tree[-1]["id"],
+        "explainability_log": ["I'm searching for specific details about the latest hypothesis."],
+    }
+
+
+def build_payload(update: dict) -> dict:
+    """Same shape as agent.build_event_payload, without the Cosmos save."""
+    completed_id = update.get("last_completed_item_id")
+    return {
+        "hypothesis_tree": update.get("hypothesis_tree") or [],
+        "explainability_log": list(update.get("explainability_log") or []) + [f"Step: breakdown_hypothesis for {completed_id}"],
+        "last_completed_item_id": completed_id,
+        "activity": {"node": "breakdown_hypothesis", "item_id": completed_id, "status": "done"},
+        "run_id": "00000000-0000-0000-0000-000000000000",
+    }
+
+
+def encoders() -> dict:
+    def legacy(update):
+        return json.dumps(build_payload(legacy_to_jsonable(update)))
+
+    paths = {"legacy": legacy}
+    for name, (dumps, _) in BACKENDS.items():
+        paths[name] = lambda update, dumps=dumps: dumps(build_payload(update))
+    return paths
+
+
+def measure(encode, update: dict, events: int) -> dict:
+    frame = encode(update)
+    started_cpu, started = time.process_time(), time.perf_counter()
+    for _ in range(events):
+        encode(update)
+    cpu = time.process_time() - started_cpu
+    wall = time.perf_counter() - started
+    return {"cpu_us_per_event": round(cpu / events * 1e6, 1), "wall_us_per_event": round(wall / events * 1e6, 1),
+            "frame_bytes": len(frame.encode())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[100, 1000, 5000], help="Tree sizes to encode")
+    parser.add_argument("--events", type=int, default=200, help="Encodes timed per tree size and path")
+    parser.add_argument("--json", help="Write results JSON here")
+    args = parser.parse_args()
+
+    paths = encoders()
+    results = {}
+    print(f"{'nodes':>6}  {'path':<8} {'CPU us/event':>13} {'wall us/event':>14} {'frame KB':>9} {'speedup':>8}")
+    for size in args.nodes:
+        update = make_update(make_tree(size))
+        # Fewer repetitions on big trees keep the run short; per-event numbers stay comparable
+        events = max(10, args.events * 100 // max(size, 100))
+        rows = {name: measure(encode, update, events) for name, encode in paths.items()}
+        baseline = rows["legacy"]["cpu_us_per_event"]
+        for name, row in rows.items():
+            row["speedup"] = round(baseline / row["cpu_us_per_event"], 2) if row["cpu_us_per_event"] else None
+            print(f"{size:>6}  {name:<8} {row['cpu_us_per_event']:>13.1f} {row['wall_us_per_event']:>14.1f} "
+                  f"{row['frame_bytes'] / 1024:>9.1f} {row['speedup']:>7.2f}x")
+        results[size] = rows
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
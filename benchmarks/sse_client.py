@@ -0,0 +1,155 @@
+"""
+Minimal SSE client for benchmarks
+
+A dependency-free asyncio HTTP/1.1 client that POSTs JSON and reads a
+`text/event-stream` response, timestamping every event as it arrives. It
+decodes chunked transfer encoding (and gzip / brotli content encoding) itself,
+so the measured timings are the server's, not an HTTP library's buffering.
+"""
+
+import json
+import time
+import zlib
+import asyncio
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@dataclass
+class SSEResult:
+    status: int = 0
+    headers: dict = field(default_factory=dict)
+    # (seconds since the request was sent, event data)
+    events: List[Tuple[float, str]] = field(default_factory=list)
+    # On the wire, i.e. compressed when the server compressed
+    bytes_received: int = 0
+    heartbeats: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status == 200
+
+    @property
+    def time_to_first_event(self) -> Optional[float]:
+        return self.events[0][0] if self.events else None
+
+    def payloads(self) -> List[Tuple[float, dict]]:
+        """Events whose data is a JSON object, decoded."""
+        decoded = []
+        for at, data in self.events:
+            if data.startswith("{"):
+                try:
+                    decoded.append((at, json.loads(data)))
+                except ValueError:
+                    pass
+        return decoded
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> Tuple[int, dict]:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed before response")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return status, headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _body_chunks(reader: asyncio.StreamReader, headers: dict):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+    elif "content-length" in headers:
+        yield await reader.readexactly(int(headers["content-length"]))
+    else:
+        while chunk := await reader.read(65536):
+            yield chunk
+
+
+def _decoder(headers: dict):
+    encoding = headers.get("content-encoding", "").lower()
+    if encoding == "gzip":
+        return zlib.decompressobj(31).decompress
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("server sent brotli but the brotli package is not installed")
+        return brotli.Decompressor().process
+    return None
+
+
+async def request_json(host: str, port: int, method: str, path: str, body: dict = None, timeout: float = 10) -> Tuple[int, dict]:
+    """Plain request/response helper (health checks, small API calls)."""
+    result = await stream_sse(host, port, path, body, timeout=timeout, method=method, raw=True)
+    if result.error:
+        raise ConnectionError(result.error)
+    text = "".join(data for _, data in result.events)
+    return result.status, json.loads(text) if text else {}
+
+
+async def stream_sse(host: str, port: int, path: str, body: dict = None, timeout: float = 300,
+                     method: str = "POST", headers: dict = None, raw: bool = False) -> SSEResult:
+    """
+    Sends the request and collects the SSE events until the server closes the
+    stream (or `timeout` passes). With `raw`, the body is returned undecoded as one event.
+    """
+    result = SSEResult()
+    started = time.perf_counter()
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}:{port}", "Connection: close",
+                 "Accept: text/event-stream", f"Content-Length: {len(payload)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await writer.drain()
+
+        async def consume():
+            result.status, result.headers = await _read_headers(reader)
+            buffer = b""
+            decode = _decoder(result.headers)
+            async for chunk in _body_chunks(reader, result.headers):
+                result.bytes_received += len(chunk)
+                buffer += decode(chunk) if decode else chunk
+                if raw:
+                    continue
+                while b"\n\n" in buffer:
+                    frame, buffer = buffer.split(b"\n\n", 1)
+                    if frame.startswith(b":"):
+                        result.heartbeats += 1
+                        continue
+                    data = "\n".join(line[5:].lstrip() for line in frame.decode().split("\n") if line.startswith("data:"))
+                    if data:
+                        result.events.append((time.perf_counter() - started, data))
+            if raw and buffer:
+                result.events.append((time.perf_counter() - started, buffer.decode()))
+
+        await asyncio.wait_for(consume(), timeout)
+    except asyncio.TimeoutError:
+        result.error = f"timed out after {timeout:.0f}s"
+    except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.elapsed = time.perf_counter() - started
+        if writer is not None:
+            writer.close()
+    return result
@@ -0,0 +1,328 @@
+"""
+SSE load test
+
+Opens N concurrent POST /run_agent streams against one server on fake
+providers and steps N up to find where latency degrades. For each
+(tree size, restart ratio, concurrency) it reports:
+
+- time to first event (TTFE) and total run time, p50/p95
+- gaps between consecutive events of a stream, p50/p95/max
+- server event loop lag from GET /stats/loop, and /health/live round trip
+- error rate (HTTP errors, 429 queue-full, timeouts, streams without [DONE])
+
+The result is a capacity curve: the highest concurrency that still meets the
+TTFE objective and error budget, per workload. By default a single uvicorn
+worker is started as a subprocess with FAKE_PROVIDERS=1; --url points the
+test at a server you started yourself (it must run with FAKE_PROVIDERS=1).
+
+Usage:
+    python benchmarks/sse_load.py [--concurrency 1,2,4,8,16] [--tree-sizes 10,30]
+        [--restart-ratios 0,0.5] [--slo-ttfe-ms 1000] [--out curve.json] [--csv curve.csv]
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from urllib.parse import urlparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.sse_client import request_json, stream_sse
+from benchmarks.graph_benchmark import (
+    PROBLEMS, PROVIDER_SECRETS, add_fake_provider_args, fake_provider_env, free_port, git_commit, percentile,
+)
+
+HEALTH_PROBE_INTERVAL_SECONDS = 0.25
+SERVER_START_TIMEOUT_SECONDS = 120
+
+
+def parse_list(text: str, cast) -> list:
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+
+# --- Server under test ---
+def start_server(args, workdir: str, port: int) -> subprocess.Popen:
+    env = {k: v for k, v in os.environ.items() if k not in PROVIDER_SECRETS}
+    env.update(fake_provider_env(args, workdir))
+    env["WEB_CONCURRENCY"] = "1"
+    if args.max_concurrent_runs:
+        env["MAX_CONCURRENT_RUNS"] = str(args.max_concurrent_runs)
+    log = open(os.path.join(workdir, "server.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "agent:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_ready(host: str, port: int, process: subprocess.Popen = None):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (code {process.returncode})")
+        try:
+            status, body = await request_json(host, port, "GET", "/health/ready")
+            if status == 200:
+                return
+            if body.get("stage") == "failed":
+                raise RuntimeError(f"Server failed to initialize: {body.get('error')}")
+        except ConnectionError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+# --- Workload ---
+def is_restart(index: int, ratio: float) -> bool:
+    """Spreads restarts evenly: request i is a restart when the running quota ticks over."""
+    return int((index + 1) * ratio) > int(index * ratio)
+
+
+async def seed_run(host: str, port: int, problem: str, tree_size: int) -> str:
+    """A completed run whose checkpointed tree restarts branch from (by base_run_id)."""
+    result = await stream_sse(host, port, "/run_agent", {"problem_statement": problem, "budget": {"max_nodes": tree_size}})
+    run_id = result.headers.get("x-run-id")
+    if not result.ok or not run_id:
+        raise RuntimeError(f"Seed run failed: {result.error or result.status}")
+    return run_id
+
+
+def classify_error(result) -> str:
+    if result.error:
+        return "timeout" if "timed out" in result.error else "connection"
+    if result.status == 429:
+        return "queue_full"
+    if result.status != 200:
+        return f"http_{result.status}"
+    # Failed and cancelled runs end with a terminal "error" / "cancelled" activity
+    final = {(payload.get("activity") or {}).get("node") for _, payload in result.payloads()[-2:]}
+    if "error" in final:
+        return "run_error"
+    if "cancelled" in final:
+        return "cancelled"
+    if not any(data == "[DONE]" for _, data in result.events):
+        return "incomplete"
+    return ""
+
+
+async def probe_health(host: str, port: int, stop: asyncio.Event, rtts: list):
+    """Round trip of a trivial endpoint while the load runs: what a new request waits for."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await request_json(host, port, "GET", "/health/live", timeout=30)
+            rtts.append((time.perf_counter() - started) * 1000)
+        except ConnectionError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), HEALTH_PROBE_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_level(host: str, port: int, args, tree_size: int, restart_ratio: float,
+                    concurrency: int, seeds: dict) -> dict:
+    """Closed loop: `concurrency` clients issue requests back to back until the level's quota is used."""
+    total = max(args.min_requests, concurrency * args.requests_per_client)
+    next_index = iter(range(total))
+    results = []
+
+    async def client():
+        for index in next_index:
+            problem = PROBLEMS[index % len(PROBLEMS)]
+            body = {"problem_statement": f"{problem} [c{concurrency} #{index}]", "budget": {"max_nodes": tree_size}}
+            restart = is_restart(index, restart_ratio)
+            if restart:
+                body.update(problem_statement=problem, base_run_id=seeds[(problem, tree_size)],
+                            restart_node_id="1", restart_mode=args.restart_mode)
+            result = await stream_sse(host, port, "/run_agent", body, timeout=args.timeout)
+            results.append((restart, result))
+
+    await request_json(host, port, "GET", "/stats/loop?reset=true")
+    stop, rtts = asyncio.Event(), []
+    prober = asyncio.create_task(probe_health(host, port, stop, rtts))
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await prober
+    _, loop = await request_json(host, port, "GET", "/stats/loop")
+
+    errors = Counter()
+    ttfe, seconds, gaps, sse_bytes = [], [], [], []
+    for _, result in results:
+        kind = classify_error(result)
+        if kind:
+            errors[kind] += 1
+            continue
+        ttfe.append(result.time_to_first_event * 1000)
+        seconds.append(result.elapsed)
+        sse_bytes.append(result.bytes_received)
+        times = [at for at, _ in result.events]
+        gaps.extend((b - a) * 1000 for a, b in zip(times, times[1:]))
+
+    completed = len(results) - sum(errors.values())
+    return {
+        "tree_size": tree_size,
+        "restart_ratio": restart_ratio,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "restarts": sum(1 for restart, _ in results if restart),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else 0.0,
+        "error_kinds": dict(errors),
+        "runs_per_sec": round(completed / wall, 3) if wall else 0.0,
+        "ttfe_ms_p50": round(percentile(ttfe, 50), 1),
+        "ttfe_ms_p95": round(percentile(ttfe, 95), 1),
+        "run_seconds_p50": round(percentile(seconds, 50), 3),
+        "run_seconds_p95": round(percentile(seconds, 95), 3),
+        "gap_ms_p50": round(percentile(gaps, 50), 1),
+        "gap_ms_p95": round(percentile(gaps, 95), 1),
+        "gap_ms_max": round(max(gaps), 1) if gaps else 0.0,
+        "loop_lag_ms_p95": loop.get("p95_ms", 0.0),
+        "loop_lag_ms_max": loop.get("max_ms", 0.0),
+        "health_rtt_ms_p95": round(percentile(rtts, 95), 1),
+        "sse_bytes_per_run": round(sum(sse_bytes) / len(sse_bytes)) if sse_bytes else 0,
+    }
+
+
+def capacity(levels: list, slo_ttfe_ms: float, max_error_rate: float) -> list:
+    """Per workload, the highest concurrency whose p95 TTFE and error rate are within bounds."""
+    curves = {}
+    for level in levels:
+        curves.setdefault((level["tree_size"], level["restart_ratio"]), []).append(level)
+    summary = []
+    for (tree_size, ratio), points in curves.items():
+        passing = [p["concurrency"] for p in points
+                   if p["ttfe_ms_p95"] <= slo_ttfe_ms and p["error_rate"] <= max_error_rate]
+        best = max((p for p in points if p["concurrency"] in passing), key=lambda p: p["concurrency"], default=None)
+        summary.append({
+            "tree_size": tree_size,
+            "restart_ratio": ratio,
+            "max_concurrency": best["concurrency"] if best else 0,
+            "runs_per_sec_at_max": best["runs_per_sec"] if best else 0.0,
+            "saturated": len(passing) < len(points),
+        })
+    return summary
+
+
+COLUMNS = [("concurrency", "conc"), ("runs_per_sec", "runs/s"), ("ttfe_ms_p50", "ttfe p50"),
+           ("ttfe_ms_p95", "ttfe p95"), ("gap_ms_p95", "gap p95"), ("gap_ms_max", "gap max"),
+           ("loop_lag_ms_p95", "lag p95"), ("loop_lag_ms_max", "lag max"), ("health_rtt_ms_p95", "live p95"),
+           ("run_seconds_p95", "run p95 s"), ("error_rate", "err rate")]
+
+
+def print_level(level: dict, header: bool):
+    if header:
+        print(f"\n[tree {level['tree_size']}, restarts {level['restart_ratio']:.0%}] (times in ms unless noted)")
+        print("  " + " ".join(f"{title:>9}" for _, title in COLUMNS))
+    print("  " + " ".join(f"{level[key]:>9}" for key, _ in COLUMNS)
+          + (f"  {level['error_kinds']}" if level["error_kinds"] else ""))
+
+
+async def run_load_test(args, host: str, port: int) -> list:
+    tree_sizes = parse_list(args.tree_sizes, int)
+    ratios = parse_list(args.restart_ratios, float)
+    levels = parse_list(args.concurrency, int)
+
+    seeds = {}
+    if any(ratios):
+        for tree_size in tree_sizes:
+            for problem in PROBLEMS:
+                seeds[(problem, tree_size)] = await seed_run(host, port, problem, tree_size)
+
+    results = []
+    for tree_size in tree_sizes:
+        for ratio in ratios:
+            for i, concurrency in enumerate(levels):
+                level = await run_level(host, port, args, tree_size, ratio, concurrency, seeds)
+                results.append(level)
+                print_level(level, header=i == 0)
+                if args.stop_on_saturation and (level["ttfe_ms_p95"] > args.slo_ttfe_ms
+                                                or level["error_rate"] > args.max_error_rate):
+                    break
+    return results
+
+
+async def run_with_server(args) -> list:
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+        await wait_until_ready(host, port)
+        return await run_load_test(args, host, port)
+
+    with tempfile.TemporaryDirectory(prefix="sse-load-") as workdir:
+        port = free_port()
+        process = start_server(args, workdir, port)
+        try:
+            await wait_until_ready("127.0.0.1", port, process)
+            return await run_load_test(args, "127.0.0.1", port)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            if process.returncode not in (0, -15) or args.verbose:
+                with open(os.path.join(workdir, "server.log")) as f:
+                    print("\n--- server log (tail) ---\n" + "".join(f.readlines()[-40:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Test a running server (started with FAKE_PROVIDERS=1) instead of spawning one")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Concurrent streams per level")
+    parser.add_argument("--tree-sizes", default="10,30", help="RunBudget.max_nodes values")
+    parser.add_argument("--restart-ratios", default="0,0.5", help="Share of requests that restart a previous run")
+    parser.add_argument("--restart-mode", choices=["full", "incremental"], default="full")
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    parser.add_argument("--min-requests", type=int, default=8, help="Lower bound on requests per level")
+    parser.add_argument("--max-concurrent-runs", type=int, help="MAX_CONCURRENT_RUNS for the spawned server")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-stream timeout in seconds")
+    parser.add_argument("--slo-ttfe-ms", type=float, default=1000, help="p95 time-to-first-event objective")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--stop-on-saturation", action="store_true", help="Skip higher levels once a workload saturates")
+    add_fake_provider_args(parser)
+    parser.add_argument("--out", help="Write the curve as JSON")
+    parser.add_argument("--csv", help="Write one row per level as CSV")
+    parser.add_argument("--verbose", action="store_true", help="Print the server log afterwards")
+    args = parser.parse_args()
+
+    levels = asyncio.run(run_with_server(args))
+    curve = capacity(levels, args.slo_ttfe_ms, args.max_error_rate)
+
+    print(f"\nCapacity (p95 TTFE <= {args.slo_ttfe_ms:.0f}ms, errors <= {args.max_error_rate:.0%}):")
+    for point in curve:
+        suffix = "" if point["saturated"] else " (not saturated; try higher concurrency)"
+        print(f"  tree {point['tree_size']:>4}, restarts {point['restart_ratio']:>4.0%}: "
+              f"{point['max_concurrency']} streams, {point['runs_per_sec_at_max']} runs/sec{suffix}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "config": {k: v for k, v in vars(args).items() if k not in ("out", "csv", "verbose")},
+                "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                "cpus": os.cpu_count(), "commit": git_commit()},
+                "levels": levels,
+                "capacity": curve,
+            }, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[k for k in levels[0] if k != "error_kinds"], extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(levels)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
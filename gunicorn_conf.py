@@ -0,0 +1,61 @@
+"""
+Multi-worker serving
+
+    gunicorn -c gunicorn_conf.py agent:app
+
+Runs one uvicorn worker per core (override with WEB_CONCURRENCY). Each worker
+imports agent.py (cheap) and initializes its agents in the background. Workers
+share the memory-mapped FAISS index through the page cache, and embeddings,
+search results and (optionally) completions through the shared cache tier.
+Provider rate limits are divided evenly between workers.
+
+All workers use the same run database (in WAL mode). A run executes on the
+worker that started it; /runs/{id}/events on another worker replays the
+events persisted so far, then follows the run by polling the database until
+the owner finishes it, and /runs/{id}/cancel on any worker cancels it.
+Interrupted runs are resumed by whichever worker starts next, or notices the
+owner has died while following the run, unless that owner is still alive.
+"""
+
+import os
+import multiprocessing
+
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Rate limits and admission are split per worker based on this
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# Not preloaded: RunManager opens SQLite connections at import, which must not cross a fork
+preload_app = False
+
+# SSE streams stay open for the whole run; don't let the arbiter kill busy workers
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 75
+
+# Restart workers now and then to bound memory growth, staggered so they don't all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+
+# Workers write Prometheus samples to files here so /metrics aggregates all of them.
+# Must be set before any worker imports prometheus_client.
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"prometheus-{os.getpid()}")
+
+
+def on_starting(server):
+    import shutil
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    except ImportError:
+        pass
@@ -0,0 +1,122 @@
+"""
+JSON extraction from LLM completions.
+
+Streamed array items must come out the same however the completion is
+chunked, truncated or almost-JSON output must be repaired locally, and
+chains fall back to parsing free text when no schema is bound.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from agent_helpers import schemas
+from agent_helpers.json_stream import IncrementalJSONParser, parse_json_from_string, repair_json
+from agent_helpers.schemas import Breakdown, llm_chain, structured_result
+
+COMPLETION = (
+    'Here is the breakdown:\n```json\n{"sub_hypotheses": ['
+    '{"text": "Prices {rise}", "reasoning": "a \\"quoted\\" reason"}, '
+    '{"text": "Demand falls", "reasoning": "nested [1, {\\"x\\": 2}]"}'
+    ']}\n```'
+)
+ITEMS = json.loads(COMPLETION[COMPLETION.index("{"):COMPLETION.rindex("}") + 1])["sub_hypotheses"]
+
+
+def feed_all(parser: IncrementalJSONParser, chunks) -> list:
+    return [item for chunk in chunks for item in parser.feed(chunk)]
+
+
+class IncrementalJSONParserTest(unittest.TestCase):
+    def test_every_split_point(self):
+        for split in range(1, len(COMPLETION)):
+            parser = IncrementalJSONParser("sub_hypotheses")
+            self.assertEqual(feed_all(parser, [COMPLETION[:split], COMPLETION[split:]]), ITEMS, split)
+
+    def test_one_character_at_a_time(self):
+        parser = IncrementalJSONParser("sub_hypotheses")
+        self.assertEqual(feed_all(parser, COMPLETION), ITEMS)
+        self.assertEqual(parser.result(), {"sub_hypotheses": ITEMS})
+
+    def test_items_emitted_as_they_close(self):
+        parser = IncrementalJSONParser("sub_hypotheses")
+        first_end = COMPLETION.index("}, ") + 1
+        self.assertEqual(parser.feed(COMPLETION[:first_end]), ITEMS[:1])
+        self.assertEqual(parser.feed(COMPLETION[first_end:]), ITEMS[1:])
+
+    def test_other_keys_are_ignored(self):
+        parser = IncrementalJSONParser("sub_hypotheses")
+        text = '{"notes": [{"text": "not me"}], "sub_hypotheses": [{"text": "me"}]}'
+        self.assertEqual(feed_all(parser, [text[:20], text[20:]]), [{"text": "me"}])
+
+    def test_truncated_completion(self):
+        parser = IncrementalJSONParser("sub_hypotheses")
+        cut = COMPLETION.index('{"text": "Demand') + 20
+        self.assertEqual(feed_all(parser, [COMPLETION[:cut]]), ITEMS[:1])
+        result = parser.result()
+        self.assertEqual(result["sub_hypotheses"][0], ITEMS[0])
+        self.assertEqual(len(result["sub_hypotheses"]), 2)
+
+
+class RepairJSONTest(unittest.TestCase):
+    def test_truncated_object_is_closed(self):
+        self.assertEqual(json.loads(repair_json('{"a": [1, {"b": "unfinished')), {"a": [1, {"b": "unfinished"}]})
+
+    def test_trailing_commas_and_python_literals(self):
+        self.assertEqual(json.loads(repair_json('{"a": True, "b": [None, False,],}')),
+                         {"a": True, "b": [None, False]})
+
+    def test_prose_and_fences_are_dropped(self):
+        self.assertEqual(json.loads(repair_json('Sure! ```json\n{"a": 1}\n``` Hope this helps.')), {"a": 1})
+
+    def test_smart_quotes_as_delimiters(self):
+        self.assertEqual(json.loads(repair_json("{“text”: “Prices rise”}")),
+                         {"text": "Prices rise"})
+
+    def test_smart_quotes_inside_a_string_are_kept(self):
+        text = '{"text": "The “best” case", "reasoning": "ok"}'
+        self.assertEqual(json.loads(repair_json(text)), {"text": "The “best” case", "reasoning": "ok"})
+
+    def test_unparseable_text_reports_failure(self):
+        data = parse_json_from_string("no json here", source="test")
+        self.assertEqual(data["error"], "Failed to parse JSON")
+        self.assertEqual(data["raw_text"], "no json here")
+
+
+class LLMChainTest(unittest.TestCase):
+    prompt = ChatPromptTemplate.from_template("{question}")
+
+    def test_text_mode_parses_the_completion(self):
+        llm = FakeListChatModel(responses=[COMPLETION])
+        with mock.patch.object(schemas, "LLM_OUTPUT_MODE", "text"):
+            chain = llm_chain(llm, self.prompt, Breakdown)
+        self.assertEqual(chain.invoke({"question": "q"}), {"sub_hypotheses": ITEMS})
+
+    def test_structured_mode_without_schema_uses_text(self):
+        # FakeListChatModel cannot bind a schema, so this only works on the text path
+        llm = FakeListChatModel(responses=['{"classification": "leaf",}'])
+        with mock.patch.object(schemas, "LLM_OUTPUT_MODE", "structured"):
+            chain = llm_chain(llm, self.prompt)
+        self.assertEqual(chain.invoke({"question": "q"}), {"classification": "leaf"})
+
+    def test_structured_parse_failure_is_repaired_from_raw_text(self):
+        output = {"raw": AIMessage(content=COMPLETION), "parsed": None, "parsing_error": ValueError("bad")}
+        self.assertEqual(structured_result(output, Breakdown), {"sub_hypotheses": ITEMS})
+
+    def test_structured_repair_that_fails_validation(self):
+        output = {"raw": AIMessage(content='{"sub_hypotheses": "none"}'), "parsed": None, "parsing_error": ValueError()}
+        self.assertEqual(structured_result(output, Breakdown)["error"], "Failed to parse Breakdown")
+
+
+if __name__ == "__main__":
+    unittest.main()
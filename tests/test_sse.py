@@ -0,0 +1,96 @@
+"""
+Coalescing of a backlogged SSE event log.
+
+A folded backlog must show the client what replaying it frame by frame
+would have: every log line, the latest tree, the provisional nodes still
+current, [DONE], and an id that resumes right after the last event covered.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_helpers.sse import DONE_EVENT, _merge, coalesce
+
+
+def update(seq: int, log: str, tree=None, completed=None):
+    payload = {"explainability_log": [log], "hypothesis_tree": tree or [],
+               "activity": {"node": f"node{seq}", "status": "done"}}
+    if completed:
+        payload["last_completed_item_id"] = completed
+    return seq, json.dumps(payload)
+
+
+def draft(seq: int, log: str, *node_ids: str):
+    payload = {"explainability_log": [log], "hypothesis_tree": [],
+               "provisional_nodes": [{"id": node_id} for node_id in node_ids]}
+    return seq, json.dumps(payload)
+
+
+def tree(*node_ids: str):
+    return [{"id": node_id} for node_id in node_ids]
+
+
+def decoded(events):
+    return [(seq, data if data == DONE_EVENT else json.loads(data)) for seq, data in events]
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_updates_fold_into_one_frame(self):
+        events = [update(1, "a", tree("1")), update(2, "b"), update(3, "c", tree("1", "1.1"), completed="1")]
+        [(seq, frame)] = decoded(coalesce(events))
+        self.assertEqual(seq, 3)
+        self.assertEqual(frame["explainability_log"], ["a", "b", "c"])
+        self.assertEqual(frame["hypothesis_tree"], tree("1", "1.1"))
+        self.assertEqual(frame["last_completed_item_id"], "1")
+        self.assertEqual(frame["coalesced"], 3)
+
+    def test_latest_non_empty_tree_wins(self):
+        [(_, frame)] = decoded(coalesce([update(1, "a", tree("1")), update(2, "b")]))
+        self.assertEqual(frame["hypothesis_tree"], tree("1"))
+
+    def test_superseded_drafts_are_dropped_but_their_logs_kept(self):
+        events = [update(1, "a"), draft(2, "drafting", "1.1"), draft(3, "drafting more", "1.2"),
+                  update(4, "b", tree("1", "1.1", "1.2"))]
+        [(seq, frame)] = decoded(coalesce(events))
+        self.assertEqual(seq, 4)
+        self.assertNotIn("provisional_nodes", frame)
+        self.assertEqual(frame["explainability_log"], ["a", "drafting", "drafting more", "b"])
+
+    def test_trailing_drafts_are_merged_after_the_updates(self):
+        events = [update(1, "a"), draft(2, "d1", "1.1"), update(3, "b"), draft(4, "d2", "1.2"), draft(5, "d3", "1.3")]
+        (update_seq, updates), (draft_seq, drafts) = decoded(coalesce(events))
+        self.assertEqual((update_seq, draft_seq), (3, 5))
+        self.assertEqual(updates["explainability_log"], ["a", "d1", "b"])
+        self.assertNotIn("provisional_nodes", updates)
+        self.assertEqual(drafts["explainability_log"], ["d2", "d3"])
+        self.assertEqual(drafts["provisional_nodes"], [{"id": "1.2"}, {"id": "1.3"}])
+
+    def test_done_passes_through_in_order(self):
+        events = [update(1, "a"), draft(2, "d", "1.1"), (3, DONE_EVENT)]
+        self.assertEqual([(seq, data if data == DONE_EVENT else "frame") for seq, data in coalesce(events)],
+                         [(1, "frame"), (2, "frame"), (3, DONE_EVENT)])
+
+    def test_done_alone(self):
+        self.assertEqual(coalesce([(7, DONE_EVENT)]), [(7, DONE_EVENT)])
+
+    def test_frame_ids_stay_increasing(self):
+        events = [update(1, "a"), draft(2, "d", "1.1"), update(3, "b"), draft(4, "d", "1.2"), (5, DONE_EVENT)]
+        seqs = [seq for seq, _ in coalesce(events)]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(seqs[-1], 5)
+
+    def test_merge_keeps_the_last_frames_other_fields(self):
+        seq, merged = _merge([(1, {"activity": {"node": "classify"}}), (2, {"activity": {"node": "breakdown"}})])
+        self.assertEqual(seq, 2)
+        self.assertEqual(merged["activity"], {"node": "breakdown"})
+        self.assertEqual(merged["explainability_log"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
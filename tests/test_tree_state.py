@@ -0,0 +1,103 @@
+"""
+Checkpoint history of the hypothesis tree channel.
+
+Each checkpoint must hold the tree as it was after its own step, including
+when it is read back by a fresh process, for every snapshot cadence.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from typing import Annotated, List, TypedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph import END, START, StateGraph
+
+from agent_helpers.tree import DeltaChannel, merge_tree, replace_tree
+from agent_helpers.types import AgentState, Hypothesis
+
+LEVELS = 6
+
+
+def node(node_id: str, parent_id: str, children_ids=()) -> Hypothesis:
+    return Hypothesis(id=node_id, text=f"Hypothesis {node_id}", reasoning="", status="pending",
+                      parent_id=parent_id, children_ids=list(children_ids), is_leaf=False, depth=node_id.count("."),
+                      tools_used=["Web Search"], confidence=0.5)
+
+
+def expected_trees() -> List[List[str]]:
+    """Node ids after start and after each grow step."""
+    ids, trees = ["1"], [["1"]]
+    for level in range(1, LEVELS):
+        parent = ids[-1]
+        ids = ids + [f"{parent}.1", f"{parent}.2"]
+        trees.append(list(ids))
+    return trees
+
+
+def build(state_type, checkpointer):
+    def start(state):
+        return {"hypothesis_tree": replace_tree([node("1", "0")]), "root_id_offset": 0}
+
+    def grow(state):
+        tree = state["hypothesis_tree"]
+        parent = tree[-1]
+        kids = [node(f"{parent['id']}.{i}", parent["id"]) for i in (1, 2)]
+        patched = dict(parent, children_ids=[k["id"] for k in kids])
+        return {"hypothesis_tree": [patched] + kids, "root_id_offset": state["root_id_offset"] + 1}
+
+    graph = StateGraph(state_type)
+    graph.add_node("start", start)
+    graph.add_node("grow", grow)
+    graph.add_edge(START, "start")
+    graph.add_edge("start", "grow")
+    graph.add_conditional_edges("grow", lambda s: END if s["root_id_offset"] >= LEVELS - 1 else "grow")
+    return graph.compile(checkpointer=checkpointer)
+
+
+class FrequentSnapshotState(TypedDict):
+    hypothesis_tree: Annotated[List[Hypothesis], DeltaChannel(merge_tree, snapshot_frequency=2)] if DeltaChannel else None
+    root_id_offset: int
+
+
+class TreeCheckpointHistoryTest(unittest.IsolatedAsyncioTestCase):
+    async def check_history(self, state_type):
+        path = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite")
+        config = {"configurable": {"thread_id": "t"}}
+
+        async with aiosqlite.connect(path) as conn:
+            graph = build(state_type, AsyncSqliteSaver(conn))
+            async for _ in graph.astream({"problem_statement": "p", "hypothesis_tree": []}, config):
+                pass
+
+        # A fresh connection and graph, as after a restart
+        async with aiosqlite.connect(path) as conn:
+            graph = build(state_type, AsyncSqliteSaver(conn))
+            history = [s async for s in graph.aget_state_history(config)]
+
+        steps = sorted((s for s in history if s.metadata.get("step", -1) >= 1), key=lambda s: s.metadata["step"])
+        actual = [[n["id"] for n in s.values["hypothesis_tree"]] for s in steps]
+        self.assertEqual(actual, expected_trees())
+
+    async def test_agent_state_history(self):
+        await self.check_history(AgentState)
+
+    @unittest.skipIf(DeltaChannel is None, "LangGraph without DeltaChannel")
+    async def test_history_across_snapshots(self):
+        await self.check_history(FrequentSnapshotState)
+
+    def test_merge_does_not_mutate_previous_value(self):
+        before = merge_tree([], [[node("1", "0")]])
+        after = merge_tree(before, [[node("1.1", "1")]])
+        self.assertEqual([n["id"] for n in before], ["1"])
+        self.assertEqual([n["id"] for n in after], ["1", "1.1"])
+
+
+if __name__ == "__main__":
+    unittest.main()